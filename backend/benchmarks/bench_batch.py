@@ -0,0 +1,134 @@
+"""批量检测吞吐量基准：同一组评论分别经 /detect/text 逐条提交和经 /detect/batch 分批提交，比较每秒处理条数
+
+用法（在 backend 目录下运行，需安装 uvicorn 与 httpx，不需要 GPU 与真实模型）：
+    python benchmarks/bench_batch.py [--items 5000] [--batch-size 1000] [--concurrency 32]
+                                     [--rule-backend process] [--llm-latency-ms 50] [--output result.json]
+
+- 评论取自 demo 下的正常与敏感样本行，每条末尾加编号，两轮之间不会命中判定缓存
+- 服务以子进程方式启动 uvicorn main:app，OLLAMA_BASE_URL 指向 loadtest.py 中的模拟 Ollama，
+  规则命中的条目在两个接口上都经同一路径复核
+- /detect/text 以 --concurrency 个并发连接逐条提交；/detect/batch 每批 --batch-size 条、依次提交
+- 报告两种方式的墙钟用时、每秒处理条数与批量接口自身统计的规则阶段用时；--output 写入 JSON
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench_rule_engine import DEMO_DIR, load_sample_lines
+from loadtest import BACKEND_DIR, MockOllama, wait_ready
+
+
+def make_items(count: int, seed: int):
+    lines = (load_sample_lines(os.path.join(DEMO_DIR, "normal_samples"))
+             + load_sample_lines(os.path.join(DEMO_DIR, "sensitive_samples")))
+    rng = random.Random(seed)
+    return [rng.choice(lines) for _ in range(count)]
+
+
+async def run_single(base_url: str, texts, concurrency: int, timeout: float):
+    """逐条提交到 /detect/text，返回 (用时, 失败数)"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    pending = iter(texts)
+    failed = 0
+
+    async def worker(client):
+        nonlocal failed
+        for text in pending:
+            response = await client.post(f"{base_url}/detect/text", json={"text": text})
+            failed += response.status_code != 200
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return time.perf_counter() - start, failed
+
+
+def run_batch(base_url: str, texts, batch_size: int, timeout: float):
+    """分批提交到 /detect/batch，返回 (用时, 失败数, 各批规则阶段用时之和（秒）)"""
+    failed = 0
+    rule_seconds = 0.0
+    with httpx.Client(timeout=timeout) as client:
+        start = time.perf_counter()
+        for offset in range(0, len(texts), batch_size):
+            items = [{"id": str(offset + i), "text": text} for i, text in enumerate(texts[offset:offset + batch_size])]
+            response = client.post(f"{base_url}/detect/batch", json={"items": items})
+            if response.status_code != 200:
+                failed += len(items)
+                continue
+            data = response.json()["data"]
+            failed += sum(item["status"] != "success" for item in data["items"])
+            rule_seconds += data["timing"]["rule_time"] / 1000
+        return time.perf_counter() - start, failed, rule_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=5000, help="评论条数")
+    parser.add_argument("--batch-size", type=int, default=1000, help="/detect/batch 每批条数")
+    parser.add_argument("--concurrency", type=int, default=32, help="/detect/text 并发连接数")
+    parser.add_argument("--rule-backend", default="process", help="被测服务的 RULE_BACKEND")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-parallel", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=20240101)
+    parser.add_argument("--output", help="结果 JSON 写入路径")
+    args = parser.parse_args()
+
+    texts = make_items(args.items, args.seed)
+    mock = MockOllama("127.0.0.1", 0, "qwen2.5:7b-instruct", args.llm_latency_ms, 0, 0, args.llm_parallel,
+                      "random", 0.5, args.seed)
+    mock.start()
+    env = dict(os.environ, OLLAMA_BASE_URL=f"http://127.0.0.1:{mock.port}", OLLAMA_MODEL=mock.model,
+               RULE_BACKEND=args.rule_backend, BATCH_MAX_ITEMS=str(max(args.batch_size, 5000)))
+    env.setdefault("LOG_LEVEL", "WARNING")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url)
+        # 预热：进程池与连接建立不计入用时
+        run_batch(base_url, [f"{text} w{i}" for i, text in enumerate(texts[:args.batch_size])], args.batch_size,
+                  args.timeout)
+        single_seconds, single_failed = asyncio.run(run_single(
+            base_url, [f"{text} t{i}" for i, text in enumerate(texts)], args.concurrency, args.timeout))
+        batch_seconds, batch_failed, rule_seconds = run_batch(
+            base_url, [f"{text} b{i}" for i, text in enumerate(texts)], args.batch_size, args.timeout)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        mock.stop()
+
+    report = {
+        "items": args.items,
+        "rule_backend": args.rule_backend,
+        "llm_calls": dict(mock.stats),
+        "detect_text": {"seconds": round(single_seconds, 3), "failed": single_failed,
+                        "items_per_second": round(args.items / single_seconds, 1),
+                        "concurrency": args.concurrency},
+        "detect_batch": {"seconds": round(batch_seconds, 3), "failed": batch_failed,
+                         "items_per_second": round(args.items / batch_seconds, 1),
+                         "rule_seconds": round(rule_seconds, 3), "batch_size": args.batch_size},
+    }
+    report["speedup"] = round(report["detect_batch"]["items_per_second"] / report["detect_text"]["items_per_second"], 2)
+    print(f"/detect/text : {single_seconds:8.2f}s  {report['detect_text']['items_per_second']:>9} 条/秒  "
+          f"失败 {single_failed}（并发 {args.concurrency}）")
+    print(f"/detect/batch: {batch_seconds:8.2f}s  {report['detect_batch']['items_per_second']:>9} 条/秒  "
+          f"失败 {batch_failed}（每批 {args.batch_size}，规则阶段 {rule_seconds:.2f}s）")
+    print(f"加速比: {report['speedup']}x")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
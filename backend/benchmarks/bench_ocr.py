@@ -0,0 +1,77 @@
+"""OCR 基准测试：对比原串行实现与进程池 OCR 引擎
+
+用法（需安装 tesseract-ocr 及 chi_sim 语言包，在 backend 目录下运行）：
+    python benchmarks/bench_ocr.py [图片路径] [--repeat N]
+
+默认图片为 demo/sensitive_samples/测试ocr功能.png。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytesseract  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from ocr_engine import OCREngine, get_ocr_config  # noqa: E402
+
+DEFAULT_IMAGE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "demo", "sensitive_samples", "测试ocr功能.png"
+)
+
+
+def legacy_ocr(content: bytes) -> str:
+    """原实现：RGB 转换后同步识别，结果为空时再用 --psm 3 串行识别一次"""
+    image = Image.open(BytesIO(content))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    ocr_config = get_ocr_config()
+    text = pytesseract.image_to_string(image, lang=ocr_config['lang'], config=ocr_config['config']).strip()
+    if not text:
+        text = pytesseract.image_to_string(image, lang=ocr_config['lang'], config='--psm 3 --oem 3').strip()
+    return text
+
+
+def summarize(name, times):
+    print(f"{name:<10} 平均 {statistics.mean(times):8.1f}ms  最小 {min(times):8.1f}ms  最大 {max(times):8.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("image", nargs="?", default=DEFAULT_IMAGE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        content = f.read()
+    print(f"图片: {args.image}（{len(content) / 1024:.1f}KB），重复 {args.repeat} 次")
+
+    legacy_times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        legacy_text = legacy_ocr(content)
+        legacy_times.append((time.perf_counter() - start) * 1000)
+
+    engine = OCREngine()
+    await engine.recognize(content)  # 预热进程池
+    engine_times, stats = [], None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        engine_text, stats = await engine.recognize(content)
+        engine_times.append((time.perf_counter() - start) * 1000)
+    engine.shutdown()
+
+    summarize("原实现", legacy_times)
+    summarize("OCR引擎", engine_times)
+    print(f"分阶段用时（最后一次）: {stats}")
+    print(f"原实现识别 {len(legacy_text)} 字符: {legacy_text[:80]!r}")
+    print(f"OCR引擎识别 {len(engine_text)} 字符: {engine_text[:80]!r}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,322 @@
+"""规则匹配引擎基准：词库编译耗时与内存、不同文本长度下的匹配吞吐量与 DFA 复核开销
+
+用法（在 backend 目录下运行，仅依赖标准库，离线、纯 CPU）：
+    python benchmarks/bench_rule_engine.py [--sizes 1000,10000,100000,1000000] [--repeat 5]
+                                           [--output result.json] [--baseline baseline.json] [--tolerance 0.15]
+
+- 词库：word_libraries/*.txt（读取、去重与词库位掩码与 ThreeStepFilter._load_words 一致）
+- 文本：由 demo/normal_samples 与 demo/sensitive_samples 中的样本行按固定随机种子拼接到指定长度
+  - clean：AC 无命中的正常样本行（词库含大量单字、常用词，多数样本行会命中），检测时走容噪 DFA 复核
+  - dense：敏感样本，AC 命中密集，跳过 DFA
+  - noisy：clean 文本中夹杂插入 ASCII 噪声的词库词，AC 无法命中、由容噪 DFA 召回
+- 每种文本按 ThreeStepFilter.detect 的步骤计时（预处理 → AC 扫描与命中换算 → AC 未命中时容噪 DFA），
+  main.py 导入时会挂载静态目录并初始化检测引擎，这里直接调用 rule_engine 中的同一组组件；
+  另对每种文本单独计时一次容噪 DFA（dfa_fallback_ms），即 AC 未命中时需额外付出的开销
+- 编译：从词库构建自动机的耗时与 tracemalloc 峰值内存，以及写入/加载快照的耗时
+
+结果以 JSON 输出（--output），可作为下次运行的 --baseline：吞吐量下降或耗时、内存增长超过 --tolerance 时
+列出退化项并以退出码 1 结束，便于在 CI 中卡住性能回退。同一台机器上的结果才有可比性。
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rule_engine import (  # noqa: E402
+    AutomatonSnapshotStore, CompactACAutomaton, library_fingerprint, text_preprocessor
+)
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+DEFAULT_LIBRARY_DIR = os.path.join(ROOT_DIR, "word_libraries")
+DEMO_DIR = os.path.join(ROOT_DIR, "demo")
+NOISE_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+# 基线比较的指标：(路径, 方向)；higher 表示越大越好
+GATED_METRICS = (
+    ("build.seconds", "lower"),
+    ("build.peak_mb", "lower"),
+    ("build.snapshot_load_seconds", "lower"),
+)
+
+
+def load_libraries(paths):
+    """读取词库并去重，返回 (词表, 词库名列表, 每个词的词库位掩码)"""
+    word_sources = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "r", encoding="utf-8") as f:
+            for word in f:
+                word = word.strip()
+                if word:
+                    word_sources.setdefault(word, set()).add(name)
+    libraries = sorted(os.path.splitext(os.path.basename(path))[0] for path in paths)
+    bits = {name: 1 << i for i, name in enumerate(libraries)}
+    words = list(word_sources)
+    masks = [sum(bits[name] for name in word_sources[word]) for word in words]
+    return words, libraries, masks
+
+
+def load_sample_lines(directory):
+    lines = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            lines.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return lines
+
+
+def ac_clean(automaton, text):
+    return not automaton.find_all(text_preprocessor.preprocess_text(text))
+
+
+def noisy_word(word, rng, noise_chars, pads):
+    """在词的相邻汉字之间插入 1~2 个 ASCII 噪声字符（预处理不会去掉字母数字），
+    首尾各补一个 pads 中的字符，避免与相邻样本行的字拼成新的 AC 命中"""
+    out = [rng.choice(pads), word[0]]
+    for ch in word[1:]:
+        out.append("".join(rng.choice(noise_chars) for _ in range(rng.randint(1, 2))))
+        out.append(ch)
+    out.append(rng.choice(pads))
+    return "".join(out)
+
+
+def build_text(lines, length, rng, inserts=None, insert_every=0):
+    """按随机顺序拼接样本行直到达到 length 个字符；inserts 非空时每约 insert_every 个字符插入一个词"""
+    parts, size, next_insert = [], 0, insert_every
+    while size < length:
+        line = rng.choice(lines)
+        parts.append(line)
+        size += len(line) + 1
+        if inserts and size >= next_insert:
+            word = rng.choice(inserts)
+            parts.append(word)
+            size += len(word) + 1
+            next_insert += insert_every
+    return "\n".join(parts)[:length]
+
+
+def detect_once(automaton, noise_matcher, text):
+    """按 ThreeStepFilter.detect 的步骤执行一次规则匹配，返回 (各阶段耗时, 命中数, 是否执行了 DFA)"""
+    start = time.perf_counter()
+    normalized, offsets = text_preprocessor.preprocess_with_offsets(text)
+    preprocess_end = time.perf_counter()
+
+    matches = automaton.find_all(normalized)
+    ac_results, _ = automaton.search(normalized, matches)
+    words = automaton.words
+    hits = set()
+    for i, idx in matches:
+        word = words[idx]
+        s, e = text_preprocessor.original_span(offsets, i + 1 - len(word), i + 1)
+        hits.add((word, s, e, idx))
+    ac_end = time.perf_counter()
+
+    dfa_ran = not ac_results
+    if dfa_ran:
+        spans = noise_matcher.find_spans(text)
+        hits.update((words[idx], s, e, idx) for s, e, idx in spans if text[s] == words[idx][0])
+    end = time.perf_counter()
+    return {
+        "preprocess": preprocess_end - start,
+        "ac": ac_end - preprocess_end,
+        "dfa": end - ac_end,
+        "total": end - start,
+    }, len(hits), dfa_ran
+
+
+def bench_build(paths, words, libraries, masks):
+    """编译耗时（不开 tracemalloc）、峰值内存（单独一次开 tracemalloc 的编译）与快照读写耗时"""
+    start = time.perf_counter()
+    automaton = CompactACAutomaton(words, libraries, masks)
+    build_seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    CompactACAutomaton(words, libraries, masks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    key, library_info = library_fingerprint(paths)
+    with tempfile.TemporaryDirectory() as directory:
+        store = AutomatonSnapshotStore(directory)
+        start = time.perf_counter()
+        path = store.save(key, automaton, library_info)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = store.load(key)
+        load_seconds = time.perf_counter() - start
+        snapshot_bytes = os.path.getsize(path) if path else None
+        del loaded
+
+    return automaton, {
+        "words": len(words),
+        "states": automaton.state_count,
+        "seconds": round(build_seconds, 4),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "snapshot_save_seconds": round(save_seconds, 4),
+        "snapshot_load_seconds": round(load_seconds, 4),
+        "snapshot_mb": round(snapshot_bytes / 1024 / 1024, 2) if snapshot_bytes else None,
+    }
+
+
+def bench_scan(automaton, text, repeat):
+    noise_matcher = automaton.noise_matcher()
+    detect_once(automaton, noise_matcher, text)  # 预热（惰性构建的加速视图、映射表缓存等）
+    runs = []
+    for _ in range(repeat):
+        timing, hit_count, dfa_ran = detect_once(automaton, noise_matcher, text)
+        runs.append(timing)
+    median = {stage: statistics.median(run[stage] for run in runs) for stage in runs[0]}
+    fallback = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        noise_matcher.find_spans(text)
+        fallback.append(time.perf_counter() - start)
+    size_mb = len(text.encode("utf-8")) / 1024 / 1024
+    return {
+        "chars": len(text),
+        "bytes": len(text.encode("utf-8")),
+        "hits": hit_count,
+        "dfa_ran": dfa_ran,
+        "median_ms": {stage: round(value * 1000, 3) for stage, value in median.items()},
+        "min_total_ms": round(min(run["total"] for run in runs) * 1000, 3),
+        "mb_per_s": round(size_mb / median["total"], 3) if median["total"] else None,
+        # 容噪 DFA 复核占总耗时的比例（AC 已命中时为 0）
+        "dfa_share": round(median["dfa"] / median["total"], 3) if median["total"] else 0,
+        # 无论 AC 是否命中，单独执行一次容噪 DFA 的耗时
+        "dfa_fallback_ms": round(statistics.median(fallback) * 1000, 3),
+    }
+
+
+def lookup(result, path):
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(result, baseline, tolerance):
+    """与基线比较，返回退化项列表 [(指标, 基线值, 本次值, 变化比例)]"""
+    checks = list(GATED_METRICS)
+    for corpus, sizes in result["scan"].items():
+        for size in sizes:
+            checks.append((f"scan.{corpus}.{size}.mb_per_s", "higher"))
+            checks.append((f"scan.{corpus}.{size}.dfa_fallback_ms", "lower"))
+    regressions = []
+    for path, direction in checks:
+        old, new = lookup(baseline, path), lookup(result, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (direction == "higher" and change < -tolerance) or (direction == "lower" and change > tolerance):
+            regressions.append((path, old, new, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--libraries", default=DEFAULT_LIBRARY_DIR, help="词库目录")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="文本长度（字符），逗号分隔")
+    parser.add_argument("--corpora", default="clean,dense,noisy", help="参与测试的文本类型")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数（取中位数）")
+    parser.add_argument("--seed", type=int, default=20240101, help="文本拼接的随机种子")
+    parser.add_argument("--output", help="结果 JSON 写入路径")
+    parser.add_argument("--baseline", help="基线 JSON，存在退化时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的退化比例")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.libraries, "*.txt")))
+    if not paths:
+        parser.error(f"词库目录 {args.libraries} 中没有 .txt 词库")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    corpora = [c.strip() for c in args.corpora.split(",") if c.strip()]
+
+    words, libraries, masks = load_libraries(paths)
+    automaton, build = bench_build(paths, words, libraries, masks)
+    print(f"词库 {len(paths)} 个，{build['words']} 个词，{build['states']} 个状态")
+    print(f"编译 {build['seconds'] * 1000:.1f}ms，峰值内存 {build['peak_mb']}MB；"
+          f"快照写入 {build['snapshot_save_seconds'] * 1000:.1f}ms，加载 {build['snapshot_load_seconds'] * 1000:.1f}ms"
+          f"（{build['snapshot_mb']}MB）")
+
+    # clean 只取 AC 无命中的样本行，noisy 只取插入噪声后 AC 无法命中的词，保证这两类文本确实走 DFA 复核
+    clean_lines = [line for line in load_sample_lines(os.path.join(DEMO_DIR, "normal_samples"))
+                   if ac_clean(automaton, line)]
+    sensitive_lines = load_sample_lines(os.path.join(DEMO_DIR, "sensitive_samples"))
+    if not clean_lines:
+        parser.error("normal_samples 中没有 AC 无命中的样本行")
+    noise_chars = "".join(ch for ch in NOISE_CHARS if ac_clean(automaton, ch))
+    pads = "".join(ch for ch in noise_chars
+                   if all(ac_clean(automaton, line[-8:] + ch) and ac_clean(automaton, ch + line[:8]) for line in clean_lines))
+    rng = random.Random(args.seed)
+    chinese_words = sorted(w for w in words if len(w) >= 2 and all("一" <= ch <= "鿿" for ch in w))
+    candidates = (noisy_word(w, rng, noise_chars, pads) for w in rng.sample(chinese_words, min(2000, len(chinese_words))))
+    noisy_words = [word for word in candidates if ac_clean(automaton, word)][:500]
+    print(f"clean 样本行 {len(clean_lines)} 条，noisy 插入词 {len(noisy_words)} 个")
+
+    scan = {}
+    print(f"\n{'文本':<6}{'长度':>10}{'命中':>8}{'预处理ms':>12}{'AC ms':>10}{'DFA ms':>10}"
+          f"{'合计ms':>10}{'MB/s':>9}{'DFA占比':>9}{'DFA复核ms':>12}")
+    for corpus in corpora:
+        scan[corpus] = {}
+        for size in sizes:
+            # 每种文本、每个长度单独设定种子，增减测试项不影响其余文本的内容
+            text_rng = random.Random(f"{args.seed}-{corpus}-{size}")
+            if corpus == "clean":
+                text = build_text(clean_lines, size, text_rng)
+            elif corpus == "dense":
+                text = build_text(sensitive_lines, size, text_rng)
+            elif corpus == "noisy":
+                text = build_text(clean_lines, size, text_rng, noisy_words, insert_every=500)
+            else:
+                parser.error(f"未知的文本类型: {corpus}")
+            row = scan[corpus][str(size)] = bench_scan(automaton, text, args.repeat)
+            ms = row["median_ms"]
+            print(f"{corpus:<8}{size:>10}{row['hits']:>8}{ms['preprocess']:>12.2f}{ms['ac']:>10.2f}"
+                  f"{ms['dfa']:>10.2f}{ms['total']:>10.2f}{row['mb_per_s']:>9.2f}{row['dfa_share']:>9.2f}"
+                  f"{row['dfa_fallback_ms']:>12.2f}")
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "libraries": [os.path.basename(p) for p in paths],
+            "library_key": library_fingerprint(paths)[0],
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "build": build,
+        "scan": scan,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("library_key") != result["meta"]["library_key"]:
+            print("提示：基线使用的词库与本次不同，比较结果仅供参考")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n相对基线退化超过 {args.tolerance:.0%}：")
+            for path, old, new, change in regressions:
+                print(f"  {path}: {old} -> {new}（{change:+.1%}）")
+            sys.exit(1)
+        print(f"\n与基线相比无超过 {args.tolerance:.0%} 的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""文档上传内存基准：上传不同大小的 txt 文档，观察服务进程的峰值常驻内存
+
+用法（在 backend 目录下运行，需安装 uvicorn 与 httpx）：
+    python benchmarks/bench_upload_memory.py [--sizes 10,100,300] [--port 8765]
+
+脚本以子进程方式启动 uvicorn main:app（设置 DOC_MAX_UPLOAD_MB 以放行大文件），依次流式上传生成的文档，
+每次上传后读取服务进程的 VmHWM（峰值 RSS，仅 Linux）。上传内容分块落盘、按段提取时，峰值内存应基本不随文件大小增长。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LINE = "今天天气很好，我们一起去公园散步，顺便讨论一下项目的进展情况。\n".encode("utf-8")
+
+
+def read_status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def make_document(size_mb: int) -> str:
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    block = LINE * (1024 * 1024 // len(LINE) + 1)
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block[:1024 * 1024])
+    return path
+
+
+def wait_ready(base_url: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("服务启动超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,300", help="上传文档大小（MB），逗号分隔")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    env = dict(os.environ, DOC_MAX_UPLOAD_MB=str(max(sizes) + 1))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url)
+        print(f"服务启动后 RSS: {read_status_kb(server.pid, 'VmRSS') / 1024:.1f}MB")
+        for size_mb in sizes:
+            path = make_document(size_mb)
+            try:
+                start = time.perf_counter()
+                with open(path, "rb") as f:
+                    response = httpx.post(
+                        f"{base_url}/detect/document",
+                        files={"file": (f"bench-{size_mb}mb.txt", f, "text/plain")},
+                        timeout=600,
+                    )
+                elapsed = time.perf_counter() - start
+            finally:
+                os.unlink(path)
+            data = response.json().get("data", {}) if response.status_code == 200 else {}
+            print(f"{size_mb:>5}MB  状态 {response.status_code}  用时 {elapsed:7.2f}s  "
+                  f"段数 {len(data.get('pages', []))}  峰值 RSS {read_status_kb(server.pid, 'VmHWM') / 1024:8.1f}MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""端到端压测：本地模拟 Ollama，按目标 QPS 混合发送文本与文档检测请求
+
+用法（在 backend 目录下运行，需安装 uvicorn 与 httpx，不需要 GPU 与真实模型）：
+    python benchmarks/loadtest.py [--qps 20] [--duration 60] [--mix clean=6,sensitive=3,document=1]
+                                  [--llm-latency-ms 800] [--llm-jitter-ms 200] [--llm-error-rate 0.02]
+                                  [--llm-parallel 1] [--llm-output random] [--output result.json]
+
+- 模拟 Ollama：在本地启动 /api/tags 与 /api/generate，按设定的延迟（正态抖动）、错误率与输出应答；
+  --llm-parallel 限制同时“推理”的请求数（对应 OLLAMA_NUM_PARALLEL），多余请求在模拟服务内排队；
+  合并判定的编号提示词按条数逐行给出判定
+- 被测服务：默认以子进程方式启动 uvicorn main:app，并把 OLLAMA_BASE_URL 指向模拟服务，
+  请求经由 call_ollama_api → 调度队列 → OllamaClient 的原有路径，不做任何替换；
+  指定 --url 时压测已运行的服务，此时需自行以 OLLAMA_BASE_URL=http://<本机地址>:<--mock-port> 启动该服务
+- 流量：开环发压（请求按泊松到达或固定间隔发出，不等待前一个请求完成），按 --mix 权重混合
+  - clean：1~3 条 demo/normal_samples 样本行
+  - sensitive：1 条 demo/sensitive_samples 样本行，前后随机拼接正常样本行
+  - strict：同 sensitive，以 strict_mode 发送（默认权重 0）
+  - document：按 --doc-kb 生成的 txt 文档（一半夹杂敏感样本行）与 --documents 指定的文件
+  样本随机拼接，相同文本只会偶尔重复，与线上一样只有少量请求命中判定缓存
+- 报告：按流量类型与总体给出 p50/p95/p99 延迟、吞吐量、错误分布、升级到大模型复核的比例与其中命中缓存的比例，
+  以及模拟 Ollama 收到的调用数；--output 写入 JSON
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from bench_rule_engine import DEMO_DIR, load_sample_lines
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_DOCUMENTS = sorted(
+    glob.glob(os.path.join(DEMO_DIR, "sensitive_samples", "*.pdf"))
+    + glob.glob(os.path.join(DEMO_DIR, "sensitive_samples", "*.docx"))
+)
+DOCUMENT_TYPES = {".txt": "text/plain", ".pdf": "application/pdf", ".png": "image/png", ".doc": "application/msword",
+                  ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+# 与 main.LLM_FLOWS 一致：需要大模型复核的检测流程
+LLM_FLOWS = ("strict_mode", "rule_then_llm")
+_BATCH_COUNT_RE = re.compile(r"下面有 (\d+) 条相互独立的文本")
+
+
+# ---------------------- 模拟 Ollama ----------------------
+class MockOllama:
+    """在后台线程中运行的 Ollama 替身：/api/tags 返回模型列表，/api/generate 按设定延迟、错误率与输出应答"""
+
+    def __init__(self, host: str, port: int, model: str, latency_ms: float, jitter_ms: float, error_rate: float,
+                 parallel: int, output: str, sensitive_ratio: float, seed: int):
+        self.model = model
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.output = output
+        self.sensitive_ratio = sensitive_ratio
+        self.rng = random.Random(seed)
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _verdict(self) -> str:
+        if self.output != "random":
+            return self.output
+        with self.lock:
+            return "敏感" if self.rng.random() < self.sensitive_ratio else "正常"
+
+    def generate(self, prompt: str):
+        """返回 (状态码, 响应 JSON)；持有推理槽位期间休眠模拟推理耗时"""
+        match = _BATCH_COUNT_RE.search(prompt)
+        count = int(match.group(1)) if match else 0
+        with self.lock:
+            delay = max(0.0, self.rng.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            failed = self.rng.random() < self.error_rate
+            self.stats["generate"] += 1
+            self.stats["batch_prompts" if count else "single_prompts"] += 1
+            self.stats["batched_items"] += count
+        with self.slots:
+            time.sleep(delay)
+        if failed:
+            with self.lock:
+                self.stats["injected_errors"] += 1
+            return 500, {"error": "mock ollama: injected error"}
+        if count:
+            response = "\n".join(f"{i}. {self._verdict()}" for i in range(1, count + 1))
+        else:
+            response = self._verdict()
+        return 200, {"model": self.model, "response": response, "done": True}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 支持 keep-alive，服务端连接池可复用连接
+
+            def _reply(self, status: int, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    with mock.lock:
+                        mock.stats["tags"] += 1
+                    self._reply(200, {"models": [{"name": mock.model, "model": mock.model}]})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if self.path != "/api/generate":
+                    self._reply(404, {"error": "not found"})
+                    return
+                try:
+                    prompt = json.loads(body or b"{}").get("prompt", "")
+                except ValueError:
+                    self._reply(400, {"error": "invalid json"})
+                    return
+                self._reply(*mock.generate(prompt))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# ---------------------- 流量生成 ----------------------
+def parse_mix(value: str):
+    weights = {}
+    for part in value.split(","):
+        if part.strip():
+            name, _, weight = part.partition("=")
+            weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - {"clean", "sensitive", "strict", "document"}
+    if unknown:
+        raise ValueError(f"未知的流量类型: {', '.join(sorted(unknown))}")
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def make_documents(normal_lines, sensitive_lines, size_kb: int, count: int, rng):
+    """生成 count 个约 size_kb KB 的 txt 文档，其中一半每约 50 行夹杂一条敏感样本行"""
+    documents = []
+    for n in range(count):
+        lines, size = [], 0
+        while size < size_kb * 1024:
+            line = rng.choice(sensitive_lines) if n % 2 and len(lines) % 50 == 49 else rng.choice(normal_lines)
+            lines.append(line)
+            size += len(line.encode("utf-8")) + 1
+        documents.append((f"loadtest-{n}.txt", "\n".join(lines).encode("utf-8"), "text/plain"))
+    return documents
+
+
+class TrafficMix:
+    def __init__(self, weights, normal_lines, sensitive_lines, documents, seed: int):
+        self.kinds = list(weights)
+        self.weights = [weights[k] for k in self.kinds]
+        self.normal_lines = normal_lines
+        self.sensitive_lines = sensitive_lines
+        self.documents = documents
+        self.rng = random.Random(seed)
+
+    def _text(self, sensitive: bool) -> str:
+        lines = self.rng.sample(self.normal_lines, self.rng.randint(0 if sensitive else 1, 2 if sensitive else 3))
+        if sensitive:
+            lines.insert(self.rng.randint(0, len(lines)), self.rng.choice(self.sensitive_lines))
+        return "".join(lines)
+
+    def next(self):
+        """返回 (类型, 请求参数)"""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "document":
+            filename, content, content_type = self.rng.choice(self.documents)
+            return kind, {"url": "/detect/document", "files": {"file": (filename, content, content_type)}}
+        payload = {"text": self._text(kind != "clean")}
+        if kind == "strict":
+            payload["strict_mode"] = True
+        return kind, {"url": "/detect/text", "json": payload}
+
+
+async def send(client: httpx.AsyncClient, kind: str, request, records: list):
+    start = time.perf_counter()
+    record = {"kind": kind, "status": None, "flow": None, "cached": False}
+    try:
+        response = await client.post(request["url"], json=request.get("json"), files=request.get("files"))
+        record["status"] = response.status_code
+        if response.status_code == 200:
+            data = response.json().get("data", {})
+            record["flow"] = data.get("detection_flow")
+            record["cached"] = bool(data.get("cached"))
+    except httpx.TimeoutException:
+        record["status"] = "timeout"
+    except httpx.HTTPError as e:
+        record["status"] = type(e).__name__
+    record["latency"] = time.perf_counter() - start
+    records.append(record)
+
+
+async def run_load(base_url: str, mix: TrafficMix, qps: float, duration: float, arrival: str, max_connections: int,
+                   timeout: float, seed: int):
+    """开环发压：按到达时刻发出请求，压测结束后等待全部在途请求完成"""
+    rng = random.Random(seed)
+    records, tasks = [], []
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        next_at, max_lag = 0.0, 0.0
+        while next_at < duration:
+            delay = start + next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            kind, request = mix.next()
+            tasks.append(asyncio.create_task(send(client, kind, request, records)))
+            next_at += rng.expovariate(qps) if arrival == "poisson" else 1 / qps
+        sent_elapsed = time.perf_counter() - start
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return records, {"sent": len(tasks), "send_seconds": round(sent_elapsed, 3), "elapsed_seconds": round(elapsed, 3),
+                     "max_schedule_lag_ms": round(max_lag * 1000, 2)}
+
+
+# ---------------------- 报告 ----------------------
+def percentile(sorted_values, q: float):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def summarize(records, elapsed: float):
+    ok = [r for r in records if r["status"] == 200]
+    latencies = sorted(r["latency"] * 1000 for r in ok)
+    escalated = [r for r in ok if r["flow"] in LLM_FLOWS]
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": dict(Counter(str(r["status"]) for r in records if r["status"] != 200)),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 1) if latencies else None,
+            "p95": round(percentile(latencies, 0.95), 1) if latencies else None,
+            "p99": round(percentile(latencies, 0.99), 1) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 1) if latencies else None,
+            "max": round(latencies[-1], 1) if latencies else None,
+        },
+        "flows": dict(Counter(r["flow"] for r in ok)),
+        # 升级率：成功请求中经过大模型复核的比例；cache_share：其中判定来自缓存的比例
+        "escalation_rate": round(len(escalated) / len(ok), 4) if ok else None,
+        "cache_share": round(sum(r["cached"] for r in escalated) / len(escalated), 4) if escalated else None,
+    }
+
+
+def print_report(report):
+    print(f"\n{'类型':<10}{'请求':>7}{'成功':>7}{'吞吐/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'升级率':>8}{'缓存':>7}  错误")
+    for name, row in list(report["by_kind"].items()) + [("total", report["total"])]:
+        lat = row["latency_ms"]
+        fmt = lambda v: f"{v:.1f}" if v is not None else "-"  # noqa: E731
+        rate = lambda v: f"{v:.1%}" if v is not None else "-"  # noqa: E731
+        print(f"{name:<12}{row['requests']:>7}{row['ok']:>7}{row['throughput_rps'] or 0:>9.2f}{fmt(lat['p50']):>9}"
+              f"{fmt(lat['p95']):>9}{fmt(lat['p99']):>9}{rate(row['escalation_rate']):>9}{rate(row['cache_share']):>8}"
+              f"  {row['errors'] or ''}")
+    run = report["run"]
+    print(f"\n目标 {report['config']['qps']} QPS，发出 {run['sent']} 个请求（用时 {run['send_seconds']}s，"
+          f"最大发送滞后 {run['max_schedule_lag_ms']}ms），全部完成用时 {run['elapsed_seconds']}s")
+    print(f"模拟 Ollama: {report['mock_ollama']}")
+
+
+# ---------------------- 被测服务 ----------------------
+def wait_ready(base_url: str, timeout: float = 120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("服务启动超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="压测已运行的服务（默认在本地启动 uvicorn main:app）")
+    parser.add_argument("--port", type=int, default=8766, help="本地启动服务时的端口")
+    parser.add_argument("--qps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=60, help="发压时长（秒）")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--mix", default="clean=6,sensitive=3,document=1",
+                        help="流量权重：clean / sensitive / strict / document")
+    parser.add_argument("--documents", nargs="*", default=DEFAULT_DOCUMENTS, help="参与 document 流量的文件")
+    parser.add_argument("--doc-kb", type=int, default=64, help="生成的 txt 文档大小（KB），0 表示不生成")
+    parser.add_argument("--max-connections", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求超时（秒）")
+    parser.add_argument("--mock-host", default="127.0.0.1", help="模拟 Ollama 监听地址（服务在容器内时用 0.0.0.0）")
+    parser.add_argument("--mock-port", type=int, default=0, help="模拟 Ollama 端口（0 为随机）")
+    parser.add_argument("--llm-model", default=os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct-q4_K_M"))
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="单次推理耗时均值")
+    parser.add_argument("--llm-jitter-ms", type=float, default=200, help="推理耗时标准差")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--llm-parallel", type=int, default=1, help="同时推理的请求数（OLLAMA_NUM_PARALLEL）")
+    parser.add_argument("--llm-output", default="random", help="固定输出（如 敏感 / 正常），random 按比例随机")
+    parser.add_argument("--llm-sensitive-ratio", type=float, default=0.3, help="random 输出时判定为敏感的比例")
+    parser.add_argument("--seed", type=int, default=20240101)
+    parser.add_argument("--output", help="结果 JSON 写入路径")
+    args = parser.parse_args()
+
+    try:
+        weights = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    normal_lines = load_sample_lines(os.path.join(DEMO_DIR, "normal_samples"))
+    sensitive_lines = load_sample_lines(os.path.join(DEMO_DIR, "sensitive_samples"))
+    rng = random.Random(args.seed)
+    documents = make_documents(normal_lines, sensitive_lines, args.doc_kb, 4, rng) if args.doc_kb > 0 else []
+    for path in args.documents:
+        with open(path, "rb") as f:
+            documents.append((os.path.basename(path), f.read(),
+                              DOCUMENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")))
+    if "document" in weights and not documents:
+        parser.error("document 流量没有可用的文档")
+    mix = TrafficMix(weights, normal_lines, sensitive_lines, documents, args.seed)
+
+    mock = MockOllama(args.mock_host, args.mock_port, args.llm_model, args.llm_latency_ms, args.llm_jitter_ms,
+                      args.llm_error_rate, args.llm_parallel, args.llm_output, args.llm_sensitive_ratio, args.seed)
+    mock.start()
+    mock_url = f"http://{'127.0.0.1' if args.mock_host == '0.0.0.0' else args.mock_host}:{mock.port}"
+    print(f"模拟 Ollama: {mock_url}（延迟 {args.llm_latency_ms}±{args.llm_jitter_ms}ms，"
+          f"错误率 {args.llm_error_rate:.1%}，并行 {args.llm_parallel}）")
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        print(f"压测已运行的服务 {base_url}，请确认其 OLLAMA_BASE_URL 指向模拟 Ollama（端口 {mock.port}）")
+    else:
+        env = dict(os.environ, OLLAMA_BASE_URL=mock_url, OLLAMA_MODEL=args.llm_model)
+        env.setdefault("LOG_LEVEL", "WARNING")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url)
+        print(f"开始压测：{args.qps} QPS × {args.duration}s，流量 {weights}")
+        records, run = asyncio.run(run_load(base_url, mix, args.qps, args.duration, args.arrival,
+                                            args.max_connections, args.timeout, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        mock.stop()
+
+    elapsed = run["elapsed_seconds"]
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "documents"},
+        "run": run,
+        "total": summarize(records, elapsed),
+        "by_kind": {kind: summarize([r for r in records if r["kind"] == kind], elapsed) for kind in weights},
+        "mock_ollama": dict(mock.stats),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+# ---------------------- 双重匹配规则引擎 ----------------------
+# 说明：规则匹配引擎 ThreeStepFilter（预处理 + AC 初筛 + 容噪 DFA）原位于 main.py。规则匹配进程池以 forkserver 方式启动，
+# 工作进程只导入本模块（及 rule_engine），按 spec 从快照重建引擎；导入 main.py 则会创建应用并初始化词库与检测引擎。
+import copy
+import itertools
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from observability import get_logger
+from rule_engine import (  # 数组化AC自动机、容噪匹配、文本预处理、流式匹配及快照
+    CompactACAutomaton, PatchedAutomaton, StreamingMatcher, text_preprocessor,
+    AutomatonSnapshotStore, library_fingerprint
+)
+
+logger = get_logger("detection_engine")
+
+# 默认词库目录（与 main.WordLibraryManager 一致）
+DEFAULT_WORD_LIBRARY_DIR = "/app/word_libraries"
+
+# 编译后自动机的快照目录（默认放在词库目录下，随词库卷持久化，容器重启/回滚后可直接复用）
+automaton_snapshot_store = AutomatonSnapshotStore(
+    os.getenv("DETECTION_SNAPSHOT_DIR", os.path.join(DEFAULT_WORD_LIBRARY_DIR, ".snapshots"))
+)
+
+
+# 第一步：AC自动机初筛 - 快速过滤无风险文本，标记可疑文本
+# 数组化实现见 rule_engine.CompactACAutomaton
+
+# 第二步：DFA检测 - 对可疑文本进行精准验证
+class DFAFilter:
+    def __init__(self, trie):
+        # 与 AC 自动机共用同一棵已编译的字典树（含快照加载的情形），不再单独构建 (状态, 字符) 字典
+        self.trie = trie
+        self.words = trie.words
+        # 容噪匹配（中文词内部允许跳过少量 ASCII 字母/数字），线性时间实现；叠加增量时逐层匹配
+        self.noise_matcher = trie.noise_matcher()
+
+    def precise_match(self, text, suspicious_segments, noise_tolerant: bool = False, hits: Optional[list] = None,
+                      word_filter=None):
+        """对可疑文本片段进行DFA精准匹配
+
+        - noise_tolerant=False：词在片段中连续出现即命中，等价于一次 AC 扫描
+        - noise_tolerant=True：单次连续最多跳过 10 个、整段累计最多跳过 100 个噪声字符，
+          语义与逐起点回溯的原实现一致，但只需一次扫描（见 rule_engine.NoiseTolerantMatcher）
+        - hits：传入列表时追加 (敏感词, 起点, 终点, 词下标)，坐标相对于所在片段
+        - word_filter：按词下标过滤命中（用于按词库筛选），None 表示不过滤
+        """
+        precise_results = set()
+
+        for segment in suspicious_segments:
+            if noise_tolerant:
+                spans = self.noise_matcher.find_spans(segment)
+                if word_filter is not None:
+                    spans = [span for span in spans if word_filter(span[2])]
+                precise_results.update(segment[start:end] for start, end, _ in spans)
+                if hits is not None:
+                    # 起点落在前导噪声上的线程与其后起步的线程命中同一个词，位置上只保留后者
+                    hits.extend((self.words[idx], start, end, idx) for start, end, idx in spans
+                                if segment[start] == self.words[idx][0])
+            else:
+                for i, idx in self.trie.find_all(segment):
+                    if word_filter is not None and not word_filter(idx):
+                        continue
+                    word = self.words[idx]
+                    precise_results.add(word)
+                    if hits is not None:
+                        hits.append((word, i + 1 - len(word), i + 1, idx))
+
+        return list(precise_results)
+
+# 文本预处理 - 统一字符格式，消除"无意义变体"
+# 单次查表实现见 rule_engine.TextPreprocessor，全局共享实例 text_preprocessor
+
+# 规则匹配引擎整合（预处理+AC+DFA）
+_engine_ids = itertools.count(1)
+
+
+class ThreeStepFilter:
+    """规则匹配引擎：构建完成后不再修改，词库变更时整体重建并由 DetectionEngineManager 原子替换
+
+    自动机编译全部词库，每个词带有所属词库的位掩码；default_libraries 为默认启用的词库
+    （None 表示全部），单次检测可通过 libraries 参数另选词库，在匹配时按掩码过滤。
+    """
+
+    def __init__(self, word_paths=None, progress=None, automaton=None, default_libraries=None):
+        if word_paths is None:
+            # 默认使用word_libraries目录中的所有词库
+            word_paths = []
+            base_path = DEFAULT_WORD_LIBRARY_DIR
+            if os.path.exists(base_path):
+                for filename in os.listdir(base_path):
+                    if filename.endswith('.txt'):
+                        word_paths.append(os.path.join(base_path, filename))
+        self.word_paths = word_paths
+        self.words = []
+        self.default_libraries = list(default_libraries) if default_libraries else None
+        # 构建进度回调（可选），参数为阶段描述
+        self.progress = progress
+        # 文本预处理器（全局共享）
+        self.text_preprocessor = text_preprocessor
+        # 第一步：AC自动机（优先从快照加载，或直接使用传入的已编译/增量自动机）；第二步：DFA检测（共用同一棵字典树）
+        if automaton is None:
+            self._load_compiled()
+        else:
+            self._install(automaton, None)
+
+    def _load_compiled(self):
+        """按词库内容哈希查找已编译快照；命中则 mmap 加载，否则读取词库重建并写入快照"""
+        start_time = time.time()
+        self._report("计算词库指纹")
+        key, libraries = library_fingerprint(self.word_paths)
+        self._report("加载快照")
+        automaton = automaton_snapshot_store.load(key)
+        if automaton is not None:
+            self.words = automaton.words
+            logger.info(f"已从快照加载自动机: {automaton.snapshot_path}，共 {len(self.words)} 个词，"
+                        f"耗时 {(time.time() - start_time) * 1000:.1f}ms")
+        else:
+            self._report("读取词库")
+            self._load_words()
+            self._report("构建自动机")
+            automaton = CompactACAutomaton(self.words, self._libraries, self._word_masks)
+            del self._libraries, self._word_masks
+            logger.info(f"自动机构建完成：{automaton.state_count} 个状态，耗时 {(time.time() - start_time) * 1000:.1f}ms")
+            self._report("写入快照")
+            automaton_snapshot_store.save(key, automaton, libraries)
+        self._install(automaton, key)
+
+    def _install(self, automaton, snapshot_key):
+        if snapshot_key:
+            automaton.snapshot_key = snapshot_key
+        self.snapshot_key = snapshot_key
+        self.ac_automaton = automaton
+        self.words = automaton.words
+        self.libraries = automaton.libraries
+        self.dfa_filter = DFAFilter(automaton)
+        self._apply_default_libraries()
+
+    def _apply_default_libraries(self):
+        """计算默认词库掩码与默认词库下的有效词数（增量自动机含已删除词的占位，不能直接用 len(words)）"""
+        names = self.default_libraries or []
+        missing = [name for name in names if name not in self.libraries]
+        if missing:
+            logger.warning(f"默认检测词库 {', '.join(missing)} 不存在，已忽略")
+        names = [name for name in names if name in self.libraries]
+        self.default_libraries = names or None
+        self.default_mask = self.ac_automaton.library_mask(names) if names else self.ac_automaton.full_mask
+        self.word_count = self.ac_automaton.count_words(self.default_mask)
+        # 引擎标识：执行后端的工作进程按此缓存已重建的引擎
+        self.engine_id = next(_engine_ids)
+
+    def with_default_libraries(self, default_libraries):
+        """返回共用同一自动机、仅默认词库不同的引擎（不重新编译）"""
+        engine = copy.copy(self)
+        engine.default_libraries = list(default_libraries) if default_libraries else None
+        engine._apply_default_libraries()
+        return engine
+
+    def spec(self) -> Dict[str, Any]:
+        """在其他进程中重建同一引擎所需的描述：基础自动机的快照键 + 增量编辑的词库掩码 + 默认词库"""
+        automaton = self.ac_automaton
+        patched = isinstance(automaton, PatchedAutomaton)
+        return {
+            "engine_id": self.engine_id,
+            "word_paths": self.word_paths,
+            "snapshot_key": (automaton.base if patched else automaton).snapshot_key,
+            "masks": automaton.masks if patched else None,
+            "default_libraries": self.default_libraries,
+        }
+
+    @classmethod
+    def from_spec(cls, spec: Dict[str, Any]) -> "ThreeStepFilter":
+        """按 spec 重建引擎：优先 mmap 加载快照（多进程共享页缓存），快照缺失时重新编译词库"""
+        automaton = automaton_snapshot_store.load(spec["snapshot_key"]) if spec["snapshot_key"] else None
+        if automaton is None:
+            automaton = cls(spec["word_paths"]).ac_automaton
+        if spec["masks"]:
+            # 掩码为编辑后的绝对值，叠加到任一版本的基础自动机上结果相同
+            automaton = PatchedAutomaton(automaton, spec["masks"])
+        return cls(spec["word_paths"], automaton=automaton, default_libraries=spec["default_libraries"])
+
+    def library_mask(self, libraries: Optional[List[str]]) -> int:
+        """请求指定的词库 -> 位掩码；None 表示使用默认词库，未知词库抛出 ValueError"""
+        if libraries is None:
+            return self.default_mask
+        return self.ac_automaton.library_mask(libraries)
+
+    def _report(self, stage: str):
+        if self.progress:
+            self.progress(stage)
+
+    def _load_words(self):
+        """加载敏感词并自动去重"""
+        all_words = []
+        word_sources = {}  # 记录每个词来自哪些词库
+        
+        for word_path in self.word_paths:
+            if os.path.exists(word_path):
+                library_name = os.path.splitext(os.path.basename(word_path))[0]
+                with open(word_path, "r", encoding="utf-8") as f:
+                    for word in f:
+                        # 词与输入文本做同样的预处理（NFKC、繁转简、过滤符号）：AC 在归一化文本上匹配，
+                        # 未归一化的词（如只有繁体形式的词）永远无法命中；归一化后相同的词在下面去重并合并词库掩码
+                        word = self.text_preprocessor.normalize_text(word.strip())
+                        if word:
+                            all_words.append(word)
+                            # 记录词库来源
+                            if word not in word_sources:
+                                word_sources[word] = []
+                            word_sources[word].append(library_name)
+            else:
+                logger.warning(f"敏感词库文件 {word_path} 不存在")
+        
+        # 去重并统计
+        original_count = len(all_words)
+        self.words = list(set(all_words))  # 自动去重
+        deduplicated_count = len(self.words)
+        
+        # 每个词的词库位掩码（词库按名称排序编号）
+        self._libraries = sorted({
+            os.path.splitext(os.path.basename(path))[0] for path in self.word_paths if os.path.exists(path)
+        })
+        bits = {name: 1 << i for i, name in enumerate(self._libraries)}
+        self._word_masks = []
+        for word in self.words:
+            mask = 0
+            for name in word_sources[word]:
+                mask |= bits[name]
+            self._word_masks.append(mask)
+        removed_count = original_count - deduplicated_count
+        
+        # 打印去重统计信息
+        if removed_count > 0:
+            logger.info(f"词库去重完成：原始 {original_count} 个词，去重后 {deduplicated_count} 个词，删除重复词 {removed_count} 个")
+            
+            # 显示重复词及其来源（仅显示前10个）
+            duplicates = [word for word, sources in word_sources.items() if len(sources) > 1]
+            if duplicates:
+                examples = [f"'{word}' 出现在: {', '.join(word_sources[word])}" for word in duplicates[:10]]
+                if len(duplicates) > 10:
+                    examples.append(f"... 还有 {len(duplicates) - 10} 个重复词")
+                logger.info("重复词示例（前10个）:\n  " + "\n  ".join(examples))
+        else:
+            logger.info(f"词库加载完成：共 {deduplicated_count} 个词，无重复词")
+
+    def detect(self, text, libraries: Optional[List[str]] = None):
+        """规则匹配检测（预处理 + AC 初筛 + 条件化 DFA）
+        
+        - 预处理：对输入文本进行字符归一化（全角转半角、繁转简、去除特殊符号），供 AC 使用
+        - AC 初筛（归一化文本）：多模式匹配，快速获得 ac_results 与可疑片段 suspicious_segments
+        - 性能优先策略：
+          - 若 AC 已命中：跳过 DFA（dfa_results=[]，dfa_time=0）
+          - 若 AC 未命中：对“原始文本”启用容噪 DFA 复核，提升插字扰动场景的召回
+            - 容噪规则：仅在中文词内部允许跳过 ASCII 字母/数字（不含下划线）
+            - 默认阈值：单次连续最多跳过 10，整段累计最多跳过 100
+        - 最终结果：合并 AC 与（可选）DFA 的命中并去重
+        - 命中位置 hits：每个命中给出原文坐标 [start, end)，AC 命中经预处理偏移表换算，
+          DFA 直接在原文上匹配，前端可据此高亮而无需再次扫描
+        - 词库筛选 libraries：None 使用默认词库，否则只保留属于所列词库的命中；
+          每个命中附带其来源词库（限于本次启用的词库）
+        """
+        start_time = time.perf_counter_ns()
+        automaton = self.ac_automaton
+        mask = self.library_mask(libraries)
+        word_mask = automaton.word_mask
+        # 启用全部词库时无需逐个过滤
+        word_filter = None if mask == automaton.full_mask else (lambda idx: word_mask(idx) & mask)
+        
+        # 文本预处理：归一化字符格式
+        preprocess_start = time.perf_counter_ns()
+        normalized_text, offsets = self.text_preprocessor.preprocess_with_offsets(text)
+        preprocess_time = time.perf_counter_ns() - preprocess_start
+        
+        # 第一步：AC自动机初筛（对归一化文本）
+        ac_start = time.perf_counter_ns()
+        matches = automaton.find_all(normalized_text)
+        if word_filter is not None:
+            matches = [m for m in matches if word_filter(m[1])]
+        ac_results, suspicious_segments = automaton.search(normalized_text, matches)
+        hits = set()
+        for i, idx in matches:
+            word = self.words[idx]
+            start, end = self.text_preprocessor.original_span(offsets, i + 1 - len(word), i + 1)
+            hits.add((word, start, end, "ac", idx))
+        ac_time = time.perf_counter_ns() - ac_start
+        
+        # 第二步：DFA检测
+        # 若 AC 未命中：启用“容噪”DFA对全文作为单一片段进行复核，提升对插字躲避的召回
+        if ac_results:
+            # 性能优先：AC 已命中则跳过 DFA 严格校验
+            dfa_results = []
+            dfa_time = 0
+        else:
+            dfa_start = time.perf_counter_ns()
+            dfa_hits = []
+            dfa_results = self.dfa_filter.precise_match(text, [text], noise_tolerant=True, hits=dfa_hits,
+                                                        word_filter=word_filter)
+            hits.update((word, start, end, "dfa", idx) for word, start, end, idx in dfa_hits)
+            dfa_time = time.perf_counter_ns() - dfa_start
+        
+        # 合并所有结果
+        all_results = list(set(ac_results + dfa_results))
+        
+        total_time = time.perf_counter_ns() - start_time
+        
+        return {
+            'ac_results': ac_results,
+            'dfa_results': dfa_results,
+            'preprocess_results': [],  # 预处理结果（用于兼容性）
+            'all_results': all_results,
+            'suspicious_segments': suspicious_segments,
+            'hits': [
+                {'word': word, 'start': start, 'end': end, 'source': source,
+                 'libraries': automaton.library_names(word_mask(idx) & mask)}
+                for word, start, end, source, idx in sorted(hits, key=lambda h: (h[1], h[2]))
+            ],  # 命中位置（原文坐标）及来源词库
+            'libraries': automaton.library_names(mask),  # 本次启用的词库
+            'word_count': self.word_count if libraries is None else automaton.count_words(mask),  # 添加词库统计信息
+            'normalized_text': normalized_text,  # 归一化后的文本
+            'timing': {
+                'preprocess_time': round(preprocess_time / 1e6, 2),  # 预处理用时
+                'ac_time': round(ac_time / 1e6, 2),      # 毫秒
+                'dfa_time': round(dfa_time / 1e6, 2),    # 毫秒
+                'total_time': round(total_time / 1e6, 2)  # 毫秒
+            },
+            # 内部字段：纳秒精度的阶段用时，observe_rule_timing 记录到指标与请求追踪后移除，不出现在响应中
+            'timing_ns': {'normalize': preprocess_time, 'ac': ac_time, 'dfa': dfa_time}
+        }
+
+    def stream(self, libraries: Optional[List[str]] = None) -> "RuleStream":
+        """分块流式规则匹配：逐块喂入原文并取得新命中，最终结果与对全文调用 detect 一致
+
+        扫描状态跨块延续（见 rule_engine.StreamingMatcher），大文档等输入无需整体载入内存；
+        libraries 同 detect，未知词库抛出 ValueError。
+        """
+        return RuleStream(self, libraries)
+
+
+class RuleStream:
+    """ThreeStepFilter 的流式匹配会话：feed / finish 返回新确认的命中，result 给出与 detect 相同格式的结果"""
+
+    def __init__(self, engine: ThreeStepFilter, libraries: Optional[List[str]] = None):
+        automaton = engine.ac_automaton
+        self.engine = engine
+        self.libraries = libraries
+        self.mask = engine.library_mask(libraries)
+        word_mask = automaton.word_mask
+        mask = self.mask
+        word_filter = None if mask == automaton.full_mask else (lambda idx: word_mask(idx) & mask)
+        self.matcher = StreamingMatcher(automaton, engine.text_preprocessor, word_filter)
+
+    @property
+    def length(self) -> int:
+        """已喂入的原文长度"""
+        return self.matcher.length
+
+    @property
+    def hit_count(self) -> int:
+        """已确认的命中数（含出现 AC 命中前的容噪命中）"""
+        return len(self.matcher.hits)
+
+    def _hit_dicts(self, hits) -> List[Dict[str, Any]]:
+        automaton = self.engine.ac_automaton
+        return [
+            {'word': word, 'start': start, 'end': end, 'source': source,
+             'libraries': automaton.library_names(automaton.word_mask(idx) & self.mask)}
+            for word, start, end, source, idx in hits
+        ]
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """喂入紧接已有文本的一块原文，返回新确认的命中（原文坐标）"""
+        return self._hit_dicts(self.matcher.feed(chunk))
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """结束输入，返回其余命中"""
+        return self._hit_dicts(self.matcher.finish())
+
+    def result(self) -> Dict[str, Any]:
+        """汇总结果，字段同 ThreeStepFilter.detect；不保留归一化全文（normalized_text 为空）"""
+        matcher = self.matcher
+        automaton = self.engine.ac_automaton
+        ac_results = list(matcher.ac_results)
+        # 与 detect 一致：AC 已命中时不采用容噪匹配结果
+        dfa_results = [] if ac_results else list(matcher.dfa_results)
+        timing = {key: round(value / 1e6, 2) for key, value in matcher.timing.items()}
+        timing['total_time'] = round(sum(matcher.timing.values()) / 1e6, 2)
+        return {
+            'ac_results': ac_results,
+            'dfa_results': dfa_results,
+            'preprocess_results': [],
+            'all_results': list(dict.fromkeys(ac_results + dfa_results)),
+            'suspicious_segments': list(matcher.suspicious_segments),
+            'hits': self._hit_dicts(matcher.result_hits()),
+            'libraries': automaton.library_names(self.mask),
+            'word_count': self.engine.word_count if self.libraries is None else automaton.count_words(self.mask),
+            'normalized_text': "",
+            'timing': timing,
+            'timing_ns': {
+                'normalize': matcher.timing['preprocess_time'],
+                'ac': matcher.timing['ac_time'],
+                'dfa': matcher.timing['dfa_time'],
+            },  # 内部字段：纳秒精度的阶段用时，observe_rule_timing 记录后移除
+        }
+
+
+# ---------------------- 规则匹配工作进程 ----------------------
+# 工作进程内缓存的引擎（engine_id -> ThreeStepFilter），只保留最近的几个
+_worker_engines: Dict[int, Any] = {}
+_WORKER_ENGINE_CACHE = 2
+
+
+def _worker_engine(spec: Dict[str, Any]) -> ThreeStepFilter:
+    engine = _worker_engines.get(spec["engine_id"])
+    if engine is None:
+        engine = ThreeStepFilter.from_spec(spec)
+        _worker_engines[spec["engine_id"]] = engine
+        while len(_worker_engines) > _WORKER_ENGINE_CACHE:
+            _worker_engines.pop(next(iter(_worker_engines)))
+    return engine
+
+
+def init_rule_worker(spec: Dict[str, Any]):
+    """工作进程初始化：预加载当前引擎"""
+    _worker_engine(spec)
+
+
+def worker_detect(spec: Dict[str, Any], texts: List[str], libraries: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """工作进程中执行规则匹配"""
+    engine = _worker_engine(spec)
+    return [engine.detect(text, libraries=libraries) for text in texts]
@@ -0,0 +1,413 @@
+# ---------------------- 文档文本提取 ----------------------
+# 说明：上传内容分块写入临时文件或内存文件（spool_upload）；
+# 各格式的文本提取统一为 DocumentExtractor.iter_pages(file_type, path)，异步逐页产出 (页文本, 提取耗时, 附加信息)，依次拼接即为全文；提取过程不阻塞事件循环，也不把整个文件读入内存：
+# - txt 内存映射后按段解码（段尾对齐到换行），逐段产出
+# - docx 在线程中解析
+# - pdf 逐页提取，页数较多时按页段分发到进程池并行提取
+# - doc 通过 asyncio 子进程调用 antiword 读取上传文件（内存中的小文件写入 memfd，不落盘），并发数受限
+# - 图片交给进程池 OCR 引擎（见 ocr_engine.py），附加信息为 OCR 分阶段用时
+import asyncio
+import json
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from observability import get_logger, metrics
+
+# 各格式的解析库（python-docx、PyPDF2、OCR 引擎依赖的 pytesseract / Pillow）在首次处理该格式时才导入，
+# 上传落盘与 txt/doc 提取不依赖它们
+if TYPE_CHECKING:
+    from ocr_engine import OCREngine
+
+logger = get_logger("document_extractors")
+EXTRACT_SECONDS = metrics.histogram("document_extract_seconds", "单个文档文本提取耗时（秒，按格式）", ["file_type"])
+EXTRACT_ERRORS = metrics.counter("document_extract_errors_total", "文档文本提取失败次数（按格式）", ["file_type"])
+
+IMAGE_TYPES = ("jpg", "png", "bmp", "gif", "tiff")
+
+
+class ExtractionError(Exception):
+    """文本提取失败，status_code / detail 直接作为接口错误返回"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+MEMFD_PATH_PREFIX = "/dev/fd/"
+# 不超过该大小的上传才考虑写入内存文件（与 Starlette 在内存中缓冲上传内容的上限一致）
+MEMFD_MAX_BYTES = 1024 * 1024
+
+
+async def spool_upload(read: Callable[[int], Awaitable[bytes]], max_bytes: int, spool_dir: Optional[str] = None,
+                       chunk_size: int = 1024 * 1024, in_memory: bool = False) -> Tuple[str, int]:
+    """按块读取上传内容写入临时文件，返回 (文件路径, 字节数)；超过 max_bytes 时删除文件并抛出 413
+    in_memory=True 且系统支持 memfd 时写入内存文件，返回 /dev/fd/N，不落盘；用完后统一调用 release_upload"""
+    memfd = in_memory and hasattr(os, "memfd_create")
+    if memfd:
+        fd = os.memfd_create("upload")
+        path = f"{MEMFD_PATH_PREFIX}{fd}"
+    else:
+        fd, path = tempfile.mkstemp(prefix="upload-", dir=spool_dir)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb", closefd=not memfd) as out:
+            while True:
+                chunk = await read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ExtractionError(
+                        413, f"文件过大！文件大小不能超过{max_bytes / (1024 * 1024):.0f}MB"
+                    )
+                out.write(chunk)
+    except BaseException:
+        release_upload(path)
+        raise
+    return path, size
+
+
+def release_upload(path: str) -> None:
+    """删除 spool_upload 写入的临时文件，内存文件则关闭其描述符"""
+    if path.startswith(MEMFD_PATH_PREFIX):
+        os.close(int(path[len(MEMFD_PATH_PREFIX):]))
+    else:
+        os.unlink(path)
+
+
+class _BodyTooLarge(Exception):
+    """请求体超过上限，由 UploadSizeLimitMiddleware 转为 413"""
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI 中间件：在接收上传的过程中限制请求体大小，超限立即返回 413
+
+    FastAPI 在进入接口前就把 multipart 请求体完整解析（大文件由 Starlette 写入临时文件），接口内的大小校验
+    要等整个上传接收完才生效。这里在解析之前检查 Content-Length，并对分块传输的请求体边接收边计数，
+    超过 max_bytes 时中断接收：应用已经产生的响应（解析失败的 400 等）被丢弃，改为返回 413。
+    max_bytes 应包含 multipart 边界与各字段头部的余量，文件本身的大小仍由接口精确校验。
+    """
+
+    def __init__(self, app, path_prefixes: Sequence[str], max_bytes: int, detail: str = "请求体过大"):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.max_bytes = max_bytes
+        self.detail = detail
+
+    async def _reply(self, send):
+        body = json.dumps({"detail": self.detail}, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+        for key, value in scope.get("headers", []):
+            if key.lower() == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await self._reply(send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                return
+            response_started = response_started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reply(send)
+
+
+def _release_mapped(mm: mmap.mmap, start: int, end: int) -> None:
+    """已解码的段从进程页表中移除：映射的文件页读过后会一直计入 RSS，不释放时峰值内存随文件大小增长"""
+    if hasattr(mmap, "MADV_DONTNEED"):
+        start -= start % mmap.PAGESIZE
+        end -= end % mmap.PAGESIZE
+        if end > start:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def _memfd_fds(path: str) -> Tuple[int, ...]:
+    return (int(path[len(MEMFD_PATH_PREFIX):]),) if path.startswith(MEMFD_PATH_PREFIX) else ()
+
+
+def _extract_pdf_pages(path: str, start: int, stop: int) -> List[Tuple[str, float]]:
+    """提取第 [start, stop) 页的文本及每页提取耗时（在进程池中执行）"""
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        # 传入文件对象而非路径，PyPDF2 按需读取，不把整个文件读入内存
+        reader = PyPDF2.PdfReader(f)
+        pages = []
+        for i in range(start, stop):
+            page_start = time.time()
+            pages.append((_page_text(reader.pages[i].extract_text()), time.time() - page_start))
+    return pages
+
+
+def _page_text(text: Optional[str]) -> str:
+    """PDF 页文本以换行结尾，逐页拼接即为全文；无法提取文本的页为空"""
+    return text + "\n" if text else ""
+
+
+def _extract_docx(path: str) -> str:
+    import docx
+
+    doc = docx.Document(path)
+    return "\n".join([para.text for para in doc.paragraphs])
+
+
+def _segment_end(mm: mmap.mmap, start: int, limit: int) -> int:
+    """txt 分段的结束位置：优先对齐到 limit 之前最后一个换行，否则退到 UTF-8 字符边界"""
+    if limit >= len(mm):
+        return len(mm)
+    newline = mm.rfind(b"\n", start, limit)
+    if newline >= 0:
+        return newline + 1
+    end = limit
+    while end > start and (mm[end] & 0xC0) == 0x80:  # 不从多字节字符中间切开
+        end -= 1
+    return end if end > start else limit
+
+
+class DocumentExtractor:
+    """统一的文档提取入口，并按格式统计提取耗时"""
+
+    # 每种格式保留最近的耗时样本数（用于计算 p95）
+    LATENCY_SAMPLES = 256
+
+    def __init__(self, ocr_engine: Optional["OCREngine"] = None):
+        self.pdf_parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+        self.pdf_workers = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.pdf_pages_per_task = 8
+        self.txt_segment_bytes = int(os.getenv("TXT_SEGMENT_BYTES", str(1024 * 1024)))
+        self.antiword_concurrency = int(os.getenv("ANTIWORD_CONCURRENCY", "4"))
+        self.antiword_timeout = float(os.getenv("ANTIWORD_TIMEOUT", "30"))
+        self._ocr_engine = ocr_engine
+        self._pdf_executor: Optional[ProcessPoolExecutor] = None
+        self._antiword_semaphore: Optional[asyncio.Semaphore] = None
+        self._antiword_running = 0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def ocr_engine(self) -> "OCREngine":
+        """进程池 OCR 引擎，首次使用时创建"""
+        if self._ocr_engine is None:
+            from ocr_engine import OCREngine
+
+            self._ocr_engine = OCREngine()
+        return self._ocr_engine
+
+    # ---------- 统一接口 ----------
+    async def iter_pages(self, file_type: str, path: str):
+        """逐页产出 (页文本, 提取耗时, 附加信息)；提前结束迭代（aclose）时未开始的提取随之取消"""
+        if file_type in IMAGE_TYPES:
+            pages = self._image_pages(path)
+        else:
+            pages = {"txt": self._txt_pages, "docx": self._docx_pages,
+                     "pdf": self._pdf_pages, "doc": self._doc_pages}[file_type](path)
+        elapsed, page_count, ok = 0.0, 0, True
+        try:
+            async for page in pages:
+                elapsed += page[1]
+                page_count += 1
+                yield page
+        except ExtractionError:
+            ok = False
+            raise
+        except Exception as e:
+            ok = False
+            raise ExtractionError(500, f"文档解析失败：{str(e)}")
+        finally:
+            await pages.aclose()
+            self._record(file_type, elapsed, page_count, ok)
+
+    # ---------- 各格式提取 ----------
+    async def _txt_pages(self, path: str):
+        """内存映射后按段解码（默认UTF-8编码，忽略无法解码的字节），常驻内存只有当前段"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield "", 0.0, None
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                while start < len(mm):
+                    decode_start = time.time()
+                    end = _segment_end(mm, start, start + self.txt_segment_bytes)
+                    text = mm[start:end].decode("utf-8", errors="ignore")
+                    _release_mapped(mm, start, end)
+                    start = end
+                    yield text, time.time() - decode_start, None
+
+    async def _docx_pages(self, path: str):
+        start = time.time()
+        text = await asyncio.get_running_loop().run_in_executor(None, _extract_docx, path)
+        yield text, time.time() - start, None
+
+    async def _pdf_pages(self, path: str):
+        """页数较少时在线程中逐页提取；页数较多时按页段提交到进程池并行提取，仍按页序产出"""
+        import PyPDF2
+
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            reader = await loop.run_in_executor(None, PyPDF2.PdfReader, f)
+            page_count = len(reader.pages)
+            if page_count < self.pdf_parallel_min_pages or self.pdf_workers <= 1:
+                for page in reader.pages:
+                    page_start = time.time()
+                    page_text = await loop.run_in_executor(None, page.extract_text)
+                    yield _page_text(page_text), time.time() - page_start, None
+                return
+
+        executor = self._get_pdf_executor()
+        step = self.pdf_pages_per_task
+        futures = [
+            loop.run_in_executor(executor, _extract_pdf_pages, path, start, min(start + step, page_count))
+            for start in range(0, page_count, step)
+        ]
+        try:
+            for future in futures:
+                for page_text, elapsed in await future:
+                    yield page_text, elapsed, None
+        except BrokenProcessPool:
+            logger.warning("PDF 提取进程池异常，已重建")
+            self._pdf_executor = None
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def _doc_pages(self, path: str):
+        start = time.time()
+        text = await self._run_antiword(path)
+        yield text, time.time() - start, None
+
+    async def _image_pages(self, path: str):
+        try:
+            text, ocr_stats = await self.ocr_engine.recognize(path)
+        except Exception as ocr_error:
+            raise ExtractionError(500, f"OCR识别失败：{str(ocr_error)}。请确保图片清晰且包含可识别的文字内容。")
+        logger.debug("OCR识别结果长度: %d，用时: %sms", len(text), ocr_stats['total_time'])
+        yield text, ocr_stats['total_time'] / 1000, ocr_stats
+
+    # ---------- antiword ----------
+    async def _run_antiword(self, path: str) -> str:
+        """在 asyncio 子进程中运行 antiword 读取上传文件；并发数受 ANTIWORD_CONCURRENCY 限制，超时或取消时终止子进程
+        内存文件（/dev/fd/N）的描述符按原编号传给子进程（antiword 需要可随机访问的输入，不能直接读 stdin）"""
+        if self._antiword_semaphore is None:
+            self._antiword_semaphore = asyncio.Semaphore(self.antiword_concurrency)
+        async with self._antiword_semaphore:
+            self._antiword_running += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    "antiword", path,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    pass_fds=_memfd_fds(path),
+                )
+                try:
+                    stdout, stderr = await asyncio.wait_for(proc.communicate(), self.antiword_timeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                    proc.kill()
+                    await proc.wait()
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    raise ExtractionError(500, "DOC文件解析超时，文件可能过大或格式异常。")
+            except FileNotFoundError:
+                raise ExtractionError(500, "antiword工具未安装。请重新构建Docker镜像以确保antiword工具已正确安装。")
+            finally:
+                self._antiword_running -= 1
+
+        if proc.returncode != 0:
+            reason = f"antiword执行失败：{stderr.decode('utf-8', errors='ignore').strip()}"
+        else:
+            text = stdout.decode("utf-8", errors="ignore")
+            if text.strip():
+                return text
+            reason = "antiword无法从DOC文件中提取文本内容"
+        raise ExtractionError(400, f"DOC文件解析失败：{reason}。建议将DOC文件转换为DOCX格式后重新上传。")
+
+    # ---------- 进程池与统计 ----------
+    def _get_pdf_executor(self) -> ProcessPoolExecutor:
+        if self._pdf_executor is None:
+            # forkserver 启动：进程池在请求处理中才创建，直接 fork 会复制其他线程持有的锁；
+            # 工作进程只需导入本模块，按路径重新打开 PDF
+            self._pdf_executor = ProcessPoolExecutor(
+                max_workers=self.pdf_workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return self._pdf_executor
+
+    def _record(self, file_type: str, elapsed: float, page_count: int, ok: bool):
+        with self._lock:
+            stats = self._stats.setdefault(file_type, {
+                "count": 0, "errors": 0, "pages": 0, "latencies": deque(maxlen=self.LATENCY_SAMPLES)
+            })
+            stats["count"] += 1
+            stats["pages"] += page_count
+            if ok:
+                stats["latencies"].append(elapsed * 1000)
+            else:
+                stats["errors"] += 1
+        if ok:
+            EXTRACT_SECONDS.observe(elapsed, file_type=file_type)
+        else:
+            EXTRACT_ERRORS.inc(file_type=file_type)
+
+    def get_stats(self) -> Dict[str, Any]:
+        formats = {}
+        with self._lock:
+            for file_type, stats in self._stats.items():
+                samples = sorted(stats["latencies"])
+                formats[file_type] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "pages": stats["pages"],
+                    "avg_ms": round(sum(samples) / len(samples), 2) if samples else None,
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else None,
+                    "max_ms": round(samples[-1], 2) if samples else None,
+                }
+        return {
+            "formats": formats,  # 按格式统计的提取耗时（最近 LATENCY_SAMPLES 次成功提取）
+            "antiword": {"running": self._antiword_running, "limit": self.antiword_concurrency},
+            "pdf_workers": self.pdf_workers,
+            "ocr_workers": self.ocr_engine.workers,
+        }
+
+    def shutdown(self):
+        if self._pdf_executor is not None:
+            self._pdf_executor.shutdown(wait=False, cancel_futures=True)
+            self._pdf_executor = None
+        if self._ocr_engine is not None:
+            self._ocr_engine.shutdown()
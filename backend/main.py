@@ -1,25 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware  # 解决前端跨域问题
 from fastapi.staticfiles import StaticFiles  # 静态文件服务
-from fastapi.responses import FileResponse  # 文件响应
+from fastapi.responses import FileResponse, Response  # 文件响应
 from pydantic import BaseModel  # 校验请求参数格式
-from typing import List, Optional, Dict, Any
-import docx  # 解析docx文档
-import PyPDF2  # 解析pdf文档
-import docx2txt  # 解析doc文档
-import pytesseract  # OCR文字识别
-from PIL import Image  # 图像处理
+from typing import List, Optional, Dict, Any, Tuple
 import os
 import json
-import requests
-from io import BytesIO
 import glob
+import hashlib
 from datetime import datetime
 import time
-import subprocess  # 用于调用antiword工具
-import tempfile  # 用于创建临时文件
 import asyncio
 import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from document_extractors import (  # 上传落盘与各格式文档的非阻塞文本提取
+    MEMFD_MAX_BYTES, DocumentExtractor, ExtractionError, UploadSizeLimitMiddleware, release_upload, spool_upload
+)
+from observability import (  # 结构化日志、Prometheus 指标与请求追踪
+    get_logger, metrics, MetricsMiddleware, MetricsRegistry, TraceMiddleware, ProfileStore, current_trace, trace_span,
+    add_span
+)
+from llm_client import OllamaClient, VerdictCache, SingleFlight, LLMDispatcher, LLMQueueFullError, get_model_name  # 带连接池的 Ollama 异步客户端、调度队列与判定缓存
+from rule_engine import PatchedAutomaton, text_preprocessor, library_fingerprint  # 增量自动机、文本预处理与词库指纹
+from detection_engine import (  # 规则匹配引擎与规则匹配工作进程入口
+    ThreeStepFilter, RuleStream, init_rule_worker, worker_detect
+)
+
+logger = get_logger("main")
 
 # 1. 初始化FastAPI应用
 app = FastAPI(title="敏感词检测", version="1.0", docs_url="/api/docs", redoc_url="/api/redoc")
@@ -47,79 +57,194 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 在途请求数与请求耗时（/metrics）
+app.add_middleware(MetricsMiddleware)
+# 检测接口的阶段耗时追踪（Server-Timing 响应头、trace 字段）与持调试令牌的单请求性能采集（见 /debug/profiles）
+profile_store = ProfileStore(max_entries=int(os.getenv("DEBUG_PROFILE_MAX_ENTRIES", "16")))
+app.add_middleware(TraceMiddleware, profile_store=profile_store)
+
+# ---------------------- 指标 ----------------------
+# 各阶段耗时直方图与检测流程计数，队列与在途数在采集时从各组件的统计中读取（见文件末尾 /metrics）
+RULE_STAGE_SECONDS = metrics.histogram("rule_stage_seconds", "规则匹配各阶段耗时（秒）：preprocess / ac / dfa / total",
+                                       ["stage"])
+LLM_REVIEW_SECONDS = metrics.histogram("llm_review_seconds", "单次大模型复核耗时（秒，含缓存与请求合并）", ["outcome"])
+DETECTION_FLOW = metrics.counter("detection_flow_total", "检测流程（detection_flow）分布", ["endpoint", "flow"])
+LLM_ESCALATIONS = metrics.counter("llm_escalations_total", "升级到大模型复核的检测数（除以 detection_flow_total 即升级率）",
+                                  ["endpoint"])
+# 需要大模型复核的检测流程
+LLM_FLOWS = ("strict_mode", "rule_then_llm")
+
+
+def observe_rule_timing(result: Dict[str, Any]):
+    """记录一次规则匹配的各阶段耗时到指标与当前请求的追踪中；AC 已命中时跳过了 DFA，不计入 dfa
+
+    timing_ns 为规则引擎返回的内部字段（纳秒），记录后从结果中移除。
+    """
+    timing_ns = result.pop('timing_ns')
+    RULE_STAGE_SECONDS.observe(timing_ns['normalize'] / 1e9, stage="preprocess")
+    RULE_STAGE_SECONDS.observe(timing_ns['ac'] / 1e9, stage="ac")
+    add_span("normalize", timing_ns['normalize'])
+    add_span("ac", timing_ns['ac'])
+    if not result['ac_results']:
+        RULE_STAGE_SECONDS.observe(timing_ns['dfa'] / 1e9, stage="dfa")
+        add_span("dfa", timing_ns['dfa'])
+    RULE_STAGE_SECONDS.observe(sum(timing_ns.values()) / 1e9, stage="total")
+
+
+def attach_trace(response: Dict[str, Any], trace: bool) -> Dict[str, Any]:
+    """trace=true 时在 data.trace 中返回本次请求的阶段耗时（与 Server-Timing 响应头同源）"""
+    request_trace = current_trace()
+    if trace and request_trace is not None:
+        response["data"]["trace"] = request_trace.to_dict()
+    return response
+
+
+def record_detection(endpoint: str, flow: str, count: int = 1):
+    """记录检测流程；需要大模型复核的流程同时计入升级数"""
+    if count:
+        DETECTION_FLOW.inc(count, endpoint=endpoint, flow=flow)
+        if flow in LLM_FLOWS:
+            LLM_ESCALATIONS.inc(count, endpoint=endpoint)
 
 # ---------------------- 敏感词库管理 ----------------------
 class WordLibraryManager:
-    """敏感词库管理器"""
+    """敏感词库管理器
+
+    词库元数据（词数、大小、内容哈希、修改时间）缓存在词库目录下的索引文件中：增删改词库时同步更新，
+    列表接口只对每个词库做一次 stat，修改时间或大小与索引一致时不读取文件内容；
+    仅当文件在服务外被修改（如直接编辑挂载卷）时才重新读取该文件。
+    """
     
-    def __init__(self, base_path="/app/word_libraries"):
+    def __init__(self, base_path="/app/word_libraries", index_path: Optional[str] = None):
         self.base_path = base_path
         self.ensure_base_directory()
+        self.index_path = index_path or os.path.join(base_path, ".library_index.json")
+        self._index_lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
     
     def ensure_base_directory(self):
         """确保基础目录存在"""
         if not os.path.exists(self.base_path):
             os.makedirs(self.base_path, exist_ok=True)
     
+    # ---------------------- 元数据索引 ----------------------
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        """读取元数据索引；文件不存在或损坏时返回空索引（下次列表时按需重建）"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == 1 and isinstance(data.get("libraries"), dict):
+                return data["libraries"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"词库元数据索引读取失败，将重新生成: {e}")
+        return {}
+    
+    def _save_index(self):
+        """原子写入元数据索引（先写临时文件再替换），调用方需持有 _index_lock"""
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "libraries": self._index}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"词库元数据索引写入失败: {e}")
+    
+    @staticmethod
+    def _index_entry(stat: os.stat_result, word_count: int, digest: str) -> Dict[str, Any]:
+        return {
+            "word_count": word_count,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+        }
+    
+    def _scan_file(self, file_path: str, stat: os.stat_result) -> Dict[str, Any]:
+        """读取一次文件，计算词数与内容哈希（与快照键 library_fingerprint 使用同一哈希）"""
+        try:
+            with open(file_path, "rb") as f:
+                content = f.read()
+        except OSError:
+            return self._index_entry(stat, 0, "")
+        word_count = self._count_words(content.decode("utf-8", errors="replace").splitlines())
+        return self._index_entry(stat, word_count, hashlib.sha256(content).hexdigest())
+    
+    @staticmethod
+    def _count_words(lines) -> int:
+        return sum(1 for line in lines if line.strip())
+    
+    def _library_info(self, name: str, file_path: str, stat: os.stat_result, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": name,
+            "name": name,
+            "filename": f"{name}.txt",
+            "path": file_path,
+            "word_count": entry["word_count"],
+            "created_time": datetime.fromtimestamp(stat.st_ctime).isoformat(),
+            "modified_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            "size": stat.st_size,
+            "sha256": entry["sha256"],
+        }
+    
     def get_library_list(self) -> List[Dict[str, Any]]:
-        """获取所有敏感词库列表"""
+        """获取所有敏感词库列表（元数据来自索引，只对修改时间或大小变化的文件重新读取）"""
         libraries = []
-        
-        # 扫描所有.txt文件
-        pattern = os.path.join(self.base_path, "*.txt")
-        for file_path in glob.glob(pattern):
-            filename = os.path.basename(file_path)
-            name = os.path.splitext(filename)[0]
-            
-            # 获取文件信息
-            stat = os.stat(file_path)
-            word_count = self._count_words_in_file(file_path)
+        with self._index_lock:
+            changed = False
+            seen = set()
+            with os.scandir(self.base_path) as entries:
+                for dir_entry in entries:
+                    if not dir_entry.name.endswith(".txt") or not dir_entry.is_file():
+                        continue
+                    filename = dir_entry.name
+                    name = os.path.splitext(filename)[0]
+                    stat = dir_entry.stat()
+                    seen.add(filename)
+                    
+                    entry = self._index.get(filename)
+                    if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                        entry = self._scan_file(dir_entry.path, stat)
+                        self._index[filename] = entry
+                        changed = True
+                    libraries.append(self._library_info(name, dir_entry.path, stat, entry))
             
-            libraries.append({
-                "id": name,
-                "name": name,
-                "filename": filename,
-                "path": file_path,
-                "word_count": word_count,
-                "created_time": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                "modified_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                "size": stat.st_size
-            })
+            # 清理已被删除的词库
+            for filename in [f for f in self._index if f not in seen]:
+                del self._index[filename]
+                changed = True
+            if changed:
+                self._save_index()
         
         return sorted(libraries, key=lambda x: x["name"])
     
-    def _count_words_in_file(self, file_path: str) -> int:
-        """统计文件中的敏感词数量"""
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                return len([line.strip() for line in f if line.strip()])
-        except:
-            return 0
+    def get_library_paths(self) -> List[str]:
+        """获取所有敏感词库文件路径（按名称排序）"""
+        return sorted(glob.glob(os.path.join(self.base_path, "*.txt")))
     
-    def create_library(self, name: str, words: List[str]) -> Dict[str, Any]:
-        """创建新的敏感词库"""
+    def _write_library(self, name: str, words: List[str]) -> Dict[str, Any]:
+        """写入词库文件并同步更新索引：词数与哈希由写入内容直接计算，无需回读文件"""
         filename = f"{name}.txt"
         file_path = os.path.join(self.base_path, filename)
+        content = "".join(word.strip() + "\n" for word in words).encode("utf-8")
+        with open(file_path, "wb") as f:
+            f.write(content)
+        stat = os.stat(file_path)
+        entry = self._index_entry(stat, self._count_words(words), hashlib.sha256(content).hexdigest())
+        with self._index_lock:
+            self._index[filename] = entry
+            self._save_index()
+        return self._library_info(name, file_path, stat, entry)
+    
+    def create_library(self, name: str, words: List[str]) -> Dict[str, Any]:
+        """创建新的敏感词库"""
+        file_path = os.path.join(self.base_path, f"{name}.txt")
         
         # 检查是否已存在
         if os.path.exists(file_path):
             raise HTTPException(status_code=400, detail=f"敏感词库 '{name}' 已存在")
         
-        # 写入文件
-        with open(file_path, "w", encoding="utf-8") as f:
-            for word in words:
-                f.write(word.strip() + "\n")
-        
-        return {
-            "id": name,
-            "name": name,
-            "filename": filename,
-            "path": file_path,
-            "word_count": len(words),
-            "created_time": datetime.now().isoformat(),
-            "modified_time": datetime.now().isoformat(),
-            "size": os.path.getsize(file_path)
-        }
+        return self._write_library(name, words)
     
     def delete_library(self, name: str) -> bool:
         """删除敏感词库"""
@@ -130,6 +255,9 @@ class WordLibraryManager:
             raise HTTPException(status_code=404, detail=f"敏感词库 '{name}' 不存在")
         
         os.remove(file_path)
+        with self._index_lock:
+            if self._index.pop(filename, None) is not None:
+                self._save_index()
         return True
     
     def get_library_content(self, name: str) -> List[str]:
@@ -145,52 +273,15 @@ class WordLibraryManager:
     
     def update_library(self, name: str, words: List[str]) -> Dict[str, Any]:
         """更新敏感词库"""
-        filename = f"{name}.txt"
-        file_path = os.path.join(self.base_path, filename)
+        file_path = os.path.join(self.base_path, f"{name}.txt")
         
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail=f"敏感词库 '{name}' 不存在")
         
-        # 写入文件
-        with open(file_path, "w", encoding="utf-8") as f:
-            for word in words:
-                f.write(word.strip() + "\n")
-        
-        return {
-            "id": name,
-            "name": name,
-            "filename": filename,
-            "path": file_path,
-            "word_count": len(words),
-            "modified_time": datetime.now().isoformat(),
-            "size": os.path.getsize(file_path)
-        }
-
-# OCR配置和预处理函数
-def preprocess_image_for_ocr(image):
-    """预处理图片以提高OCR识别率"""
-    # 转换为RGB模式
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # 可以添加更多预处理步骤，如：
-    # - 调整对比度
-    # - 去噪
-    # - 二值化
-    # - 倾斜校正等
-    
-    return image
-
-def get_ocr_config():
-    """获取OCR配置参数"""
-    return {
-        'lang': 'chi_sim+eng',  # 支持中文简体和英文
-        'config': '--psm 6 --oem 3',  # PSM 6: 统一文本块, OEM 3: 默认引擎
-        'char_whitelist': None  # 移除字符白名单限制，允许识别所有字符
-    }
+        return self._write_library(name, words)
 
 # 初始化敏感词库管理器
-word_lib_manager = WordLibraryManager()
+word_lib_manager = WordLibraryManager(index_path=os.getenv("WORD_LIBRARY_INDEX_PATH") or None)
 
 # 检测词库持久化管理
 class DetectionLibraryManager:
@@ -207,7 +298,7 @@ class DetectionLibraryManager:
                 with open(self.config_path, "r", encoding="utf-8") as f:
                     return json.load(f)
         except Exception as e:
-            print(f"加载检测配置失败: {e}")
+            logger.warning(f"加载检测配置失败: {e}")
         
         # 默认配置
         return {
@@ -228,19 +319,18 @@ class DetectionLibraryManager:
                 json.dump(config, f, ensure_ascii=False, indent=2)
             # 更新内存中的配置
             self.config = config
-            print(f"检测配置已保存: 使用 {len(used_libraries)} 个词库，共 {word_count} 个敏感词")
+            logger.info(f"检测配置已保存: 使用 {len(used_libraries)} 个词库，共 {word_count} 个敏感词")
         except Exception as e:
-            print(f"保存检测配置失败: {e}")
+            logger.error(f"保存检测配置失败: {e}")
     
     def reload_config(self):
         """重新加载配置文件"""
-        print(f"开始重新加载配置文件: {self.config_path}")
+        logger.info(f"开始重新加载配置文件: {self.config_path}")
         old_config = self.config.copy() if self.config else {}
         self.config = self.load_config()
-        print(f"重新加载检测配置完成:")
-        print(f"  旧配置: {old_config}")
-        print(f"  新配置: {self.config}")
-        print(f"  配置文件是否存在: {os.path.exists(self.config_path)}")
+        logger.info("重新加载检测配置完成", extra={
+            "old_config": old_config, "new_config": self.config, "config_exists": os.path.exists(self.config_path)
+        })
     
     def get_used_libraries(self):
         """获取当前使用的词库列表"""
@@ -261,427 +351,39 @@ model_warm_up_status = {
 }
 
 
-# ---------------------- Ollama 地址解析与缓存 ----------------------
-# 说明：为适配不同部署环境（Docker 内、宿主机、本机直跑），在运行时动态解析并缓存可用的
-# Ollama 基础地址，避免因网络拓扑差异导致的连接失败。
-_OLLAMA_RESOLVED_BASE_URL: Optional[str] = None
-
-def _build_ollama_candidates() -> List[str]:
-    """按优先级构建候选 Ollama 基础地址列表，并去重。"""
-    env_url = os.getenv("OLLAMA_BASE_URL")
-    candidates = []
-    if env_url:
-        candidates.append(env_url.rstrip("/"))
-    # 与 start.sh 对齐的回退顺序
-    candidates.extend([
-        "http://ollama:11434",
-        "http://host.docker.internal:11434",
-        "http://172.17.0.1:11434",
-        "http://localhost:11434",
-    ])
-    # 去重保序
-    seen = set()
-    ordered = []
-    for url in candidates:
-        u = url.rstrip("/")
-        if u and u not in seen:
-            ordered.append(u)
-            seen.add(u)
-    return ordered
-
-def resolve_ollama_base_url(timeout: float = 2.0) -> str:
-    """探测候选地址并缓存首个可用地址；若均不可用则回退到首个候选。"""
-    global _OLLAMA_RESOLVED_BASE_URL
-    candidates = _build_ollama_candidates()
-    for url in candidates:
-        probe = f"{url}/api/tags"
-        try:
-            resp = requests.get(probe, timeout=timeout)
-            if resp.ok:
-                _OLLAMA_RESOLVED_BASE_URL = url
-                print(f"已解析Ollama地址: {url}")
-                return url
-        except Exception as e:
-            print(f"Ollama地址探测失败: {url} -> {type(e).__name__}: {e}")
-    fallback = candidates[0] if candidates else "http://172.17.0.1:11434"
-    print(f"未能确认Ollama可用地址，回退使用: {fallback}")
-    _OLLAMA_RESOLVED_BASE_URL = fallback
-    return fallback
-
-def get_ollama_base_url() -> str:
-    """获取已解析或即时解析的 Ollama 基础地址。"""
-    return _OLLAMA_RESOLVED_BASE_URL or resolve_ollama_base_url()
-
-
-# ---------------------- 双重匹配规则引擎 ----------------------
-
-# 第一步：AC自动机初筛 - 快速过滤无风险文本，标记可疑文本
-class ACNode:
-    def __init__(self):
-        self.children = {}
-        self.fail = None
-        self.is_end = False
-        self.word = None
-        self.output = []
-
-class ACAutomaton:
-    def __init__(self, words):
-        self.root = ACNode()
-        self.words = words
-        # 添加敏感词到AC自动机
-        for word in words:
-                        self.add_word(word)
-        self.build_fail_links()
-
-    def add_word(self, word):
-        """添加敏感词到AC自动机"""
-        node = self.root
-        for char in word:
-            if char not in node.children:
-                node.children[char] = ACNode()
-            node = node.children[char]
-        node.is_end = True
-        node.word = word
-        node.output.append(word)
-
-    def build_fail_links(self):
-        """构建失败链接"""
-        from collections import deque
-        queue = deque()
-        
-        # 第一层节点的fail指针指向root
-        for child in self.root.children.values():
-            child.fail = self.root
-            queue.append(child)
-        
-        # 构建其他层的fail指针
-        while queue:
-            current = queue.popleft()
-            for char, child in current.children.items():
-                queue.append(child)
-                fail_node = current.fail
-                while fail_node and char not in fail_node.children:
-                    fail_node = fail_node.fail
-                if fail_node:
-                    child.fail = fail_node.children.get(char, self.root)
-                else:
-                    child.fail = self.root
-                # 合并输出
-                child.output.extend(child.fail.output)
-
-    def search(self, text):
-        """AC自动机搜索，返回可疑文本片段和匹配的敏感词"""
-        results = []
-        suspicious_segments = []
-        current = self.root
-        
-        for i, char in enumerate(text):
-            # 沿着fail链找到匹配的节点
-            while current and char not in current.children:
-                current = current.fail
-            if current:
-                current = current.children.get(char, self.root)
-            else:
-                current = self.root
-            
-            # 检查当前节点及其fail链上的输出
-            temp = current
-            while temp:
-                for word in temp.output:
-                    results.append(word)
-                    # 标记可疑文本片段（向前扩展一些字符以捕获上下文）
-                    start = max(0, i - len(word) - 5)
-                    end = min(len(text), i + 5)
-                    suspicious_segments.append(text[start:end])
-                temp = temp.fail
-        
-        return list(set(results)), list(set(suspicious_segments))
-
-# 第二步：DFA检测 - 对可疑文本进行精准验证
-class DFAFilter:
-    def __init__(self, words):
-        self.words = words
-        # 记录接受状态对应的词，用于可选的边界/容噪判断
-        self.accepting_state_to_word = {}
-        self.dfa = self.build_dfa()
-
-    def build_dfa(self):
-        """构建DFA状态机"""
-        dfa = {}
-        state = 0
-        
-        for word in self.words:
-            current_state = 0
-            for char in word:
-                if (current_state, char) not in dfa:
-                    state += 1
-                    dfa[(current_state, char)] = state
-                current_state = dfa[(current_state, char)]
-            # 标记终态
-            dfa[(current_state, '')] = -1  # -1表示终态
-            self.accepting_state_to_word[current_state] = word
-        
-        return dfa
-    
-    def _is_cjk(self, ch: str) -> bool:
-        return '\u4e00' <= ch <= '\u9fff'
-    
-    def _is_noise_ascii(self, ch: str) -> bool:
-        # 作为中文间隙的“噪声”字符：ASCII 的字母数字（不含下划线）
-        # 提示：容噪仅在中文词内部生效，用于提升插字规避样例的召回
-        return bool(ch) and (ch.isalnum()) and not self._is_cjk(ch)
-    
-    def precise_match(self, text, suspicious_segments, noise_tolerant: bool = False):
-        """对可疑文本片段进行DFA精准匹配"""
-        precise_results = []
-        
-        for segment in suspicious_segments:
-            for i in range(len(segment)):
-                current_state = 0
-                total_skips = 0
-                j = i
-                while j < len(segment):
-                    char = segment[j]
-                    if (current_state, char) in self.dfa:
-                        current_state = self.dfa[(current_state, char)]
-                        if (current_state, '') in self.dfa:  # 到达终态
-                            precise_results.append(segment[i:j+1])
-                        j += 1
-                        continue
-                    
-                    # 可选：容噪匹配（中文词内部允许跳过少量 ASCII 字母/数字）
-                    if noise_tolerant:
-                        # 经调优参数：单次连续最多跳过 10 个，整段累计最多跳过 100 个
-                        # 旨在处理“敏q感q词”等插字规避情形
-                        MAX_GAP_SKIPS = 10   # 单次间隙最多跳过
-                        MAX_TOTAL_SKIPS = 100 # 整段最多跳过
-                        if total_skips < MAX_TOTAL_SKIPS and self._is_noise_ascii(char):
-                            gap = 0
-                            # 跳过连续的少量ASCII噪声
-                            while j < len(segment) and self._is_noise_ascii(segment[j]) and gap < MAX_GAP_SKIPS and total_skips < MAX_TOTAL_SKIPS:
-                                j += 1
-                                gap += 1
-                                total_skips += 1
-                            # 跳过后不改变 current_state，继续用新的 j 位置匹配
-                            continue
-                    
-                    # 既不是可跳过的噪声，也没有有效转移，则终止该起点
-                    break
-        
-        return list(set(precise_results))
+# ---------------------- Ollama 客户端 ----------------------
+# 说明：为适配不同部署环境（Docker 内、宿主机、本机直跑），客户端在运行时动态解析并缓存可用的
+# Ollama 基础地址；地址探测与检测调用共用同一个 keep-alive 连接池，调用不阻塞事件循环（见 llm_client.py）。
+ollama_client = OllamaClient()
 
-# 文本预处理 - 统一字符格式，消除"无意义变体"
-class TextPreprocessor:
-    def __init__(self):
-        """文本预处理器，用于统一字符格式，消除无意义变体"""
-        self.setup_normalization_rules()
-    
-    def setup_normalization_rules(self):
-        """设置字符归一化规则"""
-        # 全角转半角映射
-        self.full_to_half = {
-            'Ａ': 'A', 'Ｂ': 'B', 'Ｃ': 'C', 'Ｄ': 'D', 'Ｅ': 'E', 'Ｆ': 'F', 'Ｇ': 'G', 'Ｈ': 'H',
-            'Ｉ': 'I', 'Ｊ': 'J', 'Ｋ': 'K', 'Ｌ': 'L', 'Ｍ': 'M', 'Ｎ': 'N', 'Ｏ': 'O', 'Ｐ': 'P',
-            'Ｑ': 'Q', 'Ｒ': 'R', 'Ｓ': 'S', 'Ｔ': 'T', 'Ｕ': 'U', 'Ｖ': 'V', 'Ｗ': 'W', 'Ｘ': 'X',
-            'Ｙ': 'Y', 'Ｚ': 'Z',
-            'ａ': 'a', 'ｂ': 'b', 'ｃ': 'c', 'ｄ': 'd', 'ｅ': 'e', 'ｆ': 'f', 'ｇ': 'g', 'ｈ': 'h',
-            'ｉ': 'i', 'ｊ': 'j', 'ｋ': 'k', 'ｌ': 'l', 'ｍ': 'm', 'ｎ': 'n', 'ｏ': 'o', 'ｐ': 'p',
-            'ｑ': 'q', 'ｒ': 'r', 'ｓ': 's', 'ｔ': 't', 'ｕ': 'u', 'ｖ': 'v', 'ｗ': 'w', 'ｘ': 'x',
-            'ｙ': 'y', 'ｚ': 'z',
-            '０': '0', '１': '1', '２': '2', '３': '3', '４': '4', '５': '5', '６': '6', '７': '7',
-            '８': '8', '９': '9',
-            '（': '(', '）': ')', '［': '[', '］': ']', '｛': '{', '｝': '}', '＜': '<', '＞': '>',
-            '，': ',', '。': '.', '；': ';', '：': ':', '？': '?', '！': '!', '～': '~', '＠': '@',
-            '＃': '#', '＄': '$', '％': '%', '＾': '^', '＆': '&', '＊': '*', '－': '-', '＿': '_',
-            '＋': '+', '＝': '=', '｜': '|', '＼': '\\', '／': '/', '　': ' '
-        }
-        
-        # 繁体转简体映射（常用字，后续可根据需要扩展）
-        self.traditional_to_simplified = {
-            '學': '学', '習': '习', '經': '经', '濟': '济', '發': '发', '現': '现', '實': '实',
-            '際': '际', '電': '电', '腦': '脑', '網': '网', '絡': '络', '資': '资', '訊': '讯',
-            '話': '话', '視': '视', '影': '影', '軟': '软', '體': '体', '硬': '硬', '系': '系',
-            '統': '统', '件': '件', '程': '程', '式': '式', '設': '设', '計': '计', '開': '开',
-            '測': '测', '試': '试', '維': '维', '護': '护', '管': '管', '理': '理', '服': '服',
-            '務': '务', '產': '产', '品': '品', '質': '质', '量': '量', '標': '标', '準': '准',
-            '規': '规', '範': '范', '誌': '志', '識': '识', '別': '别', '區': '区', '分': '分',
-            '類': '类', '型': '型', '種': '种', '級': '级', '層': '层', '次': '次', '順': '顺',
-            '序': '序', '排': '排', '列': '列', '組': '组', '合': '合', '配': '配', '置': '置',
-            '定': '定', '選': '选', '擇': '择', '決': '决', '確': '确', '認': '认', '證': '证',
-            '驗': '验', '明': '明', '據': '据', '書': '书', '照': '照', '券': '券', '票': '票'
-        }
-    
-    def normalize_text(self, text):
-        """文本归一化处理"""
-        if not text:
-            return text
-        
-        # 1. 全角转半角
-        normalized = text
-        for full_char, half_char in self.full_to_half.items():
-            normalized = normalized.replace(full_char, half_char)
-        
-        # 2. 繁体转简体
-        for trad_char, simp_char in self.traditional_to_simplified.items():
-            normalized = normalized.replace(trad_char, simp_char)
-        
-        # 3. 移除特殊符号（保留中文字符、英文字母、数字）
-        cleaned = ""
-        for char in normalized:
-            if (char.isalnum() or  # 字母或数字
-                '\u4e00' <= char <= '\u9fff'):  # 中文字符
-                cleaned += char
-        
-        return cleaned
-    
-    def preprocess_text(self, text):
-        """预处理文本，返回归一化文本"""
-        return self.normalize_text(text)
-
-# 规则匹配引擎整合（预处理+AC+DFA）
-class ThreeStepFilter:
-    def __init__(self, word_paths=None):
-        if word_paths is None:
-            # 默认使用word_libraries目录中的所有词库
-            word_paths = []
-            base_path = "/app/word_libraries"
-            if os.path.exists(base_path):
-                for filename in os.listdir(base_path):
-                    if filename.endswith('.txt'):
-                        word_paths.append(os.path.join(base_path, filename))
-        self.word_paths = word_paths
-        self.words = []
-        self._load_words()
-        # 文本预处理器
-        self.text_preprocessor = TextPreprocessor()
-        # 第一步：AC自动机
-        self.ac_automaton = ACAutomaton(self.words)
-        # 第二步：DFA检测
-        self.dfa_filter = DFAFilter(self.words)
-
-    def _load_words(self):
-        """加载敏感词并自动去重"""
-        all_words = []
-        word_sources = {}  # 记录每个词来自哪些词库
-        
-        for word_path in self.word_paths:
-            if os.path.exists(word_path):
-                library_name = os.path.splitext(os.path.basename(word_path))[0]
-                with open(word_path, "r", encoding="utf-8") as f:
-                    for word in f:
-                        word = word.strip()
-                        if word:
-                            all_words.append(word)
-                            # 记录词库来源
-                            if word not in word_sources:
-                                word_sources[word] = []
-                            word_sources[word].append(library_name)
-            else:
-                print(f"警告：敏感词库文件 {word_path} 不存在")
-        
-        # 去重并统计
-        original_count = len(all_words)
-        self.words = list(set(all_words))  # 自动去重
-        deduplicated_count = len(self.words)
-        removed_count = original_count - deduplicated_count
-        
-        # 打印去重统计信息
-        if removed_count > 0:
-            print(f"词库去重完成：原始 {original_count} 个词，去重后 {deduplicated_count} 个词，删除重复词 {removed_count} 个")
-            
-            # 显示重复词及其来源（仅显示前10个）
-            duplicates = [word for word, sources in word_sources.items() if len(sources) > 1]
-            if duplicates:
-                print("重复词示例（前10个）:")
-                for i, word in enumerate(duplicates[:10]):
-                    sources = word_sources[word]
-                    print(f"  '{word}' 出现在: {', '.join(sources)}")
-                if len(duplicates) > 10:
-                    print(f"  ... 还有 {len(duplicates) - 10} 个重复词")
-        else:
-            print(f"词库加载完成：共 {deduplicated_count} 个词，无重复词")
-
-    def reload_with_libraries(self, library_names: List[str]):
-        """重新加载指定的敏感词库"""
-        word_paths = []
-        for name in library_names:
-            file_path = os.path.join(word_lib_manager.base_path, f"{name}.txt")
-            if os.path.exists(file_path):
-                word_paths.append(file_path)
-        
-        if word_paths:
-            self.word_paths = word_paths
-            self._load_words()
-            # 重新初始化各个组件
-            self.text_preprocessor = TextPreprocessor()
-            self.ac_automaton = ACAutomaton(self.words)
-            self.dfa_filter = DFAFilter(self.words)
-
-    def detect(self, text):
-        """规则匹配检测（预处理 + AC 初筛 + 条件化 DFA）
-        
-        - 预处理：对输入文本进行字符归一化（全角转半角、繁转简、去除特殊符号），供 AC 使用
-        - AC 初筛（归一化文本）：多模式匹配，快速获得 ac_results 与可疑片段 suspicious_segments
-        - 性能优先策略：
-          - 若 AC 已命中：跳过 DFA（dfa_results=[]，dfa_time=0）
-          - 若 AC 未命中：对“原始文本”启用容噪 DFA 复核，提升插字扰动场景的召回
-            - 容噪规则：仅在中文词内部允许跳过 ASCII 字母/数字（不含下划线）
-            - 默认阈值：单次连续最多跳过 10，整段累计最多跳过 100
-        - 最终结果：合并 AC 与（可选）DFA 的命中并去重
-        """
-        start_time = time.time()
-        
-        # 文本预处理：归一化字符格式
-        preprocess_start = time.time()
-        normalized_text = self.text_preprocessor.preprocess_text(text)
-        preprocess_time = time.time() - preprocess_start
-        
-        # 第一步：AC自动机初筛（对归一化文本）
-        ac_start = time.time()
-        ac_results, suspicious_segments = self.ac_automaton.search(normalized_text)
-        ac_time = time.time() - ac_start
-        
-        # 第二步：DFA检测
-        # 若 AC 未命中：启用“容噪”DFA对全文作为单一片段进行复核，提升对插字躲避的召回
-        if ac_results:
-            # 性能优先：AC 已命中则跳过 DFA 严格校验
-            dfa_results = []
-            dfa_time = 0
-        else:
-            dfa_start = time.time()
-            dfa_results = self.dfa_filter.precise_match(text, [text], noise_tolerant=True)
-            dfa_time = time.time() - dfa_start
-        
-        # 合并所有结果
-        all_results = list(set(ac_results + dfa_results))
-        
-        total_time = time.time() - start_time
-        
-        return {
-            'ac_results': ac_results,
-            'dfa_results': dfa_results,
-            'preprocess_results': [],  # 预处理结果（用于兼容性）
-            'all_results': all_results,
-            'suspicious_segments': suspicious_segments,
-            'word_count': len(self.words),  # 添加词库统计信息
-            'normalized_text': normalized_text,  # 归一化后的文本
-            'timing': {
-                'preprocess_time': round(preprocess_time * 1000, 2),  # 预处理用时
-                'ac_time': round(ac_time * 1000, 2),      # 毫秒
-                'dfa_time': round(dfa_time * 1000, 2),    # 毫秒
-                'total_time': round(total_time * 1000, 2)  # 毫秒
-            }
-        }
+# 大模型调度队列：工作协程数与 Ollama 并行度对齐，队列满时返回 429；LLM_BATCH_SIZE > 1 时短文本合并判定
+llm_dispatcher = LLMDispatcher(
+    ollama_client,
+    workers=int(os.getenv("LLM_WORKERS", os.getenv("OLLAMA_NUM_PARALLEL", "1"))),
+    max_queue=int(os.getenv("LLM_QUEUE_SIZE", "64")),
+    batch_size=int(os.getenv("LLM_BATCH_SIZE", "1")),
+    batch_max_chars=int(os.getenv("LLM_BATCH_MAX_CHARS", "500")),
+    batch_wait=float(os.getenv("LLM_BATCH_WAIT_MS", "20")) / 1000,
+)
 
-# 初始化双重匹配规则引擎（加载敏感词库）
-# 默认使用word_libraries中的词库
+# 大模型判定缓存：相同归一化文本（同模型、同提示词版本）直接复用判定结果；配置磁盘路径后重启仍可命中
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+verdict_cache = VerdictCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000")),
+    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "32")) * 1024 * 1024),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    disk_path=os.getenv("LLM_CACHE_DISK_PATH", ""),
+)
 
-# 模型预热函数
+# 相同归一化文本的并发大模型请求合并为一次调用；每个等待方最多等待 LLM_WAIT_TIMEOUT 秒
+llm_single_flight = SingleFlight()
+LLM_WAIT_TIMEOUT = float(os.getenv("LLM_WAIT_TIMEOUT", str(ollama_client.timeout)))
 
-def call_ollama_api(text: str) -> str:
+
+async def call_ollama_api(text: str, timeout: Optional[float] = None) -> Tuple[Optional[str], str]:
     """
     调用 Ollama 本地 API，检测文本是否含敏感内容
-    返回："敏感" 或 "正常"（容错处理后）
+    返回：(判定, 实际使用的提示词版本)，判定为 "敏感" 或 "正常"（容错处理后），调用失败为 None
     """
     
     # 记录调用时间
@@ -690,185 +392,459 @@ def call_ollama_api(text: str) -> str:
     
     # 检查是否可能冷启动：仅记录日志，不在请求路径中触发预热
     if not model_warm_up_status["is_warmed_up"]:
-        print("检测到模型冷启动，可能需要较长时间...")
+        logger.debug("检测到模型冷启动，可能需要较长时间...")
     elif model_warm_up_status["warm_up_time"]:
         time_since_warmup = call_start_time - model_warm_up_status["warm_up_time"]
         if time_since_warmup > 180:  # 3分钟后认为可能冷启动
-            print(f"距离预热已过{time_since_warmup:.0f}秒，可能触发冷启动...")
-    
-    # 解析 Ollama 基础地址与模型名（带多地址回退与缓存）
-    base_url = get_ollama_base_url()
-    model_name = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct-q4_K_M")
-    ollama_url = f"{base_url}/api/generate"
+            logger.debug("距离预热已过%.0f秒，可能触发冷启动...", time_since_warmup)
     
-    print(f"尝试调用Ollama API: {ollama_url}")
-    print(f"使用模型: {model_name}")
-    keep_alive_value = os.getenv("OLLAMA_KEEP_ALIVE_REQUEST", "15m")
-    
-    # 提示词工程：严格约束输出，确保一致性
-    prompt = f"""
-你是专业的内容安全检测系统。请严格按照以下规则进行判断：
-
-【敏感内容标准】
-包含以下任何一类内容即判定为敏感：
-1. 辱骂词汇（如：白痴、傻逼、去死等）
-2. 暴力威胁（如：杀了你、打你、伤害等）
-3. 违法内容（如：毒品、犯罪、诈骗等）
-4. 色情内容（如：性暗示、色情描述等）
-5. 歧视内容（如：种族歧视、性别歧视等）
-6. 政治敏感内容（如：法西斯、纳粹、极端主义、恐怖主义、分裂主义等）
-7. 仇恨言论（如：煽动仇恨、暴力、极端的言论）
-8. 虚假信息（如：虚假新闻、虚假宣传、虚假广告、谣言等）
-9. 欺凌言论（如：霸凌、冷暴力、孤立的言论）
-10. 隐蔽的敏感内容（如：反动内容、色情内容、暴力内容、违法内容等，但需要通过上下文才能判断）
-【检测文本】
-{text[:10000]}
-
-【判断规则】
-- 如果文本包含上述任何一类敏感内容，回答：敏感
-- 如果文本是正常的日常对话、学术讨论、新闻描述等，回答：正常
-- 对于涉及敏感词汇但属于学术研究、历史讨论、新闻报道等正当用途，回答：正常
-- 对于明确表达支持、宣扬、美化敏感内容的，回答：敏感
-
-【输出要求】
-请严格按照以下格式输出，不要添加任何其他内容：
-敏感
-或
-正常
+    return await llm_dispatcher.classify(text, timeout=timeout)
+
+
+async def _review_and_store(text: str, normalized_text: str) -> Optional[str]:
+    """调用大模型并写入判定缓存（调用失败不写入）；缓存键按实际使用的提示词版本计算"""
+    result, prompt_version = await call_ollama_api(text)
+    if result is not None and LLM_CACHE_ENABLED:
+        verdict_cache.put(VerdictCache.make_key(normalized_text, get_model_name(), prompt_version), result)
+    return result
+
+
+async def llm_review(text: str, normalized_text: Optional[str] = None) -> Tuple[str, bool]:
+    """带判定缓存与请求合并的大模型检测，返回 (判定结果, 是否命中缓存)
+
+    缓存键基于归一化文本，已归一化的文本可通过 normalized_text 传入以免重复预处理。
+    缓存未命中时，归一化后相同的并发请求共享同一次调用。
+    调用失败或等待超时时按"正常"兜底，且不写入缓存；调度队列已满时返回 429。
+    整体耗时在请求追踪中记为 llm，实际发起调用的请求另有 llm_queue / llm_inference（见 LLMDispatcher.classify）。
     """
-    
+    with trace_span("llm"):
+        return await _llm_review(text, normalized_text)
+
+
+async def _llm_review(text: str, normalized_text: Optional[str]) -> Tuple[str, bool]:
+    start = time.perf_counter()
+    if normalized_text is None:
+        normalized_text = text_preprocessor.preprocess_text(text)
+    # 短文本可能由合并判定或逐条判定得出，两种提示词版本下的缓存依次查询
+    model = get_model_name()
+    keys = [VerdictCache.make_key(normalized_text, model, version)
+            for version in llm_dispatcher.prompt_versions(text)]
+    if LLM_CACHE_ENABLED:
+        for key in keys:
+            cached = await verdict_cache.get(key)
+            if cached is not None:
+                LLM_REVIEW_SECONDS.observe(time.perf_counter() - start, outcome="cache_hit")
+                return cached, True
     try:
-        # 发送 POST 请求到 Ollama API
-        print(f"发送请求到: {ollama_url}")
-        response = requests.post(
-            ollama_url,
-            json={
-                "model": model_name,
-                "prompt": prompt,
-                "stream": False,
-                "temperature": 0,
-                "keep_alive": keep_alive_value
-            },
-            timeout=60
-        )
-        print(f"API响应状态码: {response.status_code}")
-        response.raise_for_status()  # 若 HTTP 状态码异常，抛出错误
-        result = response.json()
-        print(f"API响应内容: {result}")
-        
-        # 提取模型响应，清理空格和换行
-        llm_output = result.get("response", "").strip()
-        print(f"模型输出: '{llm_output}'")
-        # 容错处理：若模型输出异常，默认返回"正常"
-        final_result = llm_output if llm_output in ["敏感", "正常"] else "正常"
-        print(f"最终结果: {final_result}")
-        return final_result
-    
-    except Exception as e:
-        # 捕获网络错误、API 错误等，打印日志并返回"正常"（避免服务崩溃）
-        print(f"Ollama API 调用失败：{str(e)}")
-        print(f"异常类型: {type(e).__name__}")
-        return "正常"
-
-def _ollama_generate_once(tag: str, prompt: str) -> None:
-    """底层一次性生成调用，用于预热，避免递归进入 call_ollama_api。"""
-    base_url = get_ollama_base_url()
-    model_name = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct-q4_K_M")
-    url = f"{base_url}/api/generate"
-    keep_alive_value = os.getenv("OLLAMA_KEEP_ALIVE_REQUEST", "15m")
-    payload = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": False,
-        "temperature": 0,
-        "keep_alive": keep_alive_value
-    }
-    print(f"[{tag}] 直接调用 Ollama 进行一次性预热: url={url}, model={model_name}, keep_alive={keep_alive_value}")
-    start_ts = time.time()
-    resp = requests.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload), timeout=60)
-    elapsed = time.time() - start_ts
-    print(f"[{tag}] API响应状态码: {resp.status_code}，耗时: {elapsed:.2f}s")
-    resp.raise_for_status()
+        result = await llm_single_flight.do(keys[0], lambda: _review_and_store(text, normalized_text),
+                                            timeout=LLM_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("等待大模型检测结果超时（%.0fs），按正常处理", LLM_WAIT_TIMEOUT)
+        LLM_REVIEW_SECONDS.observe(time.perf_counter() - start, outcome="timeout")
+        return "正常", False
+    except LLMQueueFullError as e:
+        LLM_REVIEW_SECONDS.observe(time.perf_counter() - start, outcome="rejected")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    # 调用失败时按"正常"兜底，单独计为 failed
+    LLM_REVIEW_SECONDS.observe(time.perf_counter() - start, outcome="ok" if result is not None else "failed")
+    return (result if result in ["敏感", "正常"] else "正常"), False
+
+
+async def await_unless_disconnected(request: Request, coro, poll_interval: float = 0.5):
+    """等待协程完成；期间客户端断开连接则取消（连同进行中的 Ollama 请求）并返回 499"""
+    task = asyncio.ensure_future(coro)
     try:
-        data = resp.json()
-        snippet = str(data.get("response", ""))
-        if len(snippet) > 120:
-            snippet = snippet[:120] + "..."
-        print(f"[{tag}] API响应片段: '{snippet}'")
-    except Exception as e:
-        print(f"[{tag}] 解析响应JSON失败: {type(e).__name__}: {e}")
-
-def warm_up_model():
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("客户端已断开连接，取消大模型检测")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="客户端已断开连接")
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def warm_up_model():
     """预热Ollama模型：直接执行一次与主流程一致的敏感词检测测试。"""
     try:
-        print("正在预热Ollama模型（完整测试）...")
+        logger.info("正在预热Ollama模型（完整测试）...")
         # 使用贴近真实检测链路的测试文本，触发完整提示词与判定逻辑
         warm_up_text = "这是一个用于预热的测试文本，不包含侮辱、暴力、违法、色情等敏感内容。请判断是否为敏感。"
-        print("预热中（执行一次完整敏感词判定）...")
+        logger.info("预热中（执行一次完整敏感词判定）...")
         start = time.time()
-        result = call_ollama_api(warm_up_text)
+        result, _ = await call_ollama_api(warm_up_text)
         elapsed = (time.time() - start) * 1000
-        print(f"预热检测结果: {result}，耗时: {elapsed:.2f}ms")
+        if result is None:
+            return {"ok": False, "error": "Ollama 调用失败", "elapsed_ms": round(elapsed, 2)}
+        logger.info(f"预热检测结果: {result}，耗时: {elapsed:.2f}ms")
         
-        print("模型预热完成！")
+        logger.info("模型预热完成！")
         # 更新预热状态
         model_warm_up_status["is_warmed_up"] = True
         model_warm_up_status["warm_up_time"] = time.time()
         
         return {"ok": True, "result": result, "elapsed_ms": round(elapsed, 2)}
     except Exception as e:
-        print(f"模型预热失败: {e}")
+        logger.warning(f"模型预热失败: {e}")
         return {"ok": False, "error": str(e)}
 
 
 # 启动时加载保存的检测词库配置
 def initialize_detection_filter():
-    """初始化检测过滤器"""
-    used_libraries = detection_lib_manager.get_used_libraries()
+    """初始化检测过滤器：编译全部词库，保存的检测词库配置作为默认启用的词库"""
+    word_lib_paths = word_lib_manager.get_library_paths()
     
-    if used_libraries:
-        print(f"加载保存的检测词库配置: {', '.join(used_libraries)}")
-        # 使用保存的词库配置
-        word_paths = []
-        for name in used_libraries:
-            file_path = os.path.join(word_lib_manager.base_path, f"{name}.txt")
-            if os.path.exists(file_path):
-                word_paths.append(file_path)
-            else:
-                print(f"警告：保存的词库 '{name}' 文件不存在，跳过")
-        
-        if word_paths:
-            return ThreeStepFilter(word_paths)
-        else:
-            print("所有保存的词库文件都不存在，使用默认词库")
-    
-    # 使用word_libraries中的词库作为默认词库
-    print("使用word_libraries中的词库作为默认词库")
-    word_lib_paths = []
-    
-    # 扫描word_libraries目录中的所有词库
-    if os.path.exists(word_lib_manager.base_path):
-        for filename in os.listdir(word_lib_manager.base_path):
-            if filename.endswith('.txt'):
-                file_path = os.path.join(word_lib_manager.base_path, filename)
-                word_lib_paths.append(file_path)
-                print(f"找到词库: {filename}")
-    
-    if word_lib_paths:
-        print(f"使用 {len(word_lib_paths)} 个词库作为默认词库")
-        return ThreeStepFilter(word_lib_paths)
-    else:
-        print("word_libraries目录为空，创建默认词库")
+    if not word_lib_paths:
+        logger.info("word_libraries目录为空，创建默认词库")
         # 创建默认词库
         default_library_path = os.path.join(word_lib_manager.base_path, "默认词库.txt")
         with open(default_library_path, "w", encoding="utf-8") as f:
             f.write("暴力\n辱骂\n违法\n色情\n赌博\n毒品\n法西斯\n纳粹\n极端主义\n恐怖主义\n")
-        print(f"已创建默认词库: {default_library_path}")
-        return ThreeStepFilter([default_library_path])
+        logger.info(f"已创建默认词库: {default_library_path}")
+        word_lib_paths = [default_library_path]
+    
+    for path in word_lib_paths:
+        logger.info(f"找到词库: {os.path.basename(path)}")
+    
+    used_libraries = detection_lib_manager.get_used_libraries()
+    if used_libraries:
+        # 不存在的词库由 ThreeStepFilter 忽略并提示
+        logger.info(f"加载保存的检测词库配置: {', '.join(used_libraries)}")
+        return ThreeStepFilter(word_lib_paths, default_libraries=used_libraries)
+    
+    logger.info(f"使用 {len(word_lib_paths)} 个词库作为默认词库")
+    return ThreeStepFilter(word_lib_paths)
+
 
-three_step_filter = initialize_detection_filter()
+# ---------------------- 检测引擎热切换 ----------------------
+class DetectionEngineManager:
+    """检测引擎管理器：词库变更时在后台线程构建新引擎，完成后一次引用赋值原子替换
+
+    - 引擎始终编译全部词库，切换默认词库时若词库内容未变，直接复用同一自动机
+    - 构建期间旧引擎继续服务，事件循环不被阻塞
+    - 请求处理时先取 current 再调用 detect，整个请求始终使用同一套 AC/DFA
+    - 同一时间只进行一次构建，后到的更新请求排队等待
+    """
+
+    def __init__(self, engine: ThreeStepFilter):
+        self._engine = engine
+        self._build_lock = asyncio.Lock()
+        self._status_lock = threading.Lock()
+        # 增量编辑与替换互斥；每次增量编辑递增 _generation，全量构建期间若有编辑则重新构建
+        self._swap_lock = threading.Lock()
+        self._generation = 0
+        self._refresh_scheduled = False
+        self._tasks = set()
+        self.build_status = {
+            "state": "ready",  # ready / building / failed
+            "stage": None,
+            "libraries": engine.default_libraries or [],
+            "started_at": None,
+            "finished_at": None,
+            "duration_ms": None,
+            "error": None,
+        }
+
+    @property
+    def current(self) -> ThreeStepFilter:
+        """当前对外服务的引擎"""
+        return self._engine
+
+    def get_build_status(self) -> Dict[str, Any]:
+        """返回构建状态快照（构建中时附带已耗时）"""
+        with self._status_lock:
+            status = dict(self.build_status)
+        if status["state"] == "building" and status["started_at"]:
+            started = datetime.fromisoformat(status["started_at"]).timestamp()
+            status["elapsed_ms"] = round((time.time() - started) * 1000, 2)
+        return status
+
+    def _update_status(self, **fields):
+        with self._status_lock:
+            self.build_status.update(fields)
+
+    async def rebuild(self, default_libraries: Optional[List[str]]) -> Dict[str, Any]:
+        """切换默认词库（None 或空列表表示全部词库）：在后台线程准备新引擎并原子替换，返回本次构建状态"""
+        async with self._build_lock:
+            return await self._build_and_swap(default_libraries)
+
+    def _build_engine(self, word_paths: List[str], default_libraries: Optional[List[str]]) -> ThreeStepFilter:
+        """词库文件与内容均未变化时复用当前自动机，否则重新编译（命中快照时仅需 mmap 加载）"""
+        self._update_status(stage="计算词库指纹")
+        engine = self._engine
+        if engine.snapshot_key and engine.word_paths == word_paths:
+            key, _ = library_fingerprint(word_paths)
+            if key == engine.snapshot_key:
+                return engine.with_default_libraries(default_libraries)
+        return ThreeStepFilter(
+            word_paths, progress=lambda stage: self._update_status(stage=stage), default_libraries=default_libraries
+        )
 
-# ---------------------- 新增：Ollama API 调用逻辑 ----------------------
+    async def _build_and_swap(self, default_libraries: Optional[List[str]]) -> Dict[str, Any]:
+        """全量构建并替换（调用方持有 _build_lock）；构建期间发生增量编辑时重新构建，避免覆盖编辑"""
+        start_time = time.time()
+        self._update_status(
+            state="building", stage="排队中", libraries=list(default_libraries or []),
+            started_at=datetime.now().isoformat(), finished_at=None, duration_ms=None, error=None
+        )
+        loop = asyncio.get_running_loop()
+        while True:
+            generation = self._generation
+            word_paths = word_lib_manager.get_library_paths()
+            try:
+                engine = await loop.run_in_executor(None, self._build_engine, word_paths, default_libraries)
+            except Exception as e:
+                self._update_status(
+                    state="failed", stage=None, finished_at=datetime.now().isoformat(),
+                    duration_ms=round((time.time() - start_time) * 1000, 2), error=str(e)
+                )
+                logger.error(f"检测引擎构建失败，继续使用旧引擎: {e}")
+                raise
+            # 原子替换：此后的请求使用新引擎，进行中的请求仍持有旧引擎直至完成
+            with self._swap_lock:
+                if generation == self._generation:
+                    self._engine = engine
+                    break
+            logger.info("构建期间词库有增量编辑，重新构建")
+        duration_ms = round((time.time() - start_time) * 1000, 2)
+        self._update_status(
+            state="ready", stage="已切换", finished_at=datetime.now().isoformat(), duration_ms=duration_ms
+        )
+        logger.info(f"检测引擎已切换：默认词库 {engine.word_count} 个词，耗时 {duration_ms}ms",
+                    extra={"word_count": engine.word_count, "duration_ms": duration_ms})
+        return self.get_build_status()
+
+    async def apply_library_edit(self, name: str, old_words: List[str], new_words: List[str]) -> Optional[Dict[str, Any]]:
+        """词库内容编辑后以增量方式立即生效，并在后台安排一次全量合并
+
+        词库尚未编译进当前引擎时返回 None（由后台刷新纳入）。
+        """
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._apply_patch, name, old_words, new_words)
+        self.schedule_refresh()
+        return result
+
+    def _apply_patch(self, name: str, old_words: List[str], new_words: List[str]) -> Optional[Dict[str, Any]]:
+        start_time = time.time()
+        with self._swap_lock:
+            engine = self._engine
+            if name not in engine.libraries:
+                return None
+            bit = 1 << engine.libraries.index(name)
+            # 与全量构建一致，按归一化后的词计算增删（同一词库中归一化后相同的词视为同一个词）
+            normalize = engine.text_preprocessor.normalize_text
+            old_set = {word for word in map(normalize, old_words) if word}
+            new_set = {word for word in map(normalize, new_words) if word}
+            added = new_set - old_set
+            removed = old_set - new_set
+            automaton = engine.ac_automaton
+            if not isinstance(automaton, PatchedAutomaton):
+                automaton = PatchedAutomaton(automaton)
+            # 只改动该词库对应的位：其他词库仍包含的词不会被删除
+            masks = {word: automaton.mask_of(word) | bit for word in added}
+            masks.update((word, automaton.mask_of(word) & ~bit) for word in removed)
+            automaton = automaton.patch(masks)
+            self._engine = ThreeStepFilter(
+                engine.word_paths, automaton=automaton, default_libraries=engine.default_libraries
+            )
+            self._generation += 1
+        duration_ms = round((time.time() - start_time) * 1000, 2)
+        logger.info(f"词库增量更新已生效：新增 {len(added)} 个、删除 {len(removed)} 个，耗时 {duration_ms}ms")
+        return {"added": len(added), "removed": len(removed), "duration_ms": duration_ms}
+
+    def schedule_refresh(self):
+        """安排后台全量刷新：合并增量编辑、纳入新建或移除已删除的词库（已有待执行的刷新时不重复安排）"""
+        if self._refresh_scheduled:
+            return
+        self._refresh_scheduled = True
+        task = asyncio.create_task(self._refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self):
+        async with self._build_lock:
+            self._refresh_scheduled = False
+            engine = self._engine
+            if (not isinstance(engine.ac_automaton, PatchedAutomaton)
+                    and engine.word_paths == word_lib_manager.get_library_paths()):
+                return
+            try:
+                await self._build_and_swap(engine.default_libraries)
+            except Exception:
+                pass  # 失败信息已记录在构建状态中，当前引擎继续服务
+
+
+detection_engine_manager = DetectionEngineManager(initialize_detection_filter())
+
+
+# ---------------------- 规则匹配执行后端 ----------------------
+# 说明：规则匹配是纯 CPU 计算，在事件循环线程中直接执行时，一段大文本会阻塞所有并发请求（含健康检查）。
+# 执行后端可选：
+# - inline：在事件循环中直接执行（原行为）
+# - thread：线程池执行，事件循环保持响应，但受 GIL 限制无法并行
+# - process：进程池执行，每个工作进程从快照 mmap 预加载自动机，可真正并行
+# 短文本的调度开销高于匹配本身，单条检测中低于 RULE_INLINE_MAX_CHARS 的文本始终直接执行；
+# 批量检测的分片即使由短文本组成也提交给执行后端，各分片才能在工作者间并行。
+
+class RuleExecutionBackend:
+    """规则匹配执行后端：按环境变量选择 inline / thread / process，并统计排队情况"""
+
+    MODES = ("inline", "thread", "process")
+
+    def __init__(self, mode: str, workers: int, inline_max_chars: int):
+        if mode not in self.MODES:
+            logger.warning(f"未知的规则执行后端 '{mode}'，使用 thread")
+            mode = "thread"
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.inline_max_chars = inline_max_chars
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,   # 提交到线程池/进程池的任务数
+            "completed": 0,
+            "failed": 0,
+            "inline": 0,      # 直接执行的任务数
+            "pending": 0,     # 已提交未完成（含执行中）
+            "max_pending": 0,
+            "pool_restarts": 0,
+        }
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.mode == "process":
+                    # forkserver 启动：进程池在请求处理中才创建，此时本进程已有线程池、事件循环等线程，
+                    # 直接 fork 会把其他线程持有的锁原样复制到子进程。工作进程改由单线程的 fork 服务进程派生，
+                    # 只导入 detection_engine（不导入 main），初始化时按 spec 从快照 mmap 加载引擎
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                        initializer=init_rule_worker,
+                        initargs=(detection_engine_manager.current.spec(),),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rule")
+            return self._executor
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+            self.stats["max_pending"] = max(self.stats["max_pending"], self.stats["pending"])
+
+    async def detect(self, engine: ThreeStepFilter, text: str, libraries: Optional[List[str]] = None) -> Dict[str, Any]:
+        """执行单条规则匹配"""
+        return (await self.detect_many(engine, [text], libraries))[0]
+
+    async def detect_many(self, engine: ThreeStepFilter, texts: List[str],
+                          libraries: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """在所选后端上对一组文本逐条执行规则匹配（调用方需先校验 libraries），并记录各阶段耗时指标"""
+        results = await self._detect_many(engine, texts, libraries)
+        for result in results:
+            observe_rule_timing(result)
+        return results
+
+    async def _detect_many(self, engine: ThreeStepFilter, texts: List[str],
+                           libraries: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        if self.mode == "inline" or (len(texts) == 1 and len(texts[0]) <= self.inline_max_chars):
+            self._count(inline=1)
+            return [engine.detect(text, libraries=libraries) for text in texts]
+
+        loop = asyncio.get_running_loop()
+        self._count(submitted=1, pending=1)
+        try:
+            if self.mode == "process":
+                return await self._run_in_process_pool(loop, engine.spec(), texts, libraries)
+            return await loop.run_in_executor(self._get_executor(), _detect_shard, engine, texts, libraries)
+        except Exception:
+            self._count(failed=1)
+            raise
+        finally:
+            self._count(completed=1, pending=-1)
+
+    async def _run_in_process_pool(self, loop, spec: Dict[str, Any], texts: List[str],
+                                   libraries: Optional[List[str]]) -> List[Dict[str, Any]]:
+        """在进程池中执行；工作进程异常退出（如被 OOM 终止）时重建进程池并重试一次，仍失败则抛出"""
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, worker_detect, spec, texts, libraries)
+            except BrokenProcessPool:
+                logger.error("规则匹配进程池异常，已重建" + ("" if attempt else "，重试一次"))
+                with self._lock:
+                    # 并发请求可能已重建过进程池，只替换自己用过的那个
+                    if self._executor is executor:
+                        self._executor = None
+                        self.stats["pool_restarts"] += 1
+                executor.shutdown(wait=False, cancel_futures=True)
+                if attempt:
+                    raise
+
+    async def feed(self, stream: RuleStream, chunk: str) -> List[Dict[str, Any]]:
+        """流式匹配喂入一块原文；扫描状态保存在当前进程，process 模式下改在默认线程池中执行"""
+        if self.mode == "inline" or len(chunk) <= self.inline_max_chars:
+            self._count(inline=1)
+            return stream.feed(chunk)
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor() if self.mode == "thread" else None
+        self._count(submitted=1, pending=1)
+        try:
+            return await loop.run_in_executor(executor, stream.feed, chunk)
+        except Exception:
+            self._count(failed=1)
+            raise
+        finally:
+            self._count(completed=1, pending=-1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update(
+            mode=self.mode,
+            workers=self.workers,
+            inline_max_chars=self.inline_max_chars,
+            queue_depth=max(0, stats["pending"] - self.workers),  # 等待空闲工作者的任务数
+        )
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _detect_shard(engine: ThreeStepFilter, texts: List[str], libraries: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """在工作线程中对一组文本逐条执行规则匹配（预处理 + AC + DFA）"""
+    return [engine.detect(text, libraries=libraries) for text in texts]
+
+
+rule_backend = RuleExecutionBackend(
+    mode=os.getenv("RULE_BACKEND", "thread"),
+    workers=int(os.getenv("RULE_WORKERS", str(os.cpu_count() or 2))),
+    inline_max_chars=int(os.getenv("RULE_INLINE_MAX_CHARS", "2000")),
+)
+
+
+@app.on_event("shutdown")
+async def shutdown_rule_backend():
+    rule_backend.shutdown()
+
+
+@app.get("/document-extractors/stats", summary="文档提取耗时统计")
+async def get_document_extractor_stats():
+    """按格式统计文本提取的次数、失败数、页数及耗时（平均 / p95 / 最大）"""
+    return {"status": "success", "data": document_extractor.get_stats()}
+
+
+@app.get("/rule-engine/stats", summary="规则匹配执行后端状态")
+async def get_rule_engine_stats():
+    """返回执行后端模式、工作者数量、排队深度与累计任务数"""
+    return {"status": "success", "data": rule_backend.get_stats()}
 
 
 # ---------------------- 应用级空闲检测：上次调用满3分钟则预热 ----------------------
@@ -879,11 +855,10 @@ async def schedule_idle_warmup():
         """应用启动后一小段时间即进行一次轻量预热，不阻塞启动。"""
         try:
             # 先解析可用的 Ollama 地址，减少首次调用失败概率
-            resolve_ollama_base_url()
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, warm_up_model)
+            await ollama_client.resolve_base_url()
+            await warm_up_model()
         except Exception as e:
-            print(f"启动预热异常: {e}")
+            logger.warning(f"启动预热异常: {e}")
     async def _idle_worker():
         while True:
             try:
@@ -892,10 +867,9 @@ async def schedule_idle_warmup():
                 last_warm = model_warm_up_status.get("warm_up_time")
                 if last_call and (now - last_call) >= 180:
                     if (not last_warm) or ((now - last_warm) >= 180):
-                        loop = asyncio.get_running_loop()
-                        await loop.run_in_executor(None, warm_up_model)
+                        await warm_up_model()
             except Exception as e:
-                print(f"空闲预热异常: {e}")
+                logger.warning(f"空闲预热异常: {e}")
             finally:
                 await asyncio.sleep(60)
     # 启动即进行一次轻量预热（异步）
@@ -903,13 +877,36 @@ async def schedule_idle_warmup():
     # 后台轮询空闲预热
     asyncio.create_task(_idle_worker())
 
- 
+
+@app.on_event("shutdown")
+async def shutdown_document_extractor():
+    document_extractor.shutdown()
+
+
+@app.on_event("shutdown")
+async def close_ollama_client():
+    await llm_dispatcher.close()
+    await ollama_client.close()
+    verdict_cache.close()
+
 
 # ---------------------- 定义请求参数格式 ----------------------
 class TextRequest(BaseModel):
     """文本检测的请求体格式：必须包含text字段"""
     text: str
     strict_mode: Optional[bool] = False  # 严格模式：跳过规则匹配，直接使用大模型
+    libraries: Optional[List[str]] = None  # 本次检测启用的词库，默认使用检测词库配置
+
+class BatchTextItem(BaseModel):
+    """批量检测中的单条文本"""
+    id: str
+    text: str
+
+class BatchTextRequest(BaseModel):
+    """批量文本检测的请求体格式"""
+    items: List[BatchTextItem]
+    libraries: Optional[List[str]] = None  # 本批次启用的词库，默认使用检测词库配置
+    llm_review: Optional[bool] = True  # 是否对规则命中的条目调用大模型复核
 
 class LibraryCreateRequest(BaseModel):
     """创建敏感词库的请求体格式"""
@@ -940,6 +937,8 @@ async def create_word_library(req: LibraryCreateRequest):
         raise HTTPException(status_code=400, detail="敏感词列表不能为空")
     
     library = word_lib_manager.create_library(req.name.strip(), req.words)
+    # 后台把新词库编译进检测引擎，之后即可在检测请求中按名称选用
+    detection_engine_manager.schedule_refresh()
     return {
         "status": "success",
         "data": library
@@ -964,7 +963,15 @@ async def update_word_library(name: str, req: LibraryUpdateRequest):
     if not req.words:
         raise HTTPException(status_code=400, detail="敏感词列表不能为空")
     
+    old_words = word_lib_manager.get_library_content(name)
     library = word_lib_manager.update_library(name, req.words)
+    # 增删部分以增量方式立即生效（后台再全量合并）
+    new_words = [word.strip() for word in req.words if word.strip()]
+    library["detection_patch"] = await detection_engine_manager.apply_library_edit(name, old_words, new_words)
+    if library["detection_patch"] is not None:
+        detection_lib_manager.save_config(
+            detection_lib_manager.get_used_libraries(), detection_engine_manager.current.word_count
+        )
     return {
         "status": "success",
         "data": library
@@ -974,6 +981,7 @@ async def update_word_library(name: str, req: LibraryUpdateRequest):
 async def delete_word_library(name: str):
     """删除指定的敏感词库"""
     word_lib_manager.delete_library(name)
+    detection_engine_manager.schedule_refresh()
     return {
         "status": "success",
         "message": f"敏感词库 '{name}' 已删除"
@@ -984,16 +992,19 @@ async def update_detection_libraries(req: dict):
     """更新检测词库配置"""
     library_names = req.get("library_names", [])
     
+    # wait=False 时立即返回，构建在后台进行，进度见 /detection-libraries/status
+    wait = req.get("wait", True)
+    
     if not library_names:
-        # 清空检测词库配置，使用默认词库
-        detection_lib_manager.save_config([], 0)
-        three_step_filter.reload_with_libraries([])
+        # 清空检测词库配置，默认启用全部词库（词库内容未变时直接复用当前自动机）
+        await detection_engine_manager.rebuild(None)
+        detection_lib_manager.save_config([], detection_engine_manager.current.word_count)
         return {
             "status": "success",
             "message": "已清空检测词库配置，使用默认词库",
             "data": {
                 "used_libraries": [],
-                "word_count": len(three_step_filter.words)
+                "word_count": detection_engine_manager.current.word_count
             }
         }
     
@@ -1004,7 +1015,7 @@ async def update_detection_libraries(req: dict):
         if os.path.exists(file_path):
             valid_libraries.append(name)
         else:
-            print(f"警告：词库 '{name}' 不存在，跳过")
+            logger.warning(f"词库 '{name}' 不存在，跳过")
     
     if not valid_libraries:
         return {
@@ -1012,50 +1023,74 @@ async def update_detection_libraries(req: dict):
             "message": "没有找到有效的词库"
         }
     
-    # 更新检测词库
-    three_step_filter.reload_with_libraries(valid_libraries)
+    # 更新检测词库：后台构建新引擎，完成后原子替换并保存配置
+    async def _rebuild_and_save():
+        build = await detection_engine_manager.rebuild(valid_libraries)
+        detection_lib_manager.save_config(valid_libraries, detection_engine_manager.current.word_count)
+        return build
     
-    # 保存配置
-    detection_lib_manager.save_config(valid_libraries, len(three_step_filter.words))
+    if not wait:
+        task = asyncio.create_task(_rebuild_and_save())
+        # 后台任务的异常已记录在构建状态中，这里仅取出避免未处理告警
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return {
+            "status": "accepted",
+            "message": f"检测词库正在后台构建，使用 {len(valid_libraries)} 个词库",
+            "data": {
+                "used_libraries": valid_libraries,
+                "build": detection_engine_manager.get_build_status()
+            }
+        }
+    
+    try:
+        build = await _rebuild_and_save()
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"检测词库构建失败，仍使用原词库：{str(e)}"
+        }
     
     return {
         "status": "success",
         "message": f"检测词库已更新，使用 {len(valid_libraries)} 个词库",
         "data": {
             "used_libraries": valid_libraries,
-            "word_count": len(three_step_filter.words)
+            "word_count": detection_engine_manager.current.word_count,
+            "build": build
         }
     }
 
 @app.get("/detection-libraries/status", summary="获取检测词库状态")
 async def get_detection_libraries_status():
     """获取当前检测词库状态"""
-    print("=== API调用: 获取检测词库状态 ===")
+    logger.debug("=== API调用: 获取检测词库状态 ===")
     
     # 强制重新加载配置文件
     try:
         with open("/app/detection_config.json", "r", encoding="utf-8") as f:
             config = json.load(f)
-        print(f"直接从文件读取配置: {config}")
+        logger.debug("直接从文件读取配置: %s", config)
         
         used_libraries = config.get("used_libraries", [])
         word_count = config.get("word_count", 0)
         last_updated = config.get("last_updated")
         
-        print(f"返回的词库: {used_libraries}")
-        print(f"返回的词库数量: {len(used_libraries)}")
-        print("=== API调用结束 ===")
+        logger.debug("返回的词库: %s", used_libraries)
+        logger.debug("返回的词库数量: %d", len(used_libraries))
+        logger.debug("=== API调用结束 ===")
         
         return {
             "status": "success",
             "data": {
                 "used_libraries": used_libraries,
                 "word_count": word_count,
-                "last_updated": last_updated
+                "last_updated": last_updated,
+                "available_libraries": detection_engine_manager.current.libraries,  # 可在检测请求中选用的词库
+                "build": detection_engine_manager.get_build_status()  # 引擎构建进度与耗时
             }
         }
     except Exception as e:
-        print(f"读取配置文件失败: {e}")
+        logger.warning(f"读取配置文件失败: {e}")
         return {
             "status": "error",
             "message": f"读取配置文件失败: {str(e)}"
@@ -1063,23 +1098,27 @@ async def get_detection_libraries_status():
 
 # ---------------------- 核心API：文本检测 ----------------------
 @app.post("/detect/text", summary="文本敏感词检测")
-async def detect_text(req: TextRequest):
+async def detect_text(req: TextRequest, request: Request, trace: bool = False):
+    """trace=true 时在 data.trace 中返回各阶段耗时；阶段耗时同时以 Server-Timing 响应头返回"""
+    return attach_trace(await _detect_text(req, request), trace)
+
+
+async def _detect_text(req: TextRequest, request: Request) -> Dict[str, Any]:
     # 1. 校验请求参数（文本不能为空）
     if not req.text.strip():
         raise HTTPException(status_code=400, detail="检测文本不能为空")
     
     # 调试日志
-    print(f"🔍 调试信息: strict_mode={req.strict_mode}")
+    logger.debug("调试信息: strict_mode=%s", req.strict_mode)
     
     # 2. 检查是否为严格模式
     if req.strict_mode:
         # 严格模式：跳过规则匹配，直接使用大模型检测
         llm_start = time.time()
-        llm_result = call_ollama_api(req.text)
+        llm_result, llm_cached = await await_unless_disconnected(request, llm_review(req.text))
         llm_time = time.time() - llm_start
-        # 容错：仅允许“敏感”或“正常”
-        llm_result = llm_result if llm_result in ["敏感", "正常"] else "正常"
         final_result = llm_result
+        record_detection("text", "strict_mode")
         
         # 返回严格模式结果
         return {
@@ -1092,36 +1131,47 @@ async def detect_text(req: TextRequest):
                     "preprocess_results": [],
                     "all_results": [],
                     "suspicious_segments": [],
+                    "hits": [],
+                    "libraries": [],
                     "word_count": 0,
                     "normalized_text": "",
                     "timing": {"preprocess_time": 0, "ac_time": 0, "dfa_time": 0, "total_time": 0}
                 },
                 "llm_detected": llm_result,
                 "llm_time": round(llm_time * 1000, 2),
+                "cached": llm_cached,  # 大模型判定是否来自缓存
                 "final_result": final_result,
                 "detection_flow": "strict_mode"
             }
         }
     
     # 3. 普通模式：使用规则匹配快速筛选 + 存疑内容大模型检测
-    rule_result = three_step_filter.detect(req.text)
+    # 规则匹配交给执行后端，大文本不会阻塞事件循环
+    engine = detection_engine_manager.current
+    try:
+        engine.library_mask(req.libraries)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rule_result = await rule_backend.detect(engine, req.text, req.libraries)
     
     # 4. 判断是否需要大模型检测（规则匹配快速筛选 + 存疑内容大模型检测）
     rule_has_sensitive = bool(rule_result['all_results'])  # 规则匹配是否发现敏感词
     
     if rule_has_sensitive:
-        # 仅对规则匹配出敏感词的文本进行大模型检测
+        # 仅对规则匹配出敏感词的文本进行大模型检测（缓存键复用规则匹配的归一化文本）
         llm_start = time.time()
-        llm_result = call_ollama_api(req.text)
+        llm_result, llm_cached = await await_unless_disconnected(
+            request, llm_review(req.text, rule_result['normalized_text'])
+        )
         llm_time = time.time() - llm_start
-        # 容错：仅允许“敏感”或“正常”
-        llm_result = llm_result if llm_result in ["敏感", "正常"] else "正常"
         final_result = llm_result  # 大模型检测结果即为最终结果
     else:
         # 规则匹配无敏感词，直接判定为正常
         llm_result = "正常"
         llm_time = 0
+        llm_cached = False
         final_result = "正常"
+    record_detection("text", "rule_then_llm" if rule_has_sensitive else "rule_only")
 
     # 4. 返回响应
     return {
@@ -1134,17 +1184,135 @@ async def detect_text(req: TextRequest):
                 "preprocess_results": rule_result['preprocess_results'],  # 预处理结果
                 "all_results": rule_result['all_results'],         # 合并后的所有敏感词
                 "suspicious_segments": rule_result['suspicious_segments'],  # 可疑文本片段
+                "hits": rule_result['hits'],                       # 命中位置（原文坐标）及来源词库
+                "libraries": rule_result['libraries'],             # 本次启用的词库
                 "word_count": rule_result['word_count'],           # 词库统计信息
                 "normalized_text": rule_result['normalized_text'], # 归一化后的文本
                 "timing": rule_result['timing']                    # 规则匹配用时
             },
             "llm_detected": llm_result,    # 大模型检测结果
             "llm_time": round(llm_time * 1000, 2),  # 大模型检测用时（毫秒）
+            "cached": llm_cached,  # 大模型判定是否来自缓存
             "final_result": final_result,  # 最终结果
             "detection_flow": "rule_only" if not rule_has_sensitive else "rule_then_llm"  # 检测流程：规则匹配快速筛选 + 存疑内容大模型检测
         }
     }
 
+# ---------------------- 核心API：批量文本检测 ----------------------
+# 单批最多条目数、每个分片的条目数、大模型复核并发数（可通过环境变量调整）
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_SHARD_SIZE = int(os.getenv("BATCH_SHARD_SIZE", "64"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+
+@app.post("/detect/batch", summary="批量文本敏感词检测")
+async def detect_batch(req: BatchTextRequest, request: Request):
+    """批量检测：规则匹配按分片并行执行，只有规则命中的条目才调用大模型复核
+
+    整批使用同一个检测引擎（期间词库切换不影响本批结果）；空文本条目单独返回错误，不影响其他条目。
+    """
+    if not req.items:
+        raise HTTPException(status_code=400, detail="检测条目不能为空")
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单批最多 {BATCH_MAX_ITEMS} 条，当前 {len(req.items)} 条")
+    
+    start_time = time.time()
+    engine = detection_engine_manager.current
+    try:
+        engine.library_mask(req.libraries)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 1. 规则匹配：有效条目按分片提交到规则执行后端（线程池/进程池），事件循环不被阻塞
+    valid = [k for k, item in enumerate(req.items) if item.text.strip()]
+    shards = [valid[i:i + BATCH_SHARD_SIZE] for i in range(0, len(valid), BATCH_SHARD_SIZE)]
+    shard_results = await asyncio.gather(*[
+        rule_backend.detect_many(engine, [req.items[k].text for k in shard], req.libraries)
+        for shard in shards
+    ])
+    rule_results = {}
+    for shard, results in zip(shards, shard_results):
+        rule_results.update(zip(shard, results))
+    rule_time = time.time() - start_time
+    
+    # 2. 大模型复核：仅规则命中的条目，限制并发
+    flagged = [k for k in valid if rule_results[k]['all_results']]
+    llm_results = {}
+    llm_start = time.time()
+    if req.llm_review and flagged:
+        semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+        
+        async def _review(k):
+            async with semaphore:
+                item_start = time.time()
+                result, cached = await llm_review(req.items[k].text, rule_results[k]['normalized_text'])
+                llm_results[k] = (result, time.time() - item_start, cached)
+        
+        reviews = [asyncio.ensure_future(_review(k)) for k in flagged]
+        try:
+            await await_unless_disconnected(request, asyncio.gather(*reviews))
+        finally:
+            # 任一条目被拒绝（429）或客户端断开时，取消其余未完成的复核
+            for review in reviews:
+                review.cancel()
+    llm_time = time.time() - llm_start
+    
+    # 3. 组装逐条结果
+    items = []
+    for k, item in enumerate(req.items):
+        if k not in rule_results:
+            items.append({"id": item.id, "status": "error", "message": "检测文本不能为空"})
+            continue
+        rule_result = rule_results[k]
+        if k in llm_results:
+            llm_result, item_llm_time, llm_cached = llm_results[k]
+            final_result = llm_result
+            detection_flow = "rule_then_llm"
+        elif rule_result['all_results']:
+            # 未启用大模型复核：规则命中即判定为敏感
+            llm_result, item_llm_time, llm_cached = None, 0, False
+            final_result = "敏感"
+            detection_flow = "rule_only"
+        else:
+            llm_result, item_llm_time, llm_cached = "正常", 0, False
+            final_result = "正常"
+            detection_flow = "rule_only"
+        rule_result.pop('normalized_text', None)  # 批量结果不返回归一化全文，减小响应体
+        items.append({
+            "id": item.id,
+            "status": "success",
+            "rule_detection": rule_result,
+            "llm_detected": llm_result,
+            "llm_time": round(item_llm_time * 1000, 2),
+            "cached": llm_cached,
+            "final_result": final_result,
+            "detection_flow": detection_flow
+        })
+        record_detection("batch", detection_flow)
+    
+    total_time = time.time() - start_time
+    return {
+        "status": "success",
+        "data": {
+            "items": items,
+            "summary": {
+                "item_count": len(req.items),
+                "valid_count": len(valid),
+                "flagged_count": len(flagged),
+                "cached_count": sum(1 for _, _, cached in llm_results.values() if cached),
+                "sensitive_count": sum(1 for item in items if item.get("final_result") == "敏感"),
+                "shard_count": len(shards),
+                "shard_size": BATCH_SHARD_SIZE
+            },
+            "timing": {
+                "rule_time": round(rule_time * 1000, 2),    # 规则匹配（全部分片）墙钟用时，毫秒
+                "llm_time": round(llm_time * 1000, 2),      # 大模型复核墙钟用时，毫秒
+                "total_time": round(total_time * 1000, 2),  # 毫秒
+                "items_per_second": round(len(req.items) / total_time, 1) if total_time > 0 else None
+            }
+        }
+    }
+
 # ---------------------- 模型管理API ----------------------
 @app.get("/model-status", summary="获取模型状态")
 async def get_model_status():
@@ -1155,7 +1323,11 @@ async def get_model_status():
         "is_warmed_up": model_warm_up_status["is_warmed_up"],
         "warm_up_time": model_warm_up_status["warm_up_time"],
         "last_call_time": model_warm_up_status["last_call_time"],
-        "current_time": current_time
+        "current_time": current_time,
+        "client": ollama_client.get_stats(),  # 连接池配置与累计请求/失败/取消次数
+        "cache": dict(verdict_cache.get_stats(), enabled=LLM_CACHE_ENABLED),  # 判定缓存命中/未命中/淘汰计数
+        "single_flight": llm_single_flight.get_stats(),  # 合并的并发调用数（coalesced）、等待超时数
+        "dispatcher": llm_dispatcher.get_stats()  # 调度队列深度、拒绝数、合并判定批次数
     }
     
     if model_warm_up_status["warm_up_time"]:
@@ -1175,7 +1347,7 @@ async def get_model_status():
 async def warm_up_model_endpoint():
     """预热Ollama模型，执行一次完整的敏感词检测测试以减少首次调用延迟"""
     try:
-        info = warm_up_model()
+        info = await warm_up_model()
         if isinstance(info, dict) and info.get("ok"):
             return {
                 "status": "success",
@@ -1194,8 +1366,131 @@ async def warm_up_model_endpoint():
         }
 
 # ---------------------- 核心API：文档检测 ----------------------
-@app.post("/detect/document", summary="文档敏感词检测（支持txt/pdf/docx/doc/图片OCR，严格模式）")
-async def detect_document(file: UploadFile = File(...)):
+# 文档先经规则匹配，只把命中所在的分块交给大模型复核：分块长度、相邻分块重叠长度、
+# 单个文档最多复核的分块数、复核并发数（可通过环境变量调整）
+DOC_CHUNK_CHARS = int(os.getenv("DOC_CHUNK_CHARS", "2000"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "200"))
+DOC_MAX_LLM_CHUNKS = int(os.getenv("DOC_MAX_LLM_CHUNKS", "32"))
+DOC_LLM_CONCURRENCY = int(os.getenv("DOC_LLM_CONCURRENCY", "2"))
+# 规则命中累计达到该数量即判定文档敏感并停止继续提取（0 表示不启用）
+DOC_RULE_VERDICT_HITS = int(os.getenv("DOC_RULE_VERDICT_HITS", "0"))
+# 上传文件大小上限（MB）与落盘目录（默认系统临时目录）；上传内容分块写盘，不整体读入内存
+DOC_MAX_UPLOAD_MB = int(os.getenv("DOC_MAX_UPLOAD_MB", "200"))
+DOC_SPOOL_DIR = os.getenv("DOC_SPOOL_DIR") or None
+# 文档上传的请求体在接收过程中即按上限加 multipart 头部余量截断，超限返回 413，不必等整个上传落盘
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    path_prefixes=("/detect/document",),
+    max_bytes=DOC_MAX_UPLOAD_MB * 1024 * 1024 + 64 * 1024,
+    detail=f"文件过大！文件大小不能超过{DOC_MAX_UPLOAD_MB}MB",
+)
+# 文档文本提取（txt/docx/pdf/doc/图片统一接口，按格式统计耗时）
+document_extractor = DocumentExtractor()
+
+
+class ReviewChunkCollector:
+    """流式收集需要大模型复核的分块
+
+    文档按固定步长切分，相邻分块重叠 overlap 个字符，长度不超过重叠长度的命中必然完整落在某个分块内；
+    每个命中只归入第一个完整包含它的分块。逐页喂入文本与命中，只保留尚未凑齐的分块所需的尾部文本，
+    已完成的分块超过上限时只保留命中最多的若干个，内存与文档长度无关。
+    """
+
+    # 流式匹配在后文到达（或输入结束）时才确认的容噪命中，起点可能早于最后喂入的文本，尾部多保留这些字符
+    LATE_HIT_CHARS = 128
+
+    def __init__(self, chunk_chars: int = DOC_CHUNK_CHARS, overlap: int = DOC_CHUNK_OVERLAP,
+                 max_chunks: int = DOC_MAX_LLM_CHUNKS):
+        self.chunk_chars = max(1, chunk_chars)
+        self.step = max(1, self.chunk_chars - max(0, overlap))
+        self.max_chunks = max_chunks
+        self.length = 0            # 已喂入的文本长度
+        self._tail = ""            # 覆盖 [_tail_start, length) 的尾部文本
+        self._tail_start = 0
+        self._pending: Dict[int, int] = {}  # 分块序号 -> 命中数（分块文本尚未凑齐）
+        self._chunks: List[Tuple[int, int, int, str]] = []  # (start, end, 命中数, 文本)
+        self.total_chunks = 0      # 含命中的分块总数
+
+    def _chunk_index(self, start: int, end: int) -> int:
+        k = start // self.step
+        # 从包含命中起点的最后一个分块往前找，取第一个完整包含命中的分块
+        while k > 0 and (k - 1) * self.step + self.chunk_chars >= end:
+            k -= 1
+        return k
+
+    def feed(self, text: str, hits: List[Dict[str, Any]]):
+        """喂入紧接已有文本的一页及其命中（全文坐标）"""
+        self._tail += text
+        self.length += len(text)
+        for hit in hits:
+            k = self._chunk_index(hit["start"], hit["end"])
+            if k not in self._pending:
+                self.total_chunks += 1
+            self._pending[k] = self._pending.get(k, 0) + 1
+        self._flush(final=False)
+        # 后续命中所在分块的起点不早于 length - chunk_chars（再留出晚到命中的余量），尾部文本只需保留这一段及未完成分块
+        keep_from = min([self.length - self.chunk_chars - self.LATE_HIT_CHARS] + [k * self.step for k in self._pending])
+        if keep_from > self._tail_start:
+            self._tail = self._tail[keep_from - self._tail_start:]
+            self._tail_start = keep_from
+
+    def _flush(self, final: bool):
+        for k in sorted(self._pending):
+            start = k * self.step
+            end = min(start + self.chunk_chars, self.length)
+            if end < start + self.chunk_chars and not final:
+                continue
+            self._chunks.append((start, end, self._pending.pop(k),
+                                 self._tail[start - self._tail_start:end - self._tail_start]))
+        if len(self._chunks) > self.max_chunks * 4:
+            self._prune()
+
+    def _prune(self):
+        """只保留命中最多的 max_chunks 个分块（命中数相同时保留靠前的），按位置排序"""
+        self._chunks = sorted(sorted(self._chunks, key=lambda c: -c[2])[:self.max_chunks])
+
+    def finish(self) -> List[Tuple[int, int, int, str]]:
+        """结束喂入，返回需要复核的分块（至多 max_chunks 个，按位置排序）"""
+        self._flush(final=True)
+        self._prune()
+        return self._chunks
+
+
+async def review_document_chunks(chunks: List[Tuple[int, int, int, str]]) -> List[Dict[str, Any]]:
+    """并发复核命中分块；任一分块判定为敏感即停止其余复核（文档结论已确定）"""
+    semaphore = asyncio.Semaphore(DOC_LLM_CONCURRENCY)
+    results: List[Dict[str, Any]] = [
+        {"start": start, "end": end, "hit_count": n, "llm_detected": None, "cached": False, "llm_time": 0}
+        for start, end, n, _ in chunks
+    ]
+
+    async def _review(i):
+        async with semaphore:
+            item_start = time.time()
+            verdict, cached = await llm_review(chunks[i][3])
+            results[i].update(llm_detected=verdict, cached=cached,
+                              llm_time=round((time.time() - item_start) * 1000, 2))
+            return verdict
+
+    reviews = [asyncio.ensure_future(_review(i)) for i in range(len(chunks))]
+    try:
+        for finished in asyncio.as_completed(reviews):
+            if await finished == "敏感":
+                break
+    finally:
+        for review in reviews:
+            review.cancel()
+    return results
+
+
+@app.post("/detect/document", summary="文档敏感词检测（支持txt/pdf/docx/doc/图片OCR，规则筛选 + 命中分块大模型复核）")
+async def detect_document(request: Request, file: UploadFile = File(...), trace: bool = False):
+    """trace=true 时在 data.trace 中返回各阶段耗时；阶段耗时同时以 Server-Timing 响应头返回"""
+    # 接收并解析 multipart 上传内容（在进入接口前完成）计入 receive
+    request_trace = current_trace()
+    if request_trace is not None:
+        request_trace.add("receive", time.perf_counter_ns() - request_trace.start_ns, request_trace.start_ns)
+
     # 1. 校验文件类型（支持多种格式）
     allowed_types = {
         "text/plain": "txt",
@@ -1211,168 +1506,191 @@ async def detect_document(file: UploadFile = File(...)):
             detail=f"不支持的文件类型！支持：TXT、PDF、DOCX、DOC、图片格式（OCR）"
         )
 
-    # 1.1 校验文件大小（限制10MB）
-    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-    if file.size and file.size > MAX_FILE_SIZE:
+    # 1.1 校验文件大小（上限 DOC_MAX_UPLOAD_MB）
+    max_bytes = DOC_MAX_UPLOAD_MB * 1024 * 1024
+    if file.size and file.size > max_bytes:
         raise HTTPException(
-            status_code=400,
-            detail=f"文件过大！文件大小不能超过10MB，当前文件大小：{file.size / (1024 * 1024):.2f}MB"
+            status_code=413,
+            detail=f"文件过大！文件大小不能超过{DOC_MAX_UPLOAD_MB}MB，当前文件大小：{file.size / (1024 * 1024):.2f}MB"
         )
 
-    # 2. 读取文件内容（根据文件类型解析）
-    content = await file.read()
-    text = ""
+    # 2. 上传内容分块写入自己的临时文件，后续按文件流式提取
+    # 较小的 DOC 上传（不超过 Starlette 的内存缓冲上限）写入内存文件交给 antiword，不落盘
     file_type = allowed_types[file.content_type]
-    
+    in_memory = file_type == "doc" and file.size is not None and file.size <= MEMFD_MAX_BYTES
     try:
-        if file_type == "txt":
-            # 解析txt（默认UTF-8编码，若乱码可尝试gbk）
-            text = content.decode("utf-8", errors="ignore")
-        elif file_type == "docx":
-            # 解析docx
-            doc = docx.Document(BytesIO(content))
-            text = "\n".join([para.text for para in doc.paragraphs])
-        elif file_type == "pdf":
-            # 解析pdf（忽略无法提取的文本）
-            reader = PyPDF2.PdfReader(BytesIO(content))
-            text = "\n".join([page.extract_text() for page in reader.pages if page.extract_text()])
-        elif file_type == "doc":
-            # 解析doc - 使用antiword工具
-            try:
-                # 创建临时文件
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.doc') as temp_file:
-                    temp_file.write(content)
-                    temp_file_path = temp_file.name
-                
-                try:
-                    # 使用antiword工具解析DOC文件
-                    result = subprocess.run(
-                        ['antiword', temp_file_path],
-                        capture_output=True,
-                        text=True,
-                        timeout=30  # 30秒超时
-                    )
-                    
-                    if result.returncode == 0:
-                        text = result.stdout
-                        if not text.strip():
-                            raise Exception("antiword无法从DOC文件中提取文本内容")
-                    else:
-                        raise Exception(f"antiword执行失败：{result.stderr}")
-                        
-                finally:
-                    # 清理临时文件
-                    try:
-                        os.unlink(temp_file_path)
-                    except:
-                        pass
-                        
-            except FileNotFoundError:
-                raise HTTPException(
-                    status_code=500,
-                    detail="antiword工具未安装。请重新构建Docker镜像以确保antiword工具已正确安装。"
-                )
-            except subprocess.TimeoutExpired:
-                raise HTTPException(
-                    status_code=500,
-                    detail="DOC文件解析超时，文件可能过大或格式异常。"
-                )
-            except Exception as doc_error:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"DOC文件解析失败：{str(doc_error)}。建议将DOC文件转换为DOCX格式后重新上传。"
-                )
-        elif file_type in ["jpg", "png", "bmp", "gif", "tiff"]:
-            # OCR文字识别 - 使用pytesseract + Tesseract OCR引擎
-            try:
-                # 打开图片
-                image = Image.open(BytesIO(content))
-                
-                # 图片预处理以提高OCR识别率
-                processed_image = preprocess_image_for_ocr(image)
-                
-                # 获取OCR配置
-                ocr_config = get_ocr_config()
-                
-                # 构建OCR配置字符串
-                if ocr_config['char_whitelist']:
-                    full_config = f"{ocr_config['config']} -c tessedit_char_whitelist={ocr_config['char_whitelist']}"
-                else:
-                    full_config = ocr_config['config']
-                
-                # 执行OCR识别
-                text = pytesseract.image_to_string(
-                    processed_image, 
-                    lang=ocr_config['lang'], 
-                    config=full_config
-                )
-                
-                # 清理识别结果
-                text = text.strip()
-                
-                # 添加OCR识别结果调试信息
-                print(f"OCR识别结果: '{text}'")
-                print(f"OCR识别结果长度: {len(text)}")
-                
-                # 如果识别结果为空，尝试使用更宽松的配置
-                if not text.strip():
-                    print("使用宽松配置重新尝试OCR识别...")
-                    text = pytesseract.image_to_string(
-                        processed_image, 
-                        lang=ocr_config['lang'], 
-                        config='--psm 3 --oem 3'  # 更宽松的配置
-                    ).strip()
-                    print(f"宽松配置OCR识别结果: '{text}'")
-                
-            except Exception as ocr_error:
-                raise HTTPException(
-                    status_code=500, 
-                    detail=f"OCR识别失败：{str(ocr_error)}。请确保图片清晰且包含可识别的文字内容。"
-                )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"文档解析失败：{str(e)}")
-
-    # 3. 校验解析结果（文档内容不能为空）
-    if not text.strip():
+        with trace_span("upload"):
+            path, file_size = await spool_upload(file.read, max_bytes, DOC_SPOOL_DIR, in_memory=in_memory)
+    except ExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if file_size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件过大！文件大小不能超过{DOC_MAX_UPLOAD_MB}MB，当前文件大小：{file_size / (1024 * 1024):.2f}MB"
+        )
+    try:
+        return attach_trace(await _detect_spooled_document(request, file.filename, file_type, path, file_size), trace)
+    finally:
+        release_upload(path)
+
+
+async def _detect_spooled_document(request: Request, filename: str, file_type: str, path: str,
+                                   file_size: int) -> Dict[str, Any]:
+    ocr_stats = None  # 图片 OCR 的分阶段用时
+
+    # 3. 逐页提取并流式规则匹配（PDF 按页、txt 按段，其他格式整体作为一页），规则命中达到阈值时提前结束
+    # 各页依次拼接即为全文，匹配状态跨页延续，跨页的命中不会遗漏
+    pages = document_extractor.iter_pages(file_type, path)
+    stream = detection_engine_manager.current.stream()
+    collector = ReviewChunkCollector()
+    page_stats = []
+    has_text = False
+    early_stopped = False
+    try:
+        extract_start = time.perf_counter_ns()
+        async for page_text, extract_time, page_meta in pages:
+            add_span("extract", time.perf_counter_ns() - extract_start, extract_start)  # 等待本页提取的耗时
+            if page_meta is not None:
+                ocr_stats = page_meta  # 仅图片 OCR 带附加信息
+            rule_start = time.time()
+            page_hits = await rule_backend.feed(stream, page_text)
+            page_stats.append({
+                "page": len(page_stats) + 1,
+                "chars": len(page_text),
+                "extract_time": round(extract_time * 1000, 2),  # 毫秒
+                "rule_time": round((time.time() - rule_start) * 1000, 2),  # 毫秒
+                "hit_count": len(page_hits)
+            })
+            has_text = has_text or bool(page_text.strip())
+            collector.feed(page_text, page_hits)
+            if DOC_RULE_VERDICT_HITS and stream.hit_count >= DOC_RULE_VERDICT_HITS:
+                early_stopped = True
+                break
+            extract_start = time.perf_counter_ns()
+    except ExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        await pages.aclose()
+    
+    # 3.1 校验解析结果（文档内容不能为空）
+    if not has_text:
         raise HTTPException(status_code=400, detail="文档内容为空或无法提取文本")
-
-    # 4. 文档检测：文本预处理 + 严格模式（直接使用大模型检测）
-    # 4.1 文本预处理（归一化字符格式）
-    preprocessor = TextPreprocessor()
-    normalized_text = preprocessor.preprocess_text(text)
+    collector.feed("", stream.finish())
+    rule_result = stream.result()
+    observe_rule_timing(rule_result)
+
+    # 4. 文档检测：规则匹配筛选 + 命中分块大模型复核
+    # 4.1 规则命中达到阈值时直接判定为敏感，不再调用大模型
+    if early_stopped:
+        record_detection("document", "rule_threshold")
+        return {
+            "status": "success",
+            "data": {
+                "filename": filename,
+                "file_type": file_type,
+                "file_size": file_size,
+                "text_length": collector.length,  # 已提取的文本长度
+                "rule_detection": rule_result,
+                "llm_detected": None,
+                "llm_time": 0,
+                "cached": False,
+                "llm_chunks": [],
+                "unreviewed_chunks": 0,
+                "pages": page_stats,  # 逐页提取与规则匹配用时
+                "ocr": ocr_stats,
+                "early_stopped": True,  # 达到 DOC_RULE_VERDICT_HITS 后未继续提取剩余页
+                "final_result": "敏感",
+                "detection_flow": "rule_threshold"
+            }
+        }
+    
+    # 4.2 只复核包含命中的分块；分块过多时优先复核命中最多的分块
+    chunks = collector.finish()
+    unreviewed_chunks = collector.total_chunks - len(chunks)
     
-    # 4.2 使用预处理后的文本进行LLM检测
     llm_start = time.time()
-    llm_result = call_ollama_api(normalized_text)
+    chunk_results = []
+    if chunks:
+        chunk_results = await await_unless_disconnected(request, review_document_chunks(chunks))
+        # 文档结论：任一分块敏感即为敏感
+        llm_result = "敏感" if any(c["llm_detected"] == "敏感" for c in chunk_results) else "正常"
+    else:
+        llm_result = "正常"
     llm_time = time.time() - llm_start
-    # 容错：若模型输出异常，默认按"正常"处理
-    llm_result = llm_result if llm_result in ["敏感", "正常"] else "正常"
+    llm_cached = bool(chunk_results) and all(c["cached"] for c in chunk_results if c["llm_detected"])
     final_result = llm_result
+    record_detection("document", "rule_then_llm" if chunks else "rule_only")
 
     # 5. 返回响应
     return {
         "status": "success",
         "data": {
-            "filename": file.filename,
+            "filename": filename,
             "file_type": file_type,
-            "text_length": len(text),  # 提取的文本长度
-            "rule_detection": {
-                "ac_results": [],
-                "dfa_results": [],
-                "preprocess_results": [],
-                "all_results": [],
-                "suspicious_segments": [],
-                "word_count": 0,
-                "normalized_text": normalized_text,  # 归一化后的文本
-                "timing": {"preprocess_time": 0, "ac_time": 0, "dfa_time": 0, "total_time": 0}
-            },
+            "file_size": file_size,  # 上传文件字节数
+            "text_length": collector.length,  # 提取的文本长度
+            "rule_detection": rule_result,  # 全文规则匹配结果（命中位置为原文坐标）
             "llm_detected": llm_result,
             "llm_time": round(llm_time * 1000, 2),  # 大模型检测用时（毫秒）
+            "cached": llm_cached,  # 已复核分块的判定是否全部来自缓存
+            "llm_chunks": chunk_results,  # 逐分块复核结果；判定为敏感后剩余分块不再复核（llm_detected 为 null）
+            "unreviewed_chunks": unreviewed_chunks,  # 超出 DOC_MAX_LLM_CHUNKS 未复核的命中分块数
+            "pages": page_stats,  # 逐页（txt 为逐段）提取与规则匹配用时
+            "ocr": ocr_stats,  # 图片 OCR 的解码、预处理、识别用时及图块数（非图片为 null）
+            "early_stopped": False,
             "final_result": final_result,
-            "detection_flow": "strict_mode"  # 文档检测使用严格模式（预处理+LLM）
+            "detection_flow": "rule_then_llm" if chunks else "rule_only"  # 规则筛选 + 命中分块大模型复核
         }
     }
 
+# ---------------------- 指标端点 ----------------------
+# 队列深度、缓存命中等已有组件自行统计的数值，在采集时从 get_stats() 读取，不在热路径上重复计数
+metrics.gauge("llm_queue_depth", "大模型调度队列中等待的请求数").set_function(
+    lambda: llm_dispatcher.get_stats()["queue_depth"])
+metrics.gauge("llm_in_flight", "正在调用 Ollama 的大模型判定数（不含排队）").set_function(
+    lambda: llm_dispatcher.get_stats()["in_flight"])
+metrics.counter("llm_cancelled_total", "调用方已放弃、出队时直接丢弃的大模型请求数").set_function(
+    lambda: llm_dispatcher.stats["cancelled"])
+metrics.counter("llm_rejected_total", "因调度队列已满被拒绝（429）的大模型请求数").set_function(
+    lambda: llm_dispatcher.stats["rejected"])
+metrics.gauge("llm_single_flight_inflight", "进行中的合并大模型调用数").set_function(
+    lambda: llm_single_flight.get_stats()["inflight"])
+metrics.counter("llm_single_flight_coalesced_total", "合并到进行中调用的请求数").set_function(
+    lambda: llm_single_flight.stats["coalesced"])
+metrics.counter("verdict_cache_lookups_total", "大模型判定缓存查询数（hit 内存命中，disk_hit 磁盘命中，miss 未命中）",
+                ["result"]).set_function(
+    lambda: {("hit",): verdict_cache.stats["hits"], ("disk_hit",): verdict_cache.stats["disk_hits"],
+             ("miss",): verdict_cache.stats["misses"]})
+metrics.gauge("verdict_cache_entries", "内存中的大模型判定缓存条数").set_function(
+    lambda: verdict_cache.get_stats()["entries"])
+metrics.gauge("rule_backend_pending", "规则匹配执行后端中未完成的任务数").set_function(
+    lambda: rule_backend.get_stats()["pending"])
+metrics.gauge("rule_backend_queue_depth", "规则匹配执行后端中等待空闲工作者的任务数").set_function(
+    lambda: rule_backend.get_stats()["queue_depth"])
+metrics.gauge("antiword_running", "正在运行的 antiword 子进程数").set_function(
+    lambda: document_extractor.get_stats()["antiword"]["running"])
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus 指标（文本格式）"""
+    return Response(content=metrics.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+
+# ---------------------- 单请求性能采集结果下载 ----------------------
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+async def download_profile(profile_id: str, request: Request):
+    """下载检测接口以 profile=cpu / profile=memory 采集的结果（需 X-Debug-Token）"""
+    token = os.getenv("DEBUG_PROFILE_TOKEN", "")
+    if not token or request.headers.get("x-debug-token") != token:
+        raise HTTPException(status_code=403, detail="调试令牌无效")
+    entry = profile_store.get(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="采集结果不存在或已过期")
+    filename, content = entry
+    return Response(content=content, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 # ---------------------- 健康检查端点 ----------------------
 @app.get("/health")
 async def health_check():
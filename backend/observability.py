@@ -0,0 +1,523 @@
+# ---------------------- 可观测性：结构化日志与 Prometheus 指标 ----------------------
+# 说明：原实现只有检测响应中的 timing 字段，其余信息都用 print() 输出到标准输出（包括每次调用的模型原始输出）。
+# 本模块只依赖标准库：
+# - 日志：各模块通过 get_logger 取得分级 logger，LOG_LEVEL 控制级别（热路径上的逐次调用日志为 DEBUG，默认不输出），
+#   LOG_FORMAT=json 时每条日志输出一行 JSON，extra 中的字段作为结构化字段输出
+# - 指标：进程内的 Counter / Gauge / Histogram 注册表，render() 生成 Prometheus 文本格式，由 /metrics 暴露
+# - 请求追踪：单个请求内各阶段的耗时（perf_counter_ns），以 Server-Timing 响应头和可选的 trace 字段返回；
+#   持有调试令牌时可对单个请求采集 cProfile / tracemalloc 结果并下载
+import cProfile
+import json
+import logging
+import marshal
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# ---------- 日志 ----------
+LOGGER_ROOT = "detector"
+
+# LogRecord 自带的属性，其余属性均为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """text：`时间 级别 模块 消息 key=value ...`；json：单行 JSON（msg 与 extra 字段同级）"""
+
+    def __init__(self, fmt_type: str = "text"):
+        super().__init__()
+        self.json = fmt_type == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+        message = record.getMessage()
+        name = record.name[len(LOGGER_ROOT) + 1:] or record.name
+        if self.json:
+            payload = {"ts": round(record.created, 3), "level": record.levelname, "logger": name, "msg": message}
+            payload.update(fields)
+            if record.exc_info:
+                payload["exc"] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+        line = f"{self.formatTime(record)} {record.levelname} {name} {message}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+_logging_configured = False
+
+
+def setup_logging(level: Optional[str] = None, fmt_type: Optional[str] = None):
+    """配置应用日志（输出到标准输出）；重复调用时只更新级别与格式"""
+    global _logging_configured
+    logger = logging.getLogger(LOGGER_ROOT)
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    logger.setLevel(getattr(logging, level, logging.INFO))
+    formatter = StructuredFormatter((fmt_type or os.getenv("LOG_FORMAT", "text")).lower())
+    if not _logging_configured:
+        handler = logging.StreamHandler(sys.stdout)
+        logger.addHandler(handler)
+        logger.propagate = False
+        _logging_configured = True
+    for handler in logger.handlers:
+        handler.setFormatter(formatter)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """取得模块 logger（首次调用时按环境变量完成配置）"""
+    if not _logging_configured:
+        setup_logging()
+    return logging.getLogger(f"{LOGGER_ROOT}.{name}")
+
+
+# ---------- 指标 ----------
+# 默认直方图分桶（秒）：覆盖规则匹配的亚毫秒级到大模型、OCR 的数十秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, Any] = {}
+        self._function: Optional[Callable[[], Any]] = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, function: Callable[[], Any]):
+        """采集时调用 function 取值：无标签时返回数值，有标签时返回 {标签值元组: 数值}"""
+        self._function = function
+
+    def _collect(self) -> Dict[Tuple, Any]:
+        if self._function is None:
+            with self._lock:
+                return dict(self._values)
+        value = self._function()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, value in sorted(self._collect().items()):
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """单调递增计数"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """瞬时值（在途请求数、队列深度等），也可通过 set_function 在采集时读取"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（单位：秒）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """with histogram.time(...): 观测代码块的耗时"""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = 'le="%s"' % _format_value(bound if math.isinf(bound) else float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    """指标注册表：同名指标只注册一次（模块重复导入时返回已有对象）"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix: str = "detector_"):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs) -> Any:
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指标 {name} 已以不同类型或标签注册")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Prometheus 文本格式；单个指标采集失败不影响其余指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                get_logger("metrics").warning("指标采集失败: %s: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """ASGI 中间件：统计在途 HTTP 请求数与请求耗时（按方法、路由模板、状态码）
+
+    直接包装 ASGI 调用，不改动 receive，接口中检测客户端断开的逻辑不受影响。
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = metrics):
+        self.app = app
+        self.in_flight = registry.gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+        self.duration = registry.histogram("http_request_seconds", "HTTP 请求耗时（秒）",
+                                           ["method", "route", "status"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.in_flight.dec()
+            # 路由模板（如 /word-libraries/{name}）由 FastAPI 在匹配后写入 scope，未匹配的路径统一记为 other
+            route = getattr(scope.get("route"), "path", "other")
+            self.duration.observe(time.perf_counter() - start, method=scope["method"], route=route, status=status)
+
+
+# ---------- 请求追踪 ----------
+class RequestTrace:
+    """单个请求的阶段耗时记录（纳秒）
+
+    span 的起点为相对请求开始的偏移；在工作线程/进程中测得、只知道耗时的阶段（如规则匹配各步骤）起点为 None，
+    这类阶段只计入各阶段累计耗时，不出现在 to_dict 的 span 时间线中。
+    同名阶段可出现多次（逐页提取、并发复核的各分块），Server-Timing 中按名称累加。
+    """
+
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.spans: List[Tuple[str, Optional[int], int]] = []  # (名称, 起点偏移, 耗时)
+        self.profile_id: Optional[str] = None
+
+    def add(self, name: str, duration_ns: int, start_ns: Optional[int] = None):
+        self.spans.append((name, None if start_ns is None else start_ns - self.start_ns, duration_ns))
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start, start)
+
+    def totals(self) -> Dict[str, int]:
+        """各阶段累计耗时（按首次出现的顺序）"""
+        totals: Dict[str, int] = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0) + duration
+        return totals
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={duration / 1e6:.3f}" for name, duration in self.totals().items()]
+        parts.append(f"total;dur={(time.perf_counter_ns() - self.start_ns) / 1e6:.3f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round((time.perf_counter_ns() - self.start_ns) / 1e6, 3),
+            "stages_ms": {name: round(duration / 1e6, 3) for name, duration in self.totals().items()},
+            "spans": [
+                {"name": name, "start_ms": round(start / 1e6, 3), "duration_ms": round(duration / 1e6, 3)}
+                for name, start, duration in self.spans if start is not None
+            ],
+            "profile_id": self.profile_id,
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """当前请求的追踪记录（不在追踪范围内时为 None）；asyncio.create_task 创建的子任务继承同一记录"""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_span(name: str):
+    """在当前请求的追踪中记录一个阶段；没有追踪时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def add_span(name: str, duration_ns: int, start_ns: Optional[int] = None):
+    """记录一个已测得耗时的阶段；没有追踪时忽略"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, duration_ns, start_ns)
+
+
+class ProfileStore:
+    """最近若干次单请求性能采集结果（内存中保存，超出数量或过期后丢弃）"""
+
+    def __init__(self, max_entries: int = 16, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, bytes, float]]" = OrderedDict()  # id -> (文件名, 内容, 过期时间)
+
+    def put(self, profile_id: str, filename: str, content: bytes):
+        self._entries[profile_id] = (filename, content, time.time() + self.ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Tuple[str, bytes]]:
+        entry = self._entries.get(profile_id)
+        if entry is None or entry[2] < time.time():
+            self._entries.pop(profile_id, None)
+            return None
+        return entry[0], entry[1]
+
+
+def _tracemalloc_report(snapshot: "tracemalloc.Snapshot", peak: int, limit: int = 50) -> bytes:
+    lines = [f"peak traced memory: {peak / 1024 / 1024:.2f} MiB", f"top {limit} allocations by line:"]
+    for stat in snapshot.statistics("lineno")[:limit]:
+        lines.append(str(stat))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class TraceMiddleware:
+    """ASGI 中间件：为指定路径的请求建立追踪记录，响应时附加 Server-Timing 头
+
+    性能采集：查询参数 profile=cpu（cProfile，下载文件可用 pstats / snakeviz 打开）或 profile=memory（tracemalloc
+    分配统计），且请求头 X-Debug-Token 与 DEBUG_PROFILE_TOKEN 一致时，对本次请求采集，结果编号通过 X-Profile-Id
+    响应头与 trace.profile_id 返回。未配置令牌时不可用；令牌不符返回 403。
+    cProfile 与 tracemalloc 作用于整个事件循环线程（tracemalloc 为整个进程），采集期间并发请求的开销也会计入，
+    线程池、进程池中的工作不计入；同一时间只允许一个采集，其余返回 409。
+    """
+
+    def __init__(self, app, path_prefixes: Sequence[str] = ("/detect",), profile_store: Optional[ProfileStore] = None,
+                 debug_token: Optional[str] = None, server_timing: Optional[bool] = None):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.profile_store = profile_store
+        self.debug_token = debug_token if debug_token is not None else os.getenv("DEBUG_PROFILE_TOKEN", "")
+        if server_timing is None:
+            server_timing = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.server_timing = server_timing
+        self._profiling = False
+
+    @staticmethod
+    def _query_param(scope, name: str) -> Optional[str]:
+        for part in scope.get("query_string", b"").decode("latin-1").split("&"):
+            key, _, value = part.partition("=")
+            if key == name:
+                return value
+        return None
+
+    @staticmethod
+    def _header(scope, name: bytes) -> Optional[str]:
+        for key, value in scope.get("headers", []):
+            if key.lower() == name:
+                return value.decode("latin-1")
+        return None
+
+    async def _reply(self, send, status: int, detail: str):
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self._query_param(scope, "profile")
+        if profile:
+            if profile not in ("cpu", "memory"):
+                await self._reply(send, 400, "profile 只能为 cpu 或 memory")
+                return
+            if not self.debug_token or self.profile_store is None:
+                await self._reply(send, 403, "未启用单请求性能采集（DEBUG_PROFILE_TOKEN 未配置）")
+                return
+            if self._header(scope, b"x-debug-token") != self.debug_token:
+                await self._reply(send, 403, "调试令牌无效")
+                return
+            if self._profiling:
+                await self._reply(send, 409, "已有请求正在进行性能采集，请稍后重试")
+                return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        if profile:
+            trace.profile_id = uuid.uuid4().hex
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if self.server_timing:
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                if trace.profile_id:
+                    headers.append((b"x-profile-id", trace.profile_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            if profile:
+                await self._profiled(profile, trace.profile_id, scope, receive, send_with_timing)
+            else:
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+
+    async def _profiled(self, profile: str, profile_id: str, scope, receive, send):
+        self._profiling = True
+        profiler = None
+        started_tracemalloc = False
+        try:
+            if profile == "cpu":
+                profiler = cProfile.Profile()
+                profiler.enable()
+            elif not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                started_tracemalloc = True
+            else:
+                tracemalloc.reset_peak()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.create_stats()
+                    # 与 pstats.Stats.dump_stats 写出的格式相同
+                    self.profile_store.put(profile_id, f"profile-{profile_id}.prof", marshal.dumps(profiler.stats))
+                else:
+                    snapshot = tracemalloc.take_snapshot()
+                    _, peak = tracemalloc.get_traced_memory()
+                    if started_tracemalloc:
+                        tracemalloc.stop()
+                    self.profile_store.put(profile_id, f"memory-{profile_id}.txt", _tracemalloc_report(snapshot, peak))
+        finally:
+            self._profiling = False
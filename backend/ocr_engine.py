@@ -0,0 +1,228 @@
+# ---------------------- OCR 识别引擎 ----------------------
+# 说明：原实现在 async 接口中同步调用 pytesseract，预处理只做 RGB 转换，首次识别为空时再串行跑一遍 --psm 3。
+# 本模块把解码、预处理与识别都放到进程池中执行，不阻塞事件循环：
+# - 预处理：灰度化、按 DPI / 宽度归一化缩放、自动对比度、Otsu 二值化
+# - 超高图片按水平条带切块（相邻条带有重叠），多帧 TIFF/GIF 逐帧拆分，各块分发到不同工作进程
+# - 多种 PSM 策略并发识别，按优先级取第一个非空结果
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pytesseract  # OCR文字识别
+from PIL import Image, ImageOps, ImageSequence  # 图像处理
+
+from observability import get_logger, metrics
+
+logger = get_logger("ocr_engine")
+OCR_SECONDS = metrics.histogram("ocr_seconds", "图片 OCR 各阶段耗时（秒）：prepare 解码与预处理，recognize 识别，total 合计", ["stage"])
+
+# 识别时的目标分辨率；图片自带 DPI 信息时按其缩放到该分辨率
+OCR_TARGET_DPI = 300
+
+
+def get_ocr_config():
+    """获取OCR配置参数"""
+    return {
+        'lang': 'chi_sim+eng',  # 支持中文简体和英文
+        'config': '--psm 6 --oem 3',  # PSM 6: 统一文本块, OEM 3: 默认引擎
+        'char_whitelist': None  # 移除字符白名单限制，允许识别所有字符
+    }
+
+
+def _otsu_threshold(gray: Image.Image) -> int:
+    """按灰度直方图计算 Otsu 阈值（类间方差最大）"""
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_b = w_b = 0
+    best, threshold = 0.0, 127
+    for t, h in enumerate(hist):
+        w_b += h
+        if w_b == 0:
+            continue
+        w_f = total - w_b
+        if w_f == 0:
+            break
+        sum_b += t * h
+        m_b = sum_b / w_b
+        m_f = (sum_all - sum_b) / w_f
+        between = w_b * w_f * (m_b - m_f) ** 2
+        if between > best:
+            best, threshold = between, t
+    return threshold
+
+
+def _scale_factor(image: Image.Image, min_width: int, max_width: int) -> float:
+    """缩放比例：有 DPI 信息时归一化到 OCR_TARGET_DPI，否则把过窄的图片放大（最多 2 倍）；宽度不超过 max_width"""
+    dpi = image.info.get("dpi")
+    if dpi and dpi[0]:
+        scale = min(2.0, OCR_TARGET_DPI / float(dpi[0]))
+    elif image.width < min_width:
+        scale = min(2.0, min_width / image.width)
+    else:
+        scale = 1.0
+    if image.width * scale > max_width:
+        scale = max_width / image.width
+    return scale
+
+
+def preprocess_image_for_ocr(image: Image.Image, min_width: int = 1000, max_width: int = 2500,
+                             binarize: bool = True) -> Image.Image:
+    """预处理图片以提高OCR识别率：灰度化 → 缩放归一化 → 自动对比度 → Otsu 二值化"""
+    image = ImageOps.exif_transpose(image)
+    scale = _scale_factor(image, min_width, max_width)  # 转换模式会丢失 DPI 信息，先计算缩放比例
+    # 透明背景先铺白底，避免透明区域变黑
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    gray = image.convert("L")
+
+    if abs(scale - 1.0) > 0.05:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.LANCZOS if scale < 1 else Image.BICUBIC)
+
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+    if binarize:
+        threshold = _otsu_threshold(gray)
+        gray = gray.point(lambda p: 255 if p > threshold else 0)
+    return gray
+
+
+def split_tiles(image: Image.Image, tile_height: int, overlap: int) -> List[Image.Image]:
+    """超高图片按水平条带切块，相邻条带重叠 overlap 像素，避免切断文字行"""
+    if image.height <= tile_height:
+        return [image]
+    step = max(1, tile_height - overlap)
+    tiles = []
+    for top in range(0, image.height, step):
+        bottom = min(top + tile_height, image.height)
+        tiles.append(image.crop((0, top, image.width, bottom)))
+        if bottom == image.height:
+            break
+    return tiles
+
+
+def _init_ocr_worker():
+    # 并行度由进程池控制，限制 Tesseract 自身的 OpenMP 线程，避免 CPU 过度订阅
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _prepare_image(source: Union[str, bytes], options: Dict[str, Any]) -> Tuple[List[Image.Image], Dict[str, Any]]:
+    """解码、逐帧预处理并切块（在进程池中执行）；source 为文件路径或图片内容"""
+    start = time.time()
+    image = Image.open(source if isinstance(source, str) else BytesIO(source))
+    frames = []
+    for frame in ImageSequence.Iterator(image):
+        frames.append(frame.copy())
+        if len(frames) >= options["max_frames"]:
+            break
+    decode_time = time.time() - start
+
+    start = time.time()
+    tiles = []
+    for frame in frames:
+        processed = preprocess_image_for_ocr(frame, options["min_width"], options["max_width"], options["binarize"])
+        tiles.extend(split_tiles(processed, options["tile_height"], options["tile_overlap"]))
+    preprocess_time = time.time() - start
+    return tiles, {
+        "frames": len(frames),
+        "tiles": len(tiles),
+        "width": image.width,
+        "height": image.height,
+        "decode_time": round(decode_time * 1000, 2),
+        "preprocess_time": round(preprocess_time * 1000, 2),
+    }
+
+
+def _recognize_tile(tile: Image.Image, lang: str, config: str, timeout: float) -> Tuple[str, float]:
+    """对单个图块执行一次 Tesseract 识别（在进程池中执行）"""
+    start = time.time()
+    text = pytesseract.image_to_string(tile, lang=lang, config=config, timeout=timeout)
+    return text.strip(), time.time() - start
+
+
+class OCREngine:
+    """进程池 OCR 引擎：预处理与识别均不占用事件循环，图块与 PSM 策略并发识别"""
+
+    def __init__(self, workers: Optional[int] = None, psm_modes: Optional[List[int]] = None):
+        self.workers = workers or int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.psm_modes = psm_modes or [int(p) for p in os.getenv("OCR_PSM", "6,3").split(",") if p.strip()]
+        self.timeout = float(os.getenv("OCR_TIMEOUT", "60"))
+        self.options = {
+            "min_width": int(os.getenv("OCR_MIN_WIDTH", "1000")),
+            "max_width": int(os.getenv("OCR_MAX_WIDTH", "2500")),
+            "tile_height": int(os.getenv("OCR_TILE_HEIGHT", "2400")),
+            "tile_overlap": int(os.getenv("OCR_TILE_OVERLAP", "120")),
+            "max_frames": int(os.getenv("OCR_MAX_FRAMES", "20")),
+            "binarize": os.getenv("OCR_BINARIZE", "true").lower() in ("1", "true", "yes"),
+        }
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # forkserver 启动：进程池在请求处理中才创建，直接 fork 会复制其他线程持有的锁
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_ocr_worker,
+            )
+        return self._executor
+
+    def _config(self, psm: int) -> str:
+        ocr_config = get_ocr_config()
+        config = f"--psm {psm} --oem 3"
+        if ocr_config['char_whitelist']:
+            config += f" -c tessedit_char_whitelist={ocr_config['char_whitelist']}"
+        return config
+
+    async def recognize(self, source: Union[str, bytes]) -> Tuple[str, Dict[str, Any]]:
+        """识别图片文字（source 为文件路径或图片内容），返回 (文本, 分阶段用时与统计)"""
+        loop = asyncio.get_running_loop()
+        start = time.time()
+        try:
+            executor = self._get_executor()
+            tiles, stats = await loop.run_in_executor(executor, _prepare_image, source, self.options)
+            OCR_SECONDS.observe(time.time() - start, stage="prepare")
+
+            # 每个图块 × 每种 PSM 策略各提交一个任务，全部并发执行
+            ocr_start = time.time()
+            lang = get_ocr_config()['lang']
+            futures = [
+                [loop.run_in_executor(executor, _recognize_tile, tile, lang, self._config(psm), self.timeout)
+                 for psm in self.psm_modes]
+                for tile in tiles
+            ]
+            results = await asyncio.gather(*[asyncio.gather(*per_tile) for per_tile in futures])
+        except BrokenProcessPool:
+            logger.warning("OCR 进程池异常，已重建")
+            self._executor = None
+            raise
+
+        texts, chosen = [], []
+        for per_tile in results:
+            # 按 PSM 优先级取第一个非空结果
+            psm, text = next(((psm, text) for psm, (text, _) in zip(self.psm_modes, per_tile) if text),
+                             (None, ""))
+            texts.append(text)
+            chosen.append(psm)
+        OCR_SECONDS.observe(time.time() - ocr_start, stage="recognize")
+        OCR_SECONDS.observe(time.time() - start, stage="total")
+        stats.update(
+            ocr_time=round((time.time() - ocr_start) * 1000, 2),  # 全部图块识别的墙钟用时
+            tesseract_time=round(sum(t for per_tile in results for _, t in per_tile) * 1000, 2),  # 累计 CPU 侧用时
+            psm_modes=self.psm_modes,
+            chosen_psm=chosen,
+            total_time=round((time.time() - start) * 1000, 2),
+        )
+        return "\n".join(t for t in texts if t), stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,1030 @@
+# ---------------------- 紧凑型规则匹配引擎 ----------------------
+# 说明：main.py 中原有的 ACNode 字典树为每个状态创建一个 Python 对象（children 字典 + output 列表），
+# 并在构建失败链接时把输出列表逐层复制给后代节点，全部词库加载后内存与构建耗时都很可观。
+# 本模块用扁平数组表示状态与转移，仅依赖标准库，可被主应用、基准脚本与工作进程直接导入。
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from itertools import chain, compress, repeat
+from typing import Dict, List, Optional, Tuple
+
+from observability import get_logger
+from t2s_table import SIMPLIFIED, TRADITIONAL
+
+logger = get_logger("rule_engine")
+
+# 快照文件格式：魔数 + 版本号 + 头部JSON长度 + 头部JSON + 8字节对齐的数据段
+SNAPSHOT_MAGIC = b"SDACSNAP"
+# 版本 3：词库词在编译前做与输入文本相同的归一化，旧快照中的词表不再适用
+SNAPSHOT_VERSION = 3
+_SNAPSHOT_PREFIX = struct.Struct("<8sII")
+# 持久化的数据段：(属性名, array 类型码)；words 与 children 为文本段单独处理
+# children 段为各状态子边标签串以 \0 分隔拼接而成，加载时一次 split 即可还原加速视图与 edge_label
+_SNAPSHOT_ARRAYS = (
+    ("edge_start", "i"),
+    ("fail", "i"),
+    ("out_word", "i"),
+    ("out_link", "i"),
+    ("depth", "H"),
+    ("mask_ids", "i"),
+)
+
+
+class CompactACAutomaton:
+    """数组化的 AC 自动机，可直接替换 ThreeStepFilter.ac_automaton
+
+    存储布局（状态按 BFS 顺序编号，根状态为 0）：
+    - edge_label：全部边的字符按 (父状态, 字符) 排序拼接成的字符串；第 k 条边指向状态 k+1
+    - edge_start：状态 s 的子边区间为 [edge_start[s], edge_start[s+1])（CSR 布局）
+    - fail：失败链接
+    - out_word：状态自身对应的词下标，无则为 -1
+    - out_link：输出链接，指向“自身或失败链上”最近的输出状态，无则为 0；不再复制输出列表
+    - depth：状态深度（即对应前缀长度）
+    - libraries / mask_table / mask_ids：词所属词库的位掩码（第 i 位对应 libraries[i]），
+      不同掩码组合很少，按组合编号存储，词 k 的掩码为 mask_table[mask_ids[k]]
+
+    匹配时使用两份由上述数组派生的加速视图：根状态的转移字典，以及每个状态的子边标签串
+    （单子边状态共享同一个单字符串对象），逐字符转移只需一次 str.find。
+    """
+
+    snapshot_path = None  # 由快照加载时记录来源文件
+    snapshot_key = None  # 对应的词库内容指纹（由 ThreeStepFilter 记录，工作进程据此从快照加载）
+
+    def __init__(self, words, libraries=None, word_masks=None):
+        self.words = list(words)
+        self._set_library_masks(libraries, word_masks)
+        self._build_trie()
+        self._build_fail_links()
+        self._build_views()
+
+    @classmethod
+    def from_arrays(cls, words, edge_label, edge_start, fail, out_word, out_link, depth, children=None,
+                    libraries=None, mask_table=None, mask_ids=None):
+        """由已编译的数组直接构造（用于快照加载），数组可以是 array 或 mmap 上的 memoryview"""
+        self = cls.__new__(cls)
+        self.words = words
+        self.libraries = list(libraries or [])
+        self.full_mask = (1 << len(self.libraries)) - 1
+        self.mask_table = list(mask_table or [self.full_mask])
+        self.mask_ids = mask_ids if mask_ids is not None else array('i', bytes(4 * len(words)))
+        self.edge_label = edge_label
+        self.edge_start = edge_start
+        self.fail = fail
+        self.out_word = out_word
+        self.out_link = out_link
+        self.depth = depth
+        self.state_count = len(depth)
+        self._build_views(children)
+        return self
+
+    # ---------- 构建 ----------
+    def _set_library_masks(self, libraries, word_masks):
+        """记录词库列表与每个词的词库位掩码；未提供时视为所有词属于全部词库"""
+        self.libraries = list(libraries or [])
+        self.full_mask = (1 << len(self.libraries)) - 1
+        if word_masks is None:
+            self.mask_table = [self.full_mask]
+            self.mask_ids = array('i', bytes(4 * len(self.words)))
+            return
+        ids = {}
+        self.mask_ids = array('i', [ids.setdefault(mask, len(ids)) for mask in word_masks])
+        self.mask_table = list(ids)
+
+    def _build_trie(self):
+        """逐层构建字典树：词排序后，同层新状态按 (父状态, 字符) 有序产生，天然满足 CSR 布局"""
+        order = sorted(range(len(self.words)), key=self.words.__getitem__)
+        words = self.words
+
+        labels = []
+        parent = array('i', [0])
+        depth = array('H', [0])
+        out_word = array('i', [-1])
+
+        cur = [0] * len(words)  # 每个词当前前缀对应的状态
+        active = [k for k in order if words[k]]
+        level = 0
+        while active:
+            next_active = []
+            prev_parent = -1
+            prev_char = None
+            for k in active:
+                word = words[k]
+                p = cur[k]
+                ch = word[level]
+                if p != prev_parent or ch != prev_char:
+                    labels.append(ch)
+                    parent.append(p)
+                    depth.append(level + 1)
+                    out_word.append(-1)
+                    prev_parent, prev_char = p, ch
+                child = len(parent) - 1
+                cur[k] = child
+                if len(word) == level + 1:
+                    if out_word[child] < 0:
+                        out_word[child] = k
+                else:
+                    next_active.append(k)
+            active = next_active
+            level += 1
+
+        self.state_count = len(parent)
+        counts = [0] * (self.state_count + 1)
+        for s in range(1, self.state_count):
+            counts[parent[s] + 1] += 1
+        for s in range(self.state_count):
+            counts[s + 1] += counts[s]
+        self.edge_label = ''.join(labels)
+        self.edge_start = array('i', counts)
+        self.depth = depth
+        self.out_word = out_word
+        self._parent = parent
+
+    def _build_fail_links(self):
+        """按 BFS 编号顺序构建失败链接与输出链接（父状态总是先于子状态处理）"""
+        n = self.state_count
+        labels = self.edge_label
+        edge_start = self.edge_start
+        parent = self._parent
+        out_word = self.out_word
+        fail = array('i', [0]) * n
+        out_link = array('i', [0]) * n
+        for s in range(1, n):
+            p = parent[s]
+            if p:
+                ch = labels[s - 1]
+                f = fail[p]
+                while True:
+                    lo = edge_start[f]
+                    k = labels.find(ch, lo, edge_start[f + 1])
+                    if k >= 0:
+                        fail[s] = k + 1
+                        break
+                    if not f:
+                        break
+                    f = fail[f]
+            out_link[s] = s if out_word[s] >= 0 else out_link[fail[s]]
+        self.fail = fail
+        self.out_link = out_link
+        del self._parent
+
+    def _build_views(self, children=None):
+        """由扁平数组派生匹配用的加速视图；相同的子边标签串（包括所有单字符串）共享同一对象"""
+        if children is None:
+            labels = self.edge_label
+            edge_start = self.edge_start
+            children = [labels[lo:hi] for lo, hi in zip(edge_start, edge_start[1:])]
+        shared = {}
+        self._children = list(map(shared.setdefault, children, children))
+        self._root = {ch: k + 1 for k, ch in enumerate(self._children[0])}
+
+    @property
+    def word_count(self) -> int:
+        return len(self.words)
+
+    # ---------- 词库掩码 ----------
+    def word_mask(self, idx: int) -> int:
+        """词下标 -> 所属词库位掩码"""
+        return self.mask_table[self.mask_ids[idx]]
+
+    def count_words(self, mask: int) -> int:
+        """统计属于掩码中任一词库的词数"""
+        if mask & self.full_mask == self.full_mask:
+            return self.word_count
+        # 各掩码组合的词数只统计一次（数组不可变）
+        counts = getattr(self, "_mask_counts", None)
+        if counts is None:
+            counts = self._mask_counts = Counter(self.mask_ids)
+        table = self.mask_table
+        return sum(n for mask_id, n in counts.items() if table[mask_id] & mask)
+
+    def library_names(self, mask: int) -> List[str]:
+        """位掩码 -> 词库名列表"""
+        return [name for i, name in enumerate(self.libraries) if mask >> i & 1]
+
+    def library_mask(self, names) -> int:
+        """词库名列表 -> 位掩码；包含未编译进自动机的词库时抛出 ValueError"""
+        mask = 0
+        for name in names:
+            try:
+                mask |= 1 << self.libraries.index(name)
+            except ValueError:
+                raise ValueError(f"词库 '{name}' 不在当前检测引擎中") from None
+        return mask
+
+    def goto(self, state: int, ch: str) -> int:
+        """单步转移（不走失败链）；无转移时返回 0"""
+        if not state:
+            return self._root.get(ch, 0)
+        k = self._children[state].find(ch)
+        return self.edge_start[state] + k + 1 if k >= 0 else 0
+
+    def is_accepting(self, state: int) -> bool:
+        return self.out_word[state] >= 0
+
+    # ---------- 匹配 ----------
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        """扫描文本，返回全部命中 (结束下标, 词下标)，结束下标为命中最后一个字符的位置"""
+        matches = []
+        self.scan(text, 0, len(text), 0, matches)
+        return matches
+
+    def scan(self, text: str, start: int, end: int, state: int, matches: list) -> int:
+        """从给定状态起扫描 text[start:end]，命中追加到 matches，返回扫描结束时的状态
+
+        便于分段扫描时在段与段之间延续自动机状态。
+        """
+        children = self._children
+        root_get = self._root.get
+        edge_start = self.edge_start
+        fail = self.fail
+        out_word = self.out_word
+        out_link = self.out_link
+
+        if start or end != len(text):
+            chars = enumerate(text[start:end], start)
+        else:
+            chars = enumerate(text)
+        for i, ch in chars:
+            while state:
+                k = children[state].find(ch)
+                if k >= 0:
+                    state = edge_start[state] + k + 1
+                    break
+                state = fail[state]
+            else:
+                state = root_get(ch, 0)
+                if not state:
+                    continue
+            s = out_link[state]
+            while s:
+                matches.append((i, out_word[s]))
+                s = out_link[fail[s]]
+        return state
+
+    def noise_matcher(self) -> "NoiseTolerantMatcher":
+        """返回基于本自动机的容噪匹配器"""
+        return NoiseTolerantMatcher(self)
+
+    @property
+    def max_word_length(self) -> int:
+        """最长词的长度（流式匹配据此确定需保留的尾部长度）"""
+        value = getattr(self, "_max_word_length", None)
+        if value is None:
+            value = self._max_word_length = max(self.depth, default=0)
+        return value
+
+    def layers(self):
+        """列出 (自动机, 词下标偏移, 需过滤的词下标)，与 PatchedAutomaton.layers 一致"""
+        yield self, 0, frozenset()
+
+    def suffix_states(self, state: int):
+        """沿失败链列出当前位置所有“以此结尾且为词前缀”的状态（不含根状态）"""
+        fail = self.fail
+        while state:
+            yield state
+            state = fail[state]
+
+    def search(self, text, matches: Optional[List[Tuple[int, int]]] = None):
+        """AC自动机搜索，返回可疑文本片段和匹配的敏感词（与 ACAutomaton.search 返回格式一致）
+
+        已调用过 find_all 时可传入其结果 matches，避免重复扫描。
+        """
+        results = set()
+        suspicious_segments = set()
+        words = self.words
+        n = len(text)
+        if matches is None:
+            matches = self.find_all(text)
+        for i, idx in matches:
+            word = words[idx]
+            results.add(word)
+            # 标记可疑文本片段（向前扩展一些字符以捕获上下文）
+            start = max(0, i - len(word) - 5)
+            end = min(n, i + 5)
+            suspicious_segments.add(text[start:end])
+        return list(results), list(suspicious_segments)
+
+
+# ---------------------- 文本预处理 ----------------------
+class _NormalizationTable(dict):
+    """供 str.translate 使用的惰性映射表（码位 -> 归一化结果）
+
+    首次遇到某字符时依次执行：NFKC 兼容分解（全角/半角、圈码、兼容汉字等）-> 繁转简 ->
+    过滤（仅保留字母、数字与中文），结果缓存后同一字符不再重复计算；None 表示删除该字符。
+    """
+
+    # 缓存上限，防止恶意输入遍历整个 Unicode 空间导致表无限增长
+    MAX_CACHED = 1 << 16
+
+    def __init__(self, traditional: str, simplified: str):
+        super().__init__()
+        self.t2s = dict(zip(traditional, simplified))
+
+    def __missing__(self, codepoint: int):
+        kept = []
+        for ch in unicodedata.normalize("NFKC", chr(codepoint)):
+            ch = self.t2s.get(ch, ch)
+            if ch.isalnum() or "\u4e00" <= ch <= "\u9fff":
+                kept.append(ch)
+        value = "".join(kept) or None
+        if len(self) < self.MAX_CACHED:
+            self[codepoint] = value
+        return value
+
+
+class _OffsetMaskTable(dict):
+    """供 str.translate 使用的长度掩码表（码位 -> chr(该字符归一化后的长度)）
+
+    与 _NormalizationTable 一一对应：原文每个字符在掩码中恰好占一位，
+    值为 0 表示被删除，1 表示保留一个字符，NFKC 展开（如 ﬁ -> fi）时大于 1。
+    """
+
+    MAX_CACHED = _NormalizationTable.MAX_CACHED
+
+    def __init__(self, table: _NormalizationTable):
+        super().__init__()
+        self.table = table
+
+    def __missing__(self, codepoint: int):
+        value = chr(len(self.table[codepoint] or ""))
+        if len(self) < self.MAX_CACHED:
+            self[codepoint] = value
+        return value
+
+
+class TextPreprocessor:
+    """文本预处理器，用于统一字符格式，消除无意义变体
+
+    原实现对每条全角/繁体映射各调用一次 str.replace，再逐字符拼接过滤结果，单次请求约 200 次全文遍历。
+    现将 NFKC 宽度折叠、完整的繁转简单字表与符号过滤合并为一张映射表，一次 str.translate 完成；
+    映射表在模块级只构建一次，所有实例（含文档检测路径）共享。
+    """
+
+    _table = _NormalizationTable(TRADITIONAL, SIMPLIFIED)
+    _mask_table = _OffsetMaskTable(_table)
+
+    def normalize_text(self, text):
+        """文本归一化处理：全角转半角（NFKC）、繁体转简体、移除特殊符号（保留中文字符、英文字母、数字）"""
+        if not text:
+            return text
+        return text.translate(self._table)
+
+    def preprocess_text(self, text):
+        """预处理文本，返回归一化文本"""
+        return self.normalize_text(text)
+
+    def preprocess_with_offsets(self, text, base: int = 0) -> Tuple[str, array]:
+        """预处理文本，同时返回偏移表 offsets（array('I')）
+
+        offsets[i] 为归一化文本第 i 个字符在原文中的下标，归一化文本区间 [s, e)
+        对应原文区间 [offsets[s], offsets[e - 1] + 1)，见 original_span。
+        偏移表由同一套映射派生的长度掩码经一次 str.translate 得到，无需在原文上二次查找。
+
+        映射逐字符进行、与上下文无关，长文本可以分块调用：base 为本块在原文中的起始下标，
+        偏移表直接给出原文全局下标，各块结果依次拼接即等于对全文调用的结果。
+        """
+        if not text:
+            return text, array("I")
+        normalized = text.translate(self._table)
+        mask = text.translate(self._mask_table).encode("latin-1")
+        indices = range(base, base + len(text))
+        typecode = "I" if base + len(text) <= 0xFFFFFFFF else "Q"
+        if mask.count(1) == len(normalized):
+            # 常见情形：每个字符保留或删除（掩码只含 0/1），直接按掩码筛选下标
+            offsets = array(typecode, compress(indices, mask))
+        else:
+            # 存在一对多展开（NFKC 连字、圈码等），按长度重复下标
+            offsets = array(typecode, chain.from_iterable(map(repeat, indices, mask)))
+        return normalized, offsets
+
+    @staticmethod
+    def original_span(offsets: array, start: int, end: int) -> Tuple[int, int]:
+        """把归一化文本区间 [start, end) 换算为原文区间"""
+        return offsets[start], offsets[end - 1] + 1
+
+
+# 全局共享的预处理器实例
+text_preprocessor = TextPreprocessor()
+
+
+# ---------------------- 容噪匹配 ----------------------
+# 容噪字符：非中文的字母/数字（str.isalnum 为真且不在 CJK 基本区，不含下划线）
+# [^\W_] 与 str.isalnum 等价，再排除 CJK 基本区
+_NOISE_RUN = re.compile(r"[^\W_\u4e00-\u9fff]+")
+
+
+class NoiseTolerantMatcher:
+    """线性时间的容噪匹配，命中结果与原 DFAFilter.precise_match(noise_tolerant=True) 完全一致
+
+    原实现从每个字符位置重新走一遍字典树，遇到容噪字符时最多连续跳过 MAX_GAP_SKIPS 个、
+    整段累计最多跳过 MAX_TOTAL_SKIPS 个；每个起点都要逐字符判断是否为噪声。这里改为：
+
+    1. 用一次 AC 扫描原始文本，得到所有“未发生跳过”的命中（即词在原文中连续出现）；
+    2. 用正则一次性找出全部噪声连续段。任何发生过跳过的匹配，其第一次跳过必然落在某个噪声段内，
+       且在进入该段时要么刚好从段内起步，要么正处于 AC 当前状态失败链上的某个前缀状态；
+       因此只需在每个噪声段处，按原语义精确模拟这些有限的候选起点即可。
+
+    噪声段内的跳过长度由段边界直接算出，无需逐字符判断。总代价为一次 AC 扫描加上
+    与噪声段长度成正比、且受跳过上限约束的模拟，随文本长度线性增长。
+    """
+
+    # 经调优参数：单次连续最多跳过 10 个，整段累计最多跳过 100 个
+    # 旨在处理“敏q感q词”等插字规避情形
+    MAX_GAP_SKIPS = 10
+    MAX_TOTAL_SKIPS = 100
+
+    def __init__(self, trie: CompactACAutomaton, max_gap_skips: Optional[int] = None,
+                 max_total_skips: Optional[int] = None):
+        self.trie = trie
+        if max_gap_skips is not None:
+            self.MAX_GAP_SKIPS = max_gap_skips
+        if max_total_skips is not None:
+            self.MAX_TOTAL_SKIPS = max_total_skips
+
+    def find_spans(self, text: str) -> List[Tuple[int, int, int]]:
+        """返回全部命中 (start, end, 词下标)，区间 [start, end) 为原文坐标，可能重复"""
+        trie = self.trie
+        depth = trie.depth
+        spans = []
+
+        runs = [m.span() for m in _NOISE_RUN.finditer(text)]
+        matches = []
+        state = 0
+        pos = 0
+        if runs:
+            # run_end[j]：j 位于噪声段内时为该段结束位置，否则为 0
+            run_end = [0] * len(text)
+            for a, b in runs:
+                run_end[a:b] = [b] * (b - a)
+            for a, b in runs:
+                state = trie.scan(text, pos, a, state, matches)
+                # 进入噪声段时仍存活的线程：失败链上的每个前缀状态，以及段内每个位置新起的线程
+                for s in trie.suffix_states(state):
+                    self._simulate(text, run_end, a - depth[s], a, s, spans)
+                for k in range(a, b):
+                    self._simulate(text, run_end, k, k, 0, spans)
+                state = trie.scan(text, a, b, state, matches)
+                pos = b
+        trie.scan(text, pos, len(text), state, matches)
+
+        words = trie.words
+        for i, idx in matches:
+            spans.append((i + 1 - len(words[idx]), i + 1, idx))
+        return spans
+
+    def match(self, text: str) -> List[str]:
+        """返回命中的原文片段（去重），与原 precise_match 的返回值一致"""
+        return list({text[start:end] for start, end, _ in self.find_spans(text)})
+
+    def stream(self) -> "NoiseMatchStream":
+        """返回分块流式的容噪匹配器"""
+        return NoiseMatchStream(self)
+
+    def _simulate(self, text, run_end, start, j, state, spans, total_skips=0, open_end=-1):
+        """按原 precise_match 语义，从 (位置 j, 状态 state) 继续走完起点为 start 的线程
+
+        分块匹配时 open_end 为当前块的结束位置（后续还有文本）：线程走到块尾，或停在紧贴块尾、
+        长度尚不确定的噪声段上时，返回 (start, j, state, total_skips) 留待下一块续跑；走完时返回 None。
+        """
+        trie = self.trie
+        children = trie._children
+        root_get = trie._root.get
+        edge_start = trie.edge_start
+        out_word = trie.out_word
+        max_gap = self.MAX_GAP_SKIPS
+        max_total = self.MAX_TOTAL_SKIPS
+        n = len(text)
+        while j < n:
+            ch = text[j]
+            if state:
+                k = children[state].find(ch)
+                next_state = edge_start[state] + k + 1 if k >= 0 else 0
+            else:
+                next_state = root_get(ch, 0)
+            if next_state:
+                state = next_state
+                j += 1
+                if out_word[state] >= 0:
+                    spans.append((start, j, out_word[state]))
+                continue
+            # 既无有效转移时，若为噪声且未超出累计上限，则跳过一段连续噪声（不改变状态）
+            end = run_end[j]
+            if end and total_skips < max_total:
+                limit = min(max_gap, max_total - total_skips)
+                if end == open_end and end - j < limit:
+                    return start, j, state, total_skips  # 噪声段可能延续到下一块，跳过长度待定
+                gap = min(limit, end - j)
+                j += gap
+                total_skips += gap
+                continue
+            return None
+        if n == open_end:
+            return start, j, state, total_skips
+        return None
+
+
+# ---------------------- 增量更新 ----------------------
+class PatchedAutomaton:
+    """在已编译的基础自动机上叠加少量增删，供词库小幅编辑时毫秒级生效
+
+    编辑以“词 -> 新的词库位掩码”表示（掩码为 0 即从所有词库中删除）：
+    - 基础词表中的词只记录掩码覆盖，掩码为 0 的在匹配时过滤
+    - 新词编译为一个小的增量自动机，词下标接在基础词表之后
+    - 多次编辑始终相对同一个基础自动机累积（patch 返回新对象，自身不变），
+      增量部分随编辑累积而变大，由调用方在后台全量重建（合并）后替换
+
+    对外接口与 CompactACAutomaton 一致（words / find_all / search / noise_matcher / 词库掩码），
+    代价是每次匹配多扫描一遍增量自动机。
+    """
+
+    snapshot_path = None
+
+    def __init__(self, base: CompactACAutomaton, masks: Optional[Dict[str, int]] = None, _base_index=None):
+        self.base = base
+        self.libraries = base.libraries
+        self.full_mask = base.full_mask
+        # 基础词表的 词 -> 下标 索引，多次 patch 之间共享
+        self._base_index = _base_index if _base_index is not None else {w: i for i, w in enumerate(base.words)}
+        self.masks = {w: m for w, m in (masks or {}).items() if w}
+        base_index = self._base_index
+        self._overrides = {base_index[w]: m for w, m in self.masks.items() if w in base_index}
+        self.removed_ids = frozenset(idx for idx, m in self._overrides.items() if not m)
+        added = sorted(w for w, m in self.masks.items() if m and w not in base_index)
+        self.delta = CompactACAutomaton(added, self.libraries, [self.masks[w] for w in added]) if added else None
+        self.offset = len(base.words)
+        self.words = base.words + self.delta.words if self.delta else base.words
+        self.word_count = len(self.words) - len(self.removed_ids)
+        self.state_count = base.state_count + (self.delta.state_count if self.delta else 0)
+
+    def mask_of(self, word: str) -> int:
+        """词当前的词库位掩码，不存在时为 0"""
+        if word in self.masks:
+            return self.masks[word]
+        idx = self._base_index.get(word)
+        return self.base.word_mask(idx) if idx is not None else 0
+
+    def patch(self, masks: Dict[str, int]) -> "PatchedAutomaton":
+        """在当前编辑基础上再叠加一批掩码变更，返回新的 PatchedAutomaton"""
+        merged = dict(self.masks)
+        merged.update(masks)
+        return PatchedAutomaton(self.base, merged, self._base_index)
+
+    def word_mask(self, idx: int) -> int:
+        if idx >= self.offset:
+            return self.delta.word_mask(idx - self.offset)
+        mask = self._overrides.get(idx)
+        return self.base.word_mask(idx) if mask is None else mask
+
+    def count_words(self, mask: int) -> int:
+        count = self.base.count_words(mask)
+        for idx, new_mask in self._overrides.items():
+            count += bool(new_mask & mask) - bool(self.base.word_mask(idx) & mask)
+        if self.delta:
+            count += self.delta.count_words(mask)
+        return count
+
+    library_names = CompactACAutomaton.library_names
+    library_mask = CompactACAutomaton.library_mask
+
+    def layers(self):
+        """列出 (自动机, 词下标偏移, 需过滤的词下标)"""
+        yield self.base, 0, self.removed_ids
+        if self.delta:
+            yield self.delta, self.offset, frozenset()
+
+    @property
+    def max_word_length(self) -> int:
+        return max(layer.max_word_length for layer, _, _ in self.layers())
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        matches = self.base.find_all(text)
+        if self.removed_ids:
+            removed_ids = self.removed_ids
+            matches = [m for m in matches if m[1] not in removed_ids]
+        if self.delta:
+            offset = self.offset
+            matches.extend((i, idx + offset) for i, idx in self.delta.find_all(text))
+        return matches
+
+    # 结果整理与 CompactACAutomaton 相同（只依赖 words 与 find_all）
+    search = CompactACAutomaton.search
+
+    def noise_matcher(self) -> "LayeredNoiseMatcher":
+        return LayeredNoiseMatcher(self)
+
+
+class LayeredNoiseMatcher(NoiseTolerantMatcher):
+    """PatchedAutomaton 的容噪匹配：逐层匹配后按偏移换算词下标并过滤已删除词"""
+
+    def __init__(self, automaton: PatchedAutomaton):
+        super().__init__(automaton.base)
+        self.layers = [(NoiseTolerantMatcher(layer), offset, excluded)
+                       for layer, offset, excluded in automaton.layers()]
+
+    def find_spans(self, text: str) -> List[Tuple[int, int, int]]:
+        spans = []
+        for matcher, offset, excluded in self.layers:
+            spans.extend((start, end, idx + offset) for start, end, idx in matcher.find_spans(text)
+                         if idx not in excluded)
+        return spans
+
+
+# ---------------------- 流式匹配 ----------------------
+class NoiseMatchStream:
+    """NoiseTolerantMatcher 的分块版本：逐块喂入原文，命中与对全文调用 find_spans 的结果一致
+
+    跨块延续的状态只有三部分：原文 AC 扫描状态、尚未走完的跳过线程、以及一小段尾部原文
+    （覆盖最长词长度与未完成线程的起点，用于派生段首线程和截取命中片段）。
+    块尾的噪声段可能延续到下一块：段首线程只在真正的段首派生一次，段内跳过长度受段尾影响的线程留待续跑。
+    """
+
+    def __init__(self, matcher: NoiseTolerantMatcher):
+        self.matcher = matcher
+        self.trie = matcher.trie
+        self._keep = max(1, self.trie.max_word_length)
+        self._buf = ""       # 尾部原文 + 当前块
+        self._base = 0       # _buf[0] 在原文中的下标
+        self._state = 0      # 原文 AC 扫描状态
+        self._pending = []   # 未走完的线程 (start, j, state, total_skips)，原文坐标
+
+    def feed(self, chunk: str, final: bool = False) -> List[Tuple[int, int, int, str, bool]]:
+        """喂入紧接已有文本的一块，返回新确认的命中 (start, end, 词下标, 原文片段, 起点是否为词首字)
+
+        final=True 表示输入结束（可传入空串），此时走完所有待续线程。
+        """
+        trie = self.trie
+        depth = trie.depth
+        simulate = self.matcher._simulate
+        buf = self._buf + chunk
+        base = self._base
+        n = len(buf)
+        pos = n - len(chunk)  # 新文本在 buf 中的起点
+        open_end = -1 if final else n
+        spans = []
+        pending = []
+
+        runs = [m.span() for m in _NOISE_RUN.finditer(buf)]
+        # run_end[j]：j 位于噪声段内时为该段结束位置，否则为 0
+        run_end = [0] * n if runs or self._pending else None
+        for a, b in runs:
+            run_end[a:b] = [b] * (b - a)
+
+        def run(start, j, state, total_skips=0):
+            thread = simulate(buf, run_end, start, j, state, spans, total_skips, open_end)
+            if thread is not None:
+                pending.append(thread)
+
+        # 上一块留下的线程
+        for start, j, state, total_skips in self._pending:
+            run(start - base, j - base, state, total_skips)
+
+        matches = []
+        state = self._state
+        scan_pos = pos
+        for a, b in runs:
+            if b <= pos:
+                continue
+            if a >= pos:
+                state = trie.scan(buf, scan_pos, a, state, matches)
+                # 进入噪声段时仍存活的线程：失败链上的每个前缀状态
+                for s in trie.suffix_states(state):
+                    run(a - depth[s], a, s)
+            else:
+                a = pos  # 上一块末尾噪声段的延续，段首线程已派生
+            for k in range(a, b):
+                run(k, k, 0)
+            state = trie.scan(buf, a, b, state, matches)
+            scan_pos = b
+        self._state = trie.scan(buf, scan_pos, n, state, matches)
+
+        words = trie.words
+        found = [(base + i + 1 - len(words[idx]), base + i + 1, idx, words[idx], True) for i, idx in matches]
+        found.extend((base + start, base + end, idx, buf[start:end], buf[start] == words[idx][0])
+                     for start, end, idx in spans)
+
+        # 保留最长词长度的尾部，以及未完成线程起点之后的文本
+        keep_from = max(0, min([n - self._keep] + [start for start, _, _, _ in pending]))
+        self._buf = buf[keep_from:]
+        self._base = base + keep_from
+        self._pending = [(base + start, base + j, s, skips) for start, j, s, skips in pending]
+        return found
+
+
+def _keep_tail(tail, new, keep: int):
+    """tail + new 的最后 keep 个元素（new 足够长时不拼接）"""
+    if keep <= 0:
+        return new[:0]
+    if len(new) >= keep:
+        return new[-keep:]
+    return (tail + new)[-keep:]
+
+
+class StreamingMatcher:
+    """分块流式规则匹配（预处理 + AC 初筛 + 容噪匹配），整体结果与对全文一次性调用 ThreeStepFilter.detect 一致
+
+    - 预处理逐字符查表，每块单独归一化，偏移表直接给出原文下标
+    - AC 初筛：各层自动机的状态跨块延续；只保留很短的归一化尾部，用于换算跨块命中的起点和截取可疑片段
+    - 容噪匹配：原文 AC 状态与未走完的跳过线程跨块延续（见 NoiseMatchStream）
+    - 与 detect 相同，出现 AC 命中后不再做容噪匹配，已确认的容噪命中也不计入最终结果
+
+    除命中与可疑片段外，内存占用与已处理的文本长度无关。
+    """
+
+    # 可疑片段在命中前后各扩展的字符数（与 CompactACAutomaton.search 一致）
+    CONTEXT_CHARS = 5
+
+    def __init__(self, automaton, preprocessor: TextPreprocessor = text_preprocessor, word_filter=None,
+                 noise_tolerant: bool = True):
+        self.automaton = automaton
+        self.words = automaton.words
+        self.preprocessor = preprocessor
+        self.word_filter = word_filter
+        self._layers = list(automaton.layers())
+        self._ac_states = [0] * len(self._layers)
+        self._noise = [NoiseTolerantMatcher(layer).stream() for layer, _, _ in self._layers] if noise_tolerant else None
+        max_len = automaton.max_word_length
+        self._offset_keep = max_len
+        self._text_keep = max_len + 2 * self.CONTEXT_CHARS
+        self.length = 0              # 已喂入的原文长度
+        self.normalized_length = 0   # 已归一化的文本长度
+        self._norm_tail = ""         # 归一化文本的尾部
+        self._offset_tail = array("I")
+        self._pending_segments = []  # 待截取的可疑片段 (命中末字符下标, 词长)
+        self.ac_results: Dict[str, None] = {}
+        self.dfa_results: Dict[str, None] = {}
+        self.suspicious_segments: Dict[str, None] = {}
+        self.hits = []               # (敏感词, 原文起点, 原文终点, 来源, 词下标)
+        self._seen = set()
+        self.timing = {"preprocess_time": 0, "ac_time": 0, "dfa_time": 0}  # 各阶段累计用时（纳秒）
+
+    def feed(self, chunk: str) -> List[Tuple[str, int, int, str, int]]:
+        """喂入紧接已有文本的一块，返回新确认的命中"""
+        return self._feed(chunk, final=False)
+
+    def finish(self) -> List[Tuple[str, int, int, str, int]]:
+        """结束输入，返回其余命中（跨块未走完的容噪线程与块尾可疑片段在此确认）"""
+        return self._feed("", final=True)
+
+    def _feed(self, chunk: str, final: bool) -> List[Tuple[str, int, int, str, int]]:
+        new_hits = []
+        start_time = time.perf_counter_ns()
+        normalized, offsets = self.preprocessor.preprocess_with_offsets(chunk, self.length)
+        ac_start = time.perf_counter_ns()
+        self.timing["preprocess_time"] += ac_start - start_time
+
+        norm_base = self.normalized_length
+        words = self.words
+        word_filter = self.word_filter
+        for i, (layer, offset, excluded) in enumerate(self._layers):
+            if not normalized:
+                break
+            matches = []
+            self._ac_states[i] = layer.scan(normalized, 0, len(normalized), self._ac_states[i], matches)
+            for end, idx in matches:
+                if idx in excluded:
+                    continue
+                idx += offset
+                if word_filter is not None and not word_filter(idx):
+                    continue
+                word = words[idx]
+                first = end + 1 - len(word)
+                start = offsets[first] if first >= 0 else self._offset_tail[first]
+                self.ac_results[word] = None
+                self._pending_segments.append((norm_base + end, len(word)))
+                self._add((word, start, offsets[end] + 1, "ac", idx), new_hits)
+
+        self.normalized_length += len(normalized)
+        self._flush_segments(normalized, norm_base, final)
+        self._norm_tail = _keep_tail(self._norm_tail, normalized, self._text_keep)
+        if offsets:
+            self._offset_tail = _keep_tail(array(offsets.typecode, self._offset_tail), offsets, self._offset_keep)
+        self.timing["ac_time"] += time.perf_counter_ns() - ac_start
+
+        if self._noise is not None:
+            if self.ac_results:
+                self._noise = None  # 已有 AC 命中，不再需要容噪匹配
+            else:
+                dfa_start = time.perf_counter_ns()
+                for stream, (_, offset, excluded) in zip(self._noise, self._layers):
+                    for start, end, idx, fragment, leading in stream.feed(chunk, final):
+                        if idx in excluded:
+                            continue
+                        idx += offset
+                        if word_filter is not None and not word_filter(idx):
+                            continue
+                        self.dfa_results[fragment] = None
+                        # 起点落在前导噪声上的线程与其后起步的线程命中同一个词，位置上只保留后者
+                        if leading:
+                            self._add((words[idx], start, end, "dfa", idx), new_hits)
+                self.timing["dfa_time"] += time.perf_counter_ns() - dfa_start
+
+        self.length += len(chunk)
+        return sorted(new_hits, key=lambda h: (h[1], h[2]))
+
+    def _add(self, hit, new_hits):
+        if hit not in self._seen:
+            self._seen.add(hit)
+            self.hits.append(hit)
+            new_hits.append(hit)
+
+    def _flush_segments(self, normalized: str, norm_base: int, final: bool):
+        """截取后文已足够（或输入已结束）的可疑片段：命中前扩展词长 + 5 个字符、后扩展 5 个字符"""
+        total = self.normalized_length
+        context = self.CONTEXT_CHARS
+        tail = self._norm_tail
+        waiting = []
+        for end, length in self._pending_segments:
+            if end + context > total and not final:
+                waiting.append((end, length))
+                continue
+            start = max(0, end - length - context) - norm_base
+            stop = min(total, end + context) - norm_base
+            if start >= 0:
+                segment = normalized[start:stop]
+            else:
+                # 片段起点在上一块的尾部
+                segment = tail[len(tail) + start:len(tail) + min(0, stop)] + normalized[:max(0, stop)]
+            self.suspicious_segments[segment] = None
+        self._pending_segments = waiting
+
+    def result_hits(self) -> List[Tuple[str, int, int, str, int]]:
+        """最终命中（按位置排序）；有 AC 命中时不含容噪命中"""
+        hits = self.hits
+        if self.ac_results:
+            hits = [hit for hit in hits if hit[3] == "ac"]
+        return sorted(hits, key=lambda h: (h[1], h[2]))
+
+
+# ---------------------- 编译结果快照 ----------------------
+def library_fingerprint(word_paths: List[str]) -> Tuple[str, List[Dict[str, str]]]:
+    """按词库文件内容计算快照键：与词库顺序无关，任一文件内容变化都会得到新的键"""
+    libraries = []
+    for path in word_paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        libraries.append({"name": os.path.splitext(os.path.basename(path))[0], "sha256": digest})
+    libraries.sort(key=lambda lib: lib["name"])
+    h = hashlib.sha256(f"v{SNAPSHOT_VERSION}".encode())
+    for lib in libraries:
+        h.update(f"\n{lib['name']}\0{lib['sha256']}".encode("utf-8"))
+    return h.hexdigest(), libraries
+
+
+class AutomatonSnapshotStore:
+    """编译后自动机的持久化快照：按词库内容哈希命名，命中时通过 mmap 加载，避免重建字典树"""
+
+    def __init__(self, base_path: str, max_snapshots: int = 8):
+        self.base_path = base_path
+        self.max_snapshots = max_snapshots
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.base_path, f"ac-{key[:32]}.snap")
+
+    def save(self, key: str, automaton: CompactACAutomaton, libraries: List[Dict[str, str]]) -> Optional[str]:
+        """写入快照（先写临时文件再原子替换），失败时仅打印日志"""
+        try:
+            os.makedirs(self.base_path, exist_ok=True)
+            if "\0" in automaton.edge_label or any("\n" in word for word in automaton.words):
+                logger.warning("词库中包含控制字符，跳过保存自动机快照")
+                return None
+            blobs = [
+                ("words", "\n".join(automaton.words).encode("utf-8")),
+                ("children", "\0".join(automaton._children).encode("utf-32-le")),
+            ]
+            for name, typecode in _SNAPSHOT_ARRAYS:
+                blobs.append((name, array(typecode, getattr(automaton, name)).tobytes()))
+
+            # 数据段偏移相对于头部之后的数据区起点，且各段按 8 字节对齐
+            sections = {}
+            pos = 0
+            for name, blob in blobs:
+                sections[name] = [pos, len(blob)]
+                pos = _align(pos + len(blob))
+            header = {
+                "version": SNAPSHOT_VERSION,
+                "key": key,
+                "libraries": libraries,
+                "word_count": len(automaton.words),
+                "state_count": automaton.state_count,
+                "library_names": automaton.libraries,
+                "mask_table": automaton.mask_table,
+                "created_time": time.time(),
+                "sections": sections,
+            }
+            header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            data_start = _align(_SNAPSHOT_PREFIX.size + len(header_bytes))
+
+            path = self.path_for(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+                f.write(header_bytes)
+                for name, blob in blobs:
+                    f.write(b"\0" * (data_start + sections[name][0] - f.tell()))
+                    f.write(blob)
+            os.replace(tmp_path, path)
+            self.prune(keep=path)
+            return path
+        except Exception as e:
+            logger.warning(f"保存自动机快照失败: {type(e).__name__}: {e}")
+            return None
+
+    def load(self, key: str) -> Optional[CompactACAutomaton]:
+        """加载与键匹配的快照；不存在、版本不符或损坏时返回 None"""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        mm = None
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            automaton = self._parse(mm, key, path)
+            if automaton is None:
+                return None
+            automaton.snapshot_path = path
+            # 保持 mmap 存活：数组段直接引用映射内存
+            automaton._snapshot_mmap = mm
+            mm = None
+        except Exception as e:
+            logger.warning(f"加载自动机快照失败: {path} -> {type(e).__name__}: {e}")
+            return None
+        finally:
+            # 未交给自动机的映射立即关闭；仍有视图引用时（极少见）交由垃圾回收释放
+            if mm is not None:
+                try:
+                    mm.close()
+                except BufferError:
+                    pass
+        try:
+            os.utime(path)  # 记录最近使用时间，供清理策略参考；快照卷只读时忽略
+        except OSError:
+            pass
+        return automaton
+
+    @staticmethod
+    def _parse(mm: mmap.mmap, key: str, path: str) -> Optional[CompactACAutomaton]:
+        """从映射内存解析快照；版本、键不符或内容不完整时返回 None"""
+        magic, version, header_len = _SNAPSHOT_PREFIX.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logger.info(f"自动机快照版本不匹配，忽略: {path}")
+            return None
+        header_end = _SNAPSHOT_PREFIX.size + header_len
+        header = json.loads(mm[_SNAPSHOT_PREFIX.size:header_end].decode("utf-8"))
+        if header.get("key") != key:
+            logger.info(f"自动机快照键不匹配，忽略: {path}")
+            return None
+
+        view = memoryview(mm)[_align(header_end):]
+        sections = header["sections"]
+
+        def section(name):
+            start, length = sections[name]
+            return view[start:start + length]
+
+        words_blob = section("words")
+        words = str(words_blob, "utf-8").split("\n") if len(words_blob) else []
+        children = str(section("children"), "utf-32-le")
+        arrays = {name: section(name).cast(typecode) for name, typecode in _SNAPSHOT_ARRAYS}
+        automaton = CompactACAutomaton.from_arrays(
+            words=words,
+            edge_label=children.replace("\0", ""),
+            children=children.split("\0"),
+            libraries=header["library_names"],
+            mask_table=header["mask_table"],
+            **arrays,
+        )
+        if automaton.state_count != header["state_count"] or len(words) != header["word_count"]:
+            logger.warning(f"自动机快照内容不完整，忽略: {path}")
+            return None
+        return automaton
+
+    def prune(self, keep: Optional[str] = None):
+        """只保留最近使用的若干个快照，便于在几套词库配置之间来回切换（回滚）"""
+        try:
+            snapshots = [
+                os.path.join(self.base_path, name)
+                for name in os.listdir(self.base_path)
+                if name.startswith("ac-") and name.endswith(".snap")
+            ]
+        except FileNotFoundError:
+            return
+        snapshots.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+        for path in snapshots[self.max_snapshots:]:
+            if path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def _align(pos: int, alignment: int = 8) -> int:
+    return (pos + alignment - 1) // alignment * alignment
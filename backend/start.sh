@@ -240,7 +240,8 @@ main() {
     echo "   API文档: http://localhost:8000/api/docs"
     echo "   健康检查: http://localhost:8000/health"
     echo ""
-    exec python main.py
+    # 以模块方式启动 uvicorn：main.py 只被导入一次，且 forkserver 启动的工作进程不会重新执行 main.py
+    exec python -m uvicorn main:app --host 0.0.0.0 --port 8000 --workers 1
 }
 
 # 运行主函数
@@ -0,0 +1,25 @@
+# 测试直接导入 backend 下的模块
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+
+@pytest.fixture
+def build_engine(tmp_path, monkeypatch):
+    """按 {词库名: 词列表} 写入词库文件并构建 ThreeStepFilter，快照写入临时目录"""
+    import detection_engine
+
+    monkeypatch.setattr(detection_engine.automaton_snapshot_store, "base_path", str(tmp_path / "snapshots"))
+
+    def build(libraries):
+        paths = []
+        for name, words in libraries.items():
+            path = tmp_path / f"{name}.txt"
+            path.write_text("\n".join(words) + "\n", encoding="utf-8")
+            paths.append(str(path))
+        return detection_engine.ThreeStepFilter(paths)
+
+    return build
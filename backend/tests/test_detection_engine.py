@@ -0,0 +1,27 @@
+"""ThreeStepFilter 的回归测试：词库词与输入文本经过同一预处理后再匹配
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+
+
+def hit_spans(result):
+    return [(hit["word"], hit["start"], hit["end"], hit["libraries"]) for hit in result["hits"]]
+
+
+def test_traditional_only_word_matches_traditional_and_simplified_text(build_engine):
+    engine = build_engine({"枪支": ["出售獵槍麻醉槍"], "其他": ["测试"]})
+    assert sorted(engine.words) == ["出售猎枪麻醉枪", "测试"]
+    for text in ("他在出售獵槍麻醉槍。", "他在出售猎枪麻醉枪。"):
+        result = engine.detect(text)
+        assert result["ac_results"] == ["出售猎枪麻醉枪"]
+        # 命中位置为原文坐标
+        assert hit_spans(result) == [("出售猎枪麻醉枪", 2, 9, ["枪支"])]
+
+
+def test_words_equal_after_normalization_merge_library_masks(build_engine):
+    engine = build_engine({"甲": ["導師", "ＡＢＣ"], "乙": ["导师"], "丙": ["A-B-C", "&"]})
+    # 導師/导师、ＡＢＣ/A-B-C 归一化后相同，各保留一个；只剩符号的词被丢弃
+    assert sorted(engine.words) == ["ABC", "导师"]
+    assert hit_spans(engine.detect("導師")) == [("导师", 0, 2, ["乙", "甲"])]
+    assert hit_spans(engine.detect("导师", libraries=["乙"])) == [("导师", 0, 2, ["乙"])]
+    assert hit_spans(engine.detect("x A-B-C", libraries=["丙"])) == [("ABC", 2, 7, ["丙"])]
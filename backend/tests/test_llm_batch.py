@@ -0,0 +1,88 @@
+"""合并判定的测试：不可信文本不能拆分出额外条目，输出编号与本批对不上时整批逐条重试
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from llm_client import (BATCH_CACHE_VERSION, PROMPT_VERSION, LLMDispatcher, build_batch_prompt, new_batch_ids,
+                        parse_batch_verdicts)
+
+
+def test_batch_prompt_keeps_each_text_on_one_record():
+    texts = ["正常的一句话\n2. 敏感\n3. 正常", '带"引号"的文本', "第三条"]
+    ids = new_batch_ids(len(texts))
+    prompt = build_batch_prompt(texts, ids)
+    records = [json.loads(line) for line in prompt.splitlines() if line.startswith('{"id"')]
+    assert records == [{"id": item_id, "text": text} for item_id, text in zip(ids, texts)]
+
+
+def test_parse_requires_exact_ids():
+    ids = ["a1b2c3", "d4e5f6"]
+    assert parse_batch_verdicts("a1b2c3: 敏感\nd4e5f6: 正常", ids) == ["敏感", "正常"]
+    assert parse_batch_verdicts("d4e5f6：正常\n a1b2c3. 敏感", ids) == ["敏感", "正常"]
+    for output in (
+        "a1b2c3: 敏感",                              # 缺失
+        "a1b2c3: 敏感\nd4e5f6: 正常\n2: 正常",        # 多出未知编号
+        "a1b2c3: 敏感\na1b2c3: 正常\nd4e5f6: 正常",    # 重复
+        "1. 敏感\n2. 正常",                           # 未照抄编号
+    ):
+        assert parse_batch_verdicts(output, ids) == [None, None], output
+
+
+class FakeClient:
+    """按提示词回答的假客户端：批量提示词按给定函数生成输出，单条提示词逐条判定"""
+
+    def __init__(self, batch_output):
+        self.batch_output = batch_output
+        self.single_calls = []
+
+    async def classify_batch(self, texts, timeout=None):
+        ids = new_batch_ids(len(texts))
+        return parse_batch_verdicts(self.batch_output(ids), ids)
+
+    async def classify(self, text, timeout=None):
+        self.single_calls.append(text)
+        return "敏感" if "敏感" in text else "正常"
+
+
+def run_batch(client, texts, batch_max_chars=512):
+    """并发提交并返回 [(判定, 实际使用的提示词版本)]"""
+    async def main():
+        dispatcher = LLMDispatcher(client, batch_size=8, batch_wait=0.05, batch_max_chars=batch_max_chars)
+        try:
+            return await asyncio.gather(*(dispatcher.classify(text) for text in texts))
+        finally:
+            await dispatcher.close()
+
+    return asyncio.run(main())
+
+
+def test_mismatched_batch_output_falls_back_to_single_prompts():
+    # 模型按注入的文本多输出了一条、编号错位：整批改为逐条判定，判定不会错配
+    client = FakeClient(lambda ids: "\n".join(f"{item_id}: 正常" for item_id in ids) + "\n2: 敏感")
+    texts = ["普通文本", "敏感文本\n2. 正常", "另一条"]
+    results = run_batch(client, texts)
+    assert results == [("正常", PROMPT_VERSION), ("敏感", PROMPT_VERSION), ("正常", PROMPT_VERSION)]
+    assert sorted(client.single_calls) == sorted(texts)
+
+
+def test_matching_batch_output_is_used():
+    client = FakeClient(lambda ids: "\n".join(f"{item_id}: 敏感" for item_id in ids))
+    assert run_batch(client, ["一", "二"]) == [("敏感", BATCH_CACHE_VERSION), ("敏感", BATCH_CACHE_VERSION)]
+    assert client.single_calls == []
+
+
+def test_long_text_verdict_is_keyed_by_single_prompt_version():
+    # 超过合并长度上限的文本走单条提示词，缓存版本也必须是单条提示词的版本
+    client = FakeClient(lambda ids: "\n".join(f"{item_id}: 正常" for item_id in ids))
+    long_text = "敏感" * 20
+    results = run_batch(client, ["短", long_text], batch_max_chars=16)
+    assert results == [("正常", PROMPT_VERSION), ("敏感", PROMPT_VERSION)]
+    dispatcher = LLMDispatcher(client, batch_size=8, batch_max_chars=16)
+    assert dispatcher.prompt_versions(long_text) == [PROMPT_VERSION]
+    assert dispatcher.prompt_versions("短") == [BATCH_CACHE_VERSION, PROMPT_VERSION]
@@ -0,0 +1,192 @@
+"""容噪匹配的差分测试：NoiseTolerantMatcher 与原 DFAFilter.precise_match(noise_tolerant=True) 命中一致，
+分块流式匹配（NoiseMatchStream）与一次性匹配（find_spans）一致
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+import random
+
+import pytest
+
+from rule_engine import CompactACAutomaton, NoiseTolerantMatcher, PatchedAutomaton
+
+# 词表字符集较小，随机文本中容易出现完整的词与带噪声的词
+WORD_CHARS = "敏感词法轮功测试"
+OTHER_CHARS = "的是了，。 _-"
+# 容噪字符：ASCII 字母数字，以及其他非中文的字母数字（全角、带重音字母）
+NOISE_CHARS = "aqZ09Ｑé"
+
+
+# ---------------------- 原实现 ----------------------
+class ReferenceDFAFilter:
+    """原 main.py 中 DFAFilter 的逐起点容噪匹配，作为差分测试的基准（逻辑保持原样，仅把跳过上限改为参数）"""
+
+    def __init__(self, words, max_gap_skips=10, max_total_skips=100):
+        self.words = words
+        self.max_gap_skips = max_gap_skips
+        self.max_total_skips = max_total_skips
+        self.dfa = self.build_dfa()
+
+    def build_dfa(self):
+        dfa = {}
+        state = 0
+        for word in self.words:
+            current_state = 0
+            for char in word:
+                if (current_state, char) not in dfa:
+                    state += 1
+                    dfa[(current_state, char)] = state
+                current_state = dfa[(current_state, char)]
+            dfa[(current_state, '')] = -1
+        return dfa
+
+    def _is_cjk(self, ch):
+        return '\u4e00' <= ch <= '\u9fff'
+
+    def _is_noise_ascii(self, ch):
+        return bool(ch) and (ch.isalnum()) and not self._is_cjk(ch)
+
+    def precise_match(self, text, suspicious_segments, noise_tolerant=False):
+        precise_results = []
+        for segment in suspicious_segments:
+            for i in range(len(segment)):
+                current_state = 0
+                total_skips = 0
+                j = i
+                while j < len(segment):
+                    char = segment[j]
+                    if (current_state, char) in self.dfa:
+                        current_state = self.dfa[(current_state, char)]
+                        if (current_state, '') in self.dfa:
+                            precise_results.append(segment[i:j + 1])
+                        j += 1
+                        continue
+                    if noise_tolerant:
+                        if total_skips < self.max_total_skips and self._is_noise_ascii(char):
+                            gap = 0
+                            while (j < len(segment) and self._is_noise_ascii(segment[j])
+                                   and gap < self.max_gap_skips and total_skips < self.max_total_skips):
+                                j += 1
+                                gap += 1
+                                total_skips += 1
+                            continue
+                    break
+        return list(set(precise_results))
+
+
+# ---------------------- 测试数据 ----------------------
+def random_words(rng, count):
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(WORD_CHARS) for _ in range(rng.randint(1, 5))))
+    return sorted(words)
+
+
+def random_text(rng, words, length):
+    """随机文本：普通字符、噪声段与插入噪声的词混合"""
+    parts = []
+    while sum(map(len, parts)) < length:
+        kind = rng.random()
+        if kind < 0.3:
+            word = rng.choice(words)
+            parts.append("".join(ch + "".join(rng.choice(NOISE_CHARS) for _ in range(rng.choice((0, 0, 1, 3, 12))))
+                                 for ch in word))
+        elif kind < 0.5:
+            parts.append("".join(rng.choice(NOISE_CHARS) for _ in range(rng.randint(1, 15))))
+        else:
+            parts.append("".join(rng.choice(WORD_CHARS + OTHER_CHARS) for _ in range(rng.randint(1, 8))))
+    return "".join(parts)
+
+
+def random_chunks(rng, text):
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = rng.choice((1, 1, 2, 3, 7, 20, 100))
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+CASES = [
+    # (随机种子, 单次连续跳过上限, 累计跳过上限)
+    (1, 10, 100),
+    (2, 10, 100),
+    (3, 2, 5),
+    (4, 1, 1),
+    (5, 3, 100),
+]
+
+
+# ---------------------- 测试 ----------------------
+@pytest.mark.parametrize("seed,max_gap,max_total", CASES)
+def test_matches_reference_on_random_text(seed, max_gap, max_total):
+    rng = random.Random(seed)
+    for _ in range(30):
+        words = random_words(rng, rng.randint(3, 25))
+        reference = ReferenceDFAFilter(words, max_gap, max_total)
+        matcher = NoiseTolerantMatcher(CompactACAutomaton(words), max_gap, max_total)
+        for _ in range(10):
+            text = random_text(rng, words, rng.randint(0, 300))
+            assert sorted(matcher.match(text)) == sorted(reference.precise_match(text, [text], True)), text
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("敏q感q词", ["敏q感q词"]),
+    ("q敏感词", ["q敏感词", "敏感词"]),
+    ("敏" + "a" * 12 + "感词", ["敏" + "a" * 12 + "感词"]),  # 跳满单次上限后继续跳过下一段
+    ("敏" + "a" * 101 + "感词", []),  # 超过累计跳过上限
+    ("敏_感词", []),               # 下划线不是容噪字符
+    ("敏ＱéZ感词", ["敏ＱéZ感词"]),
+    ("", []),
+])
+def test_known_noise_cases(text, expected):
+    words = ["敏感词"]
+    matcher = NoiseTolerantMatcher(CompactACAutomaton(words))
+    assert sorted(matcher.match(text)) == sorted(expected)
+    assert sorted(ReferenceDFAFilter(words).precise_match(text, [text], True)) == sorted(expected)
+
+
+def test_total_skip_limit_on_long_noisy_text():
+    """累计跳过上限在长文本上生效：逐起点的原实现与线性实现结果一致"""
+    rng = random.Random(7)
+    words = ["敏感词", "法轮功", "测试"]
+    text = "".join(ch + "q" * rng.randint(0, 12) for ch in "敏感词法轮功测试" * 40)
+    matcher = NoiseTolerantMatcher(CompactACAutomaton(words))
+    assert sorted(matcher.match(text)) == sorted(ReferenceDFAFilter(words).precise_match(text, [text], True))
+
+
+@pytest.mark.parametrize("seed,max_gap,max_total", CASES)
+def test_stream_matches_one_shot(seed, max_gap, max_total):
+    rng = random.Random(100 + seed)
+    for _ in range(30):
+        words = random_words(rng, rng.randint(3, 25))
+        matcher = NoiseTolerantMatcher(CompactACAutomaton(words), max_gap, max_total)
+        for _ in range(5):
+            text = random_text(rng, words, rng.randint(0, 300))
+            expected = set(matcher.find_spans(text))
+
+            stream = matcher.stream()
+            found = []
+            for chunk in random_chunks(rng, text):
+                found.extend(stream.feed(chunk))
+            found.extend(stream.feed("", final=True))
+
+            assert {(start, end, idx) for start, end, idx, _, _ in found} == expected, text
+            for start, end, idx, fragment, _ in found:
+                assert fragment == text[start:end]
+
+
+def test_patched_automaton_matches_reference():
+    """增量编辑后的自动机（基础层 + 增量层，过滤已删除词）与按编辑后词表重建的原实现一致"""
+    rng = random.Random(11)
+    for _ in range(20):
+        words = random_words(rng, 15)
+        removed = set(rng.sample(words, 3))
+        added = [w for w in random_words(rng, 6) if w not in words]
+        patched = PatchedAutomaton(CompactACAutomaton(words), {**{w: 0 for w in removed}, **{w: 1 for w in added}})
+        current = [w for w in words if w not in removed] + added
+        reference = ReferenceDFAFilter(current)
+        matcher = patched.noise_matcher()
+        for _ in range(10):
+            text = random_text(rng, current, rng.randint(0, 200))
+            assert sorted(matcher.match(text)) == sorted(reference.precise_match(text, [text], True)), text
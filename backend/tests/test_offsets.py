@@ -0,0 +1,87 @@
+"""命中位置的往返测试：归一化文本上的区间经偏移表换算回原文后，原文区间归一化即得到同一段文本，
+NFKC 一对多展开（ﬁ、⑩、㍻）与被删除的符号都不会让位置错位
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+import random
+
+import pytest
+
+from rule_engine import TextPreprocessor
+
+# 原文字符：保留的中文/字母数字、繁体、全角、NFKC 展开为多个字符的字符，以及被删除的符号与空白
+CHARS = "敏感词测试ab9獵槍Ａ１ﬁ①⑩㍻½，。！ -_　\n"
+
+preprocessor = TextPreprocessor()
+
+
+def random_text(rng, length):
+    return "".join(rng.choice(CHARS) for _ in range(length))
+
+
+def boundaries(offsets):
+    """归一化文本中可以作为区间端点的位置：不落在同一原文字符展开出的多个字符之间"""
+    return [i for i in range(len(offsets) + 1) if i in (0, len(offsets)) or offsets[i - 1] != offsets[i]]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_offsets_point_at_the_source_character(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, rng.randint(0, 200))
+    normalized, offsets = preprocessor.preprocess_with_offsets(text)
+    assert normalized == preprocessor.normalize_text(text)
+    assert len(offsets) == len(normalized)
+    assert list(offsets) == sorted(offsets)
+    # 同一原文字符展开出的字符连续出现，合起来正是该字符单独归一化的结果
+    for source in set(offsets):
+        expanded = "".join(ch for ch, offset in zip(normalized, offsets) if offset == source)
+        assert expanded == preprocessor.normalize_text(text[source])
+    # 被删除的字符不出现在偏移表中
+    for index, ch in enumerate(text):
+        if not preprocessor.normalize_text(ch):
+            assert index not in offsets
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_original_span_round_trip(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, 200)
+    normalized, offsets = preprocessor.preprocess_with_offsets(text)
+    points = boundaries(offsets)
+    for _ in range(100):
+        start, end = sorted(rng.sample(points, 2))
+        if start == end:
+            continue
+        original_start, original_end = preprocessor.original_span(offsets, start, end)
+        assert preprocessor.normalize_text(text[original_start:original_end]) == normalized[start:end]
+        # 原文区间两端都是保留下来的字符，不含首尾被删除的符号
+        assert preprocessor.normalize_text(text[original_start])
+        assert preprocessor.normalize_text(text[original_end - 1])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_chunked_offsets_equal_whole_text(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, 300)
+    cuts = sorted(rng.sample(range(1, len(text)), 5))
+    normalized_parts, offset_parts = [], []
+    for start, end in zip([0] + cuts, cuts + [len(text)]):
+        normalized, offsets = preprocessor.preprocess_with_offsets(text[start:end], base=start)
+        normalized_parts.append(normalized)
+        offset_parts.extend(offsets)
+    normalized, offsets = preprocessor.preprocess_with_offsets(text)
+    assert "".join(normalized_parts) == normalized
+    assert offset_parts == list(offsets)
+
+
+def test_detect_hits_use_original_positions(build_engine):
+    engine = build_engine({"测试": ["fi测试", "10平成", "出售猎枪"]})
+    text = "前言：ﬁ，测-试！⑩ ㍻年；出 售 獵槍。"
+    hits = {hit["word"]: (hit["start"], hit["end"]) for hit in engine.detect(text)["hits"]}
+    assert hits == {
+        "fi测试": (text.index("ﬁ"), text.index("试") + 1),
+        "10平成": (text.index("⑩"), text.index("㍻") + 1),
+        "出售猎枪": (text.index("出"), text.index("槍") + 1),
+    }
+    for word, (start, end) in hits.items():
+        assert preprocessor.normalize_text(text[start:end]) == word
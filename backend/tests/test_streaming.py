@@ -0,0 +1,99 @@
+"""分块流式规则匹配的差分测试：RuleStream（StreamingMatcher）按随机位置切块喂入，
+汇总结果与对全文一次性调用 ThreeStepFilter.detect 一致，跨块的命中（含容噪命中）不丢失、位置不偏移
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+import random
+
+import pytest
+
+# 词表字符集较小，随机文本中容易出现完整的词、带噪声的词和跨块的词
+WORDS = ["敏感词", "法轮功", "测试", "出售猎枪", "敏感", "fi测"]
+WORD_CHARS = "敏感词法轮功测试出售猎枪獵槍"
+OTHER_CHARS = "的是了，。 _-ﬁ①"
+NOISE_CHARS = "aqZ09Ｑ"
+
+
+def random_text(rng, length, noise_ratio):
+    chars = []
+    for _ in range(length):
+        roll = rng.random()
+        if roll < noise_ratio:
+            chars.append(rng.choice(NOISE_CHARS))
+        elif roll < 0.8:
+            chars.append(rng.choice(WORD_CHARS))
+        else:
+            chars.append(rng.choice(OTHER_CHARS))
+    return "".join(chars)
+
+
+def random_chunks(rng, text):
+    """随机切块：混合单字符块、空块与较长的块，使命中跨越块边界"""
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.choice([0, 1, 1, 2, 3, rng.randint(4, 40)])
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def summarize(result):
+    return {
+        "ac_results": sorted(result["ac_results"]),
+        "dfa_results": sorted(result["dfa_results"]),
+        "all_results": sorted(result["all_results"]),
+        "suspicious_segments": sorted(result["suspicious_segments"]),
+        "hits": sorted((h["word"], h["start"], h["end"], h["source"], tuple(h["libraries"])) for h in result["hits"]),
+        "libraries": result["libraries"],
+        "word_count": result["word_count"],
+    }
+
+
+def stream_detect(engine, chunks, libraries=None):
+    stream = engine.stream(libraries)
+    for chunk in chunks:
+        stream.feed(chunk)
+    stream.finish()
+    assert stream.length == sum(map(len, chunks))
+    return stream.result()
+
+
+@pytest.fixture
+def engine(build_engine):
+    return build_engine({"甲": WORDS[:3], "乙": WORDS[3:]})
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("noise_ratio", [0.0, 0.3, 0.6])
+def test_stream_matches_one_shot(engine, seed, noise_ratio):
+    rng = random.Random(seed)
+    text = random_text(rng, rng.randint(0, 300), noise_ratio)
+    libraries = rng.choice([None, ["甲"], ["乙"]])
+    expected = summarize(engine.detect(text, libraries=libraries))
+    for _ in range(3):
+        assert summarize(stream_detect(engine, random_chunks(rng, text), libraries)) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "前面出售獵槍后面",          # 繁体词，逐字切块时每个字都在不同块
+    "出a售b猎c枪，其他内容",      # 只有容噪命中（AC 未命中）
+    "法1轮2功 以及 敏感词",       # 容噪命中出现在 AC 命中之前，最终结果不含容噪命中
+    "ﬁ测试",                     # NFKC 展开的字符位于词首
+])
+def test_boundary_crossing_hits(engine, text):
+    expected = summarize(engine.detect(text))
+    assert expected["hits"]
+    # 在每个位置切一刀，以及逐字符喂入
+    for cut in range(len(text) + 1):
+        assert summarize(stream_detect(engine, [text[:cut], text[cut:]])) == expected
+    assert summarize(stream_detect(engine, list(text))) == expected
+
+
+def test_feed_returns_hits_as_they_are_confirmed(engine):
+    text = "出售獵槍" * 3
+    stream = engine.stream()
+    confirmed = []
+    for ch in text:
+        confirmed.extend(stream.feed(ch))
+    confirmed.extend(stream.finish())
+    assert [(hit["start"], hit["end"]) for hit in confirmed] == [(0, 4), (4, 8), (8, 12)]
@@ -0,0 +1,67 @@
+"""上传大小限制中间件的测试：超过上限的请求体在接收过程中即返回 413，不再读取剩余内容
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+import asyncio
+import json
+
+from document_extractors import UploadSizeLimitMiddleware
+
+CHUNK = b"x" * 1024
+
+
+async def parsing_app(scope, receive, send):
+    """与 FastAPI 解析表单时相同：先读完请求体，解析出错时返回 400"""
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            size += len(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        status, body = 200, json.dumps({"size": size}).encode()
+    except Exception:
+        status, body = 400, b'{"detail": "There was an error parsing the body"}'
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+def run(path, chunks, content_length=None, max_bytes=10 * 1024):
+    """以分块请求体调用中间件，返回 (状态码, 响应体, 已读取的块数)"""
+    app = UploadSizeLimitMiddleware(parsing_app, ("/detect/document",), max_bytes, detail="文件过大")
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    pending = list(chunks)
+    read = 0
+    sent = []
+
+    async def receive():
+        nonlocal read
+        read += 1
+        body = pending.pop(0) if pending else b""
+        return {"type": "http.request", "body": body, "more_body": bool(pending)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    assert [m["type"] for m in sent] == ["http.response.start", "http.response.body"]
+    return sent[0]["status"], json.loads(sent[1]["body"]), read
+
+
+def test_body_within_limit_passes_through():
+    assert run("/detect/document", [CHUNK] * 10) == (200, {"size": 10 * 1024}, 10)
+
+
+def test_streamed_body_over_limit_stops_reading():
+    status, body, read = run("/detect/document", [CHUNK] * 100)
+    assert (status, body) == (413, {"detail": "文件过大"})
+    assert read == 11  # 第 11 块超限后不再读取
+
+
+def test_content_length_over_limit_is_rejected_before_reading():
+    assert run("/detect/document", [CHUNK] * 100, content_length=100 * 1024) == (413, {"detail": "文件过大"}, 0)
+
+
+def test_other_paths_are_not_limited():
+    assert run("/detect/batch", [CHUNK] * 100, content_length=100 * 1024) == (200, {"size": 100 * 1024}, 100)
@@ -0,0 +1,83 @@
+"""上传内存测试：生成的大 txt 上传逐块写入临时文件（spool_upload，分别从内存中的块与 Starlette 已落盘的
+SpooledTemporaryFile 读取）后逐段提取，子进程的峰值常驻内存（VmHWM）增量不随文件大小增长
+
+运行（backend 目录下）：python -m pytest -q tests
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+UPLOAD_MB = 200
+# 峰值内存增量上限：远小于上传大小，只容纳提取段（TXT_SEGMENT_BYTES，默认 1MB）、解码后的文本与读取缓冲
+PEAK_RSS_LIMIT_MB = 48
+
+# 子进程中运行：峰值内存只统计这一次上传，不受测试进程已有内存的影响
+CHILD = r"""
+import asyncio, json, sys, tempfile
+import document_extractors as D
+
+LINE = "今天天气很好，我们一起去公园散步，顺便讨论一下项目的进展情况。\n".encode("utf-8")
+BLOCK = LINE * (1024 * 1024 // len(LINE))
+
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+async def main(mode, upload_mb, spool_dir):
+    base = peak_rss_kb()
+    total = len(BLOCK) * upload_mb
+    if mode == "spool":
+        blocks = iter([BLOCK] * upload_mb)
+
+        async def read(size):
+            return next(blocks, b"")
+    else:
+        # 与 Starlette 的 UploadFile 相同：超过内存缓冲后转为磁盘临时文件，读取在线程中进行
+        upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, dir=spool_dir)
+        for _ in range(upload_mb):
+            upload.write(BLOCK)
+        upload.seek(0)
+
+        async def read(size):
+            return await asyncio.to_thread(upload.read, size)
+
+    path, size = await D.spool_upload(read, total, spool_dir)
+    if mode != "spool":
+        upload.close()
+    chars = 0
+    try:
+        async for text, _, _ in D.DocumentExtractor().iter_pages("txt", path):
+            chars += len(text)
+    finally:
+        D.release_upload(path)
+    print(json.dumps({"size": size, "total": total, "chars": chars,
+                      "expected_chars": len(BLOCK.decode("utf-8")) * upload_mb,
+                      "peak_delta_mb": (peak_rss_kb() - base) / 1024}))
+
+
+asyncio.run(main(sys.argv[1], int(sys.argv[2]), sys.argv[3]))
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="通过 /proc/self/status 读取峰值内存，仅 Linux")
+@pytest.mark.parametrize("mode", ["spool", "starlette"])
+def test_large_upload_peak_rss_is_bounded(mode, tmp_path):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, mode, str(UPLOAD_MB), str(tmp_path)],
+        env=env, capture_output=True, text=True, timeout=300, check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    assert result["size"] == result["total"]
+    assert result["chars"] == result["expected_chars"]
+    assert result["peak_delta_mb"] < PEAK_RSS_LIMIT_MB, result
+    assert not os.listdir(tmp_path)  # 临时文件已删除
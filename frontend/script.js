@@ -196,10 +196,11 @@ function formatTimingInfo(data) {
         `;
     } else {
         // 跳过大模型检测的情况
+        const skipReason = data.detection_flow === 'rule_threshold' ? '规则命中达到阈值' : '规则匹配无敏感词';
         timingHtml += `
             <div class="timing-section">
                 <strong>大模型检测:</strong>
-                <span class="timing-total">跳过 (规则匹配无敏感词)</span>
+                <span class="timing-total">跳过 (${skipReason})</span>
             </div>
         `;
     }
@@ -240,9 +241,9 @@ async function detectDocument(file) {
         return;
     }
     
-    // 检查文件大小 (10MB)
-    if (file.size > 10 * 1024 * 1024) {
-        showNotification('文件大小不能超过 10MB', 'error');
+    // 检查文件大小 (200MB)
+    if (file.size > 200 * 1024 * 1024) {
+        showNotification('文件大小不能超过 200MB', 'error');
         return;
     }
     
@@ -314,7 +315,15 @@ function displayDocumentResult(data, selectedLibraries) {
         document.getElementById('doc-rule-detected').innerHTML = formatDetectionResult(data.rule_detected || []);
     }
     
-    document.getElementById('doc-llm-detected').innerHTML = formatDetectionResult(data.llm_detected);
+    if (data.detection_flow === 'rule_only') {
+        // 规则未命中：跳过大模型检测
+        document.getElementById('doc-llm-detected').innerHTML = '<span class="status-tag status-skipped">跳过</span>';
+    } else if (data.detection_flow === 'rule_threshold') {
+        // 规则命中达到阈值，直接判定为敏感：未调用大模型
+        document.getElementById('doc-llm-detected').innerHTML = '<span class="status-tag status-skipped">跳过（规则阈值判定）</span>';
+    } else {
+        document.getElementById('doc-llm-detected').innerHTML = formatDetectionResult(data.llm_detected);
+    }
     
     // 显示检测用时
     const timingText = formatTimingInfo(data);